@@ -0,0 +1,136 @@
+""" Builds the compiled profiles into artifacts that load without compiling.
+
+Every server process loads the templates and mappings of the profiles, and
+cleans and compiles them, on its own. This command does that once and saves
+every compiled Profile to <output>/<profile>.profile. The ProfileRegistry
+loads a profile from its artifact when the artifact is up to date and falls
+back to the JSON files otherwise.
+
+An artifact is stale when its template or mapping file changed, or when the
+code that compiles profiles, jmespath or Python changed since it was built.
+Artifacts are pickles, so only artifacts built by this command should be
+loaded.
+
+Usage, from the src directory:
+    python -m artifacts --resources-dir resources --output cache/profiles
+"""
+import argparse
+import hashlib
+import importlib.util
+import os
+import pickle
+import sys
+from functools import lru_cache
+
+import jmespath
+
+import settings
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_SUFFIX = ".profile"
+# The modules that compile profiles or whose classes are saved in an
+# artifact. By name, as profiles imports this module.
+COMPILER_MODULES = ("cache", "paths", "plan", "profiles", "utils")
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def compiler_version() -> str:
+    """ Returns a hash of the source of the modules that compile profiles,
+    and of the versions of jmespath, whose parsed expressions are saved in
+    an artifact, and of Python. """
+    digest = hashlib.sha256(str(ARTIFACT_FORMAT).encode())
+    digest.update(f"jmespath {jmespath.__version__}, python "
+                  f"{sys.version_info[:3]}".encode())
+    for name in COMPILER_MODULES:
+        with open(importlib.util.find_spec(name).origin, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def artifact_path(artifact_dir: str, name: str) -> str:
+    return os.path.join(artifact_dir, name + ARTIFACT_SUFFIX)
+
+
+def source_hashes(template_path: str, mapping_path: str) -> dict:
+    return {"compiler": compiler_version(),
+            "template": file_hash(template_path),
+            "mapping": file_hash(mapping_path)}
+
+
+def save_artifact(artifact_dir: str, profile, template_path: str,
+                  mapping_path: str) -> str:
+    """
+    Saves a compiled profile with the hashes of its sources.
+
+    The file is replaced at once, so a server that loads it at the same time
+    never reads half an artifact.
+
+    :return: the path of the artifact.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = artifact_path(artifact_dir, profile.name)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        # The hashes come first, so a stale artifact is rejected without
+        # loading the profile.
+        pickle.dump(source_hashes(template_path, mapping_path), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(profile, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+    return path
+
+
+def load_artifact(artifact_dir: str, name: str, template_path: str,
+                  mapping_path: str):
+    """
+    Returns the compiled profile saved in an artifact, if it is up to date.
+
+    :return: the Profile, or None if there is no artifact, it is stale or it
+        can not be read.
+    """
+    path = artifact_path(artifact_dir, name)
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) != source_hashes(template_path, mapping_path):
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, AttributeError, EOFError, ImportError,
+            IndexError, TypeError, ValueError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("--resources-dir", default=settings.RESOURCES_DIR)
+    parser.add_argument("--output", default=settings.PROFILE_ARTIFACT_DIR,
+                        help="the directory of the artifacts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.output:
+        print("error: no output directory, set --output or "
+              "PROFILE_ARTIFACT_DIR", file=sys.stderr)
+        return 2
+    # profiles loads artifacts, so it is imported when the command runs.
+    from profiles import ProfileRegistry
+
+    registry = ProfileRegistry(args.resources_dir)
+    for path in registry.build_artifacts(args.output):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
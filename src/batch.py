@@ -0,0 +1,82 @@
+import json_codec
+from delta import map_output
+
+
+class BatchError(Exception):
+    """ Raised when a batch can not be read. """
+
+
+async def iter_ndjson_lines(chunks, max_line_size: int):
+    """
+    Yields the non-empty lines of a stream of NDJSON byte chunks.
+
+    Only a single line is kept in memory at a time, so the memory used does
+    not depend on the size of the stream.
+
+    :param chunks: an async iterable of bytes.
+    :param max_line_size: the maximum size of a single line in bytes.
+    :raises BatchError: if a line is larger than max_line_size.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        start = 0
+        end = chunk.find(b"\n")
+        while end != -1:
+            buffer += chunk[start:end]
+            if buffer.strip():
+                yield bytes(buffer)
+            buffer.clear()
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        buffer += chunk[start:]
+        if len(buffer) > max_line_size:
+            raise BatchError(f"NDJSON line exceeds {max_line_size} bytes")
+    if buffer.strip():
+        yield bytes(buffer)
+
+
+def map_batch_result(record, template, mapping, path_stats=None,
+                     delta_format: str = None) -> tuple:
+    """
+    Maps a single record of a batch to its serialized result.
+
+    :param record: the metadata as a JSON object or an NDJSON line.
+    :param template: the template plan.
+    :param mapping: the compiled mapping.
+    :param path_stats: PathStats to record the searches of the paths in.
+    :param delta_format: return a delta of the template in this format.
+    :return: a (result JSON bytes, None) tuple, or (None, error message) if
+        the record fails to map.
+    """
+    try:
+        if isinstance(record, bytes):
+            record = json_codec.loads(record)
+        return json_codec.dumps(map_output(record, template, mapping,
+                                           delta_format,
+                                           path_stats=path_stats)), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def map_batch_record(index: int, record, template, mapping,
+                     path_stats=None, delta_format: str = None) -> bytes:
+    """
+    Maps a single record of a batch to an NDJSON result line.
+
+    A record that fails to map results in an error line instead of an
+    exception, so a single bad record does not end the batch.
+
+    :param index: the position of the record in the batch.
+    :param record: the metadata as a JSON object or an NDJSON line.
+    :param template: the template plan.
+    :param mapping: the compiled mapping.
+    :param path_stats: PathStats to record the searches of the paths in.
+    :param delta_format: return a delta of the template in this format.
+    :return: a JSON line with either a 'result' or an 'error'.
+    """
+    body, error = map_batch_result(record, template, mapping, path_stats,
+                                   delta_format)
+    if error is not None:
+        return json_codec.dumps({"index": index, "error": error}) + b"\n"
+    # The compact JSON of {"index": index, "result": result}.
+    return b'{"index":%d,"result":%s}\n' % (index, body)
@@ -0,0 +1,83 @@
+""" Measures how the mapping time of large multiple compounds grows.
+
+A synthetic record is mapped with an increasing number of authors and
+keywords (basic compounds) and variables (an object to compound field). The
+time per compound entry should stay about the same as the number of entries
+grows, the growth column is the time per entry relative to the smallest size.
+
+Usage, from the src directory:
+    python -m benchmarks.compound_scaling --max-entries 100000
+"""
+import argparse
+import gc
+import time
+
+import utils
+from benchmarks.synthetic import synthetic_case
+from mapper import map_record
+from plan import get_template_plan
+
+DIMENSIONS = ("authors", "keywords", "compounds")
+
+
+def entry_counts(max_entries: int) -> list:
+    """ Returns 1000, 10000, ... up to and including max_entries. """
+    counts = []
+    count = 1000
+    while count < max_entries:
+        counts.append(count)
+        count *= 10
+    counts.append(max_entries)
+    return counts
+
+
+def time_mapping(dimension: str, entries: int, repeat: int) -> float:
+    """ Returns the fastest time of mapping a record with the entries. """
+    metadata, template, mapping = synthetic_case(**{dimension: entries})
+    template_plan = get_template_plan(template)
+    compiled_mapping = utils.get_compiled_mapping(mapping)
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        map_record(metadata, template_plan, compiled_mapping)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_scaling(dimension: str, counts: list, repeat: int = 3) -> list:
+    """
+    Returns the mapping time of every number of entries of a dimension.
+
+    :return: list of (entries, seconds, microseconds per entry, growth)
+        tuples. The growth is the time per entry relative to the first count.
+    """
+    rows = []
+    for entries in counts:
+        seconds = time_mapping(dimension, entries, repeat)
+        per_entry = seconds / entries * 1e6
+        growth = per_entry / rows[0][2] if rows else 1.0
+        rows.append((entries, seconds, per_entry, growth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-entries", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dimensions", nargs="*", default=DIMENSIONS,
+                        choices=DIMENSIONS)
+    args = parser.parse_args()
+
+    counts = entry_counts(args.max_entries)
+    print(f"{'dimension':<12}{'entries':>10}{'seconds':>10}"
+          f"{'us/entry':>10}{'growth':>8}")
+    for dimension in args.dimensions:
+        for entries, seconds, per_entry, growth in measure_scaling(
+                dimension, counts, args.repeat):
+            print(f"{dimension:<12}{entries:>10}{seconds:>10.3f}"
+                  f"{per_entry:>10.2f}{growth:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
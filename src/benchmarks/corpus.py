@@ -0,0 +1,75 @@
+import json
+import os
+
+# The fixtures of the tests: (name, metadata, template, mapping).
+FIXTURES = [
+    ("liss-child",
+     "test-data/input-data/liss-child-metadata.json",
+     "resources/templates/liss_dataverse_template.json",
+     "resources/mappings/liss-mapping.json"),
+    ("liss-parent",
+     "test-data/input-data/liss-parent-metadata.json",
+     "resources/templates/liss_dataverse_template.json",
+     "resources/mappings/liss-mapping.json"),
+    ("liss-old",
+     "test-data/input-data/liss-test-metadata.json",
+     "test-data/test-templates/liss_old_dataverse_template.json",
+     "test-data/test-mappings/liss-old-mapping.json"),
+    ("cbs",
+     "test-data/input-data/cbs-test-metadata.json",
+     "resources/templates/cbs_dataverse_template.json",
+     "resources/mappings/cbs-mapping.json"),
+    ("cid",
+     "test-data/input-data/cid-test-metadata.json",
+     "resources/templates/cid_dataverse_template.json",
+     "resources/mappings/cid-mapping.json"),
+    ("cid-2",
+     "test-data/input-data/cid-test-metadata-2.json",
+     "resources/templates/cid_dataverse_template.json",
+     "resources/mappings/cid-mapping.json"),
+    ("ssh",
+     "test-data/input-data/ssh-test-metadata.json",
+     "resources/templates/ssh_dataverse_template.json",
+     "resources/mappings/ssh-mapping.json"),
+    ("ssh-additional",
+     "test-data/input-data/ssh-test-input-metadata.json",
+     "resources/templates/ssh_dataverse_template.json",
+     "resources/mappings/ssh-mapping.json"),
+    ("ssh-coverage",
+     "test-data/input-data/ssh-coverage-input-metadata.json",
+     "resources/templates/ssh_dataverse_template.json",
+     "resources/mappings/ssh-mapping.json"),
+    ("ssh-alt-title",
+     "test-data/input-data/ssh-alt-title-metadata.json",
+     "resources/templates/ssh_dataverse_template.json",
+     "resources/mappings/ssh-mapping.json"),
+    ("easy",
+     "test-data/input-data/easy-test-metadata.json",
+     "test-data/test-templates/easy_dataverse_template.json",
+     "test-data/test-mappings/easy-mapping.json"),
+]
+
+
+def open_json_file(json_path):
+    with open(json_path) as f:
+        return json.load(f)
+
+
+def load_corpus(names=None):
+    """
+    Returns the fixtures that are available on disk.
+
+    Fixtures that use the src/resources submodule are skipped when it has
+    not been checked out.
+
+    :param names: only return the fixtures with these names.
+    :return: list of (name, metadata, template, mapping) tuples.
+    """
+    corpus = []
+    for name, *paths in FIXTURES:
+        if names and name not in names:
+            continue
+        if not all(os.path.isfile(path) for path in paths):
+            continue
+        corpus.append((name, *(open_json_file(path) for path in paths)))
+    return corpus
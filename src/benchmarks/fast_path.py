@@ -0,0 +1,58 @@
+""" Compares the latency of /mapper with the raw-bytes /mapper/raw path.
+
+Every fixture of the corpus is posted to both end-points in-process, so the
+times include parsing, validation, mapping and serializing the response.
+
+Usage, from the src directory:
+    python -m benchmarks.fast_path --requests 200
+"""
+import argparse
+import json
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+import json_codec
+from benchmarks.corpus import load_corpus
+from main import app
+
+
+def time_requests(client, url: str, body: bytes, requests: int) -> list:
+    """ Returns the latency of every request in milliseconds. """
+    headers = {"Content-Type": "application/json"}
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.post(url, content=body, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--fixtures", nargs="*")
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    codec = "orjson" if json_codec.orjson is not None else "json"
+    print(f"codec: {codec}")
+    print(f"{'fixture':<16}{'/mapper ms':>12}{'/mapper/raw ms':>16}"
+          f"{'speedup':>9}")
+    for name, metadata, template, mapping in load_corpus(args.fixtures):
+        body = json.dumps({"metadata": metadata, "template": template,
+                           "mapping": mapping}).encode("utf-8")
+        # Warm up the mapping and template caches of both paths.
+        time_requests(client, "/mapper", body, 1)
+        time_requests(client, "/mapper/raw", body, 1)
+        model = statistics.median(
+            time_requests(client, "/mapper", body, args.requests))
+        raw = statistics.median(
+            time_requests(client, "/mapper/raw", body, args.requests))
+        print(f"{name:<16}{model:>12.3f}{raw:>16.3f}{model / raw:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+""" Load tests the service with the fixture corpus at set concurrency levels.
+
+The request bodies are built from the fixtures of the corpus and posted to
+/mapper or /mapper/raw, in turn, by a number of concurrent clients. By
+default the FastAPI app is driven in-process through httpx's ASGI transport.
+With --url a running server is tested instead, for example one started with
+'uvicorn main:app --port 7070 --workers 4'.
+
+Without --rate every client sends its next request when the previous one is
+answered. With --rate the requests are started at a fixed rate, spread over
+the clients, and the latency is measured from the time a request should have
+started, so a server that falls behind is not hidden by a slower client.
+
+The app in-process is started and stopped with its lifespan, like a server
+does, and every run waits until /ready answers 200, so the warm-up of the
+profiles is part of the test.
+
+Every level reports the throughput, the latency percentiles, the error rate
+and the CPU and memory used by the server: the benchmark process itself when
+the app runs in-process, or the processes given with --server-pid (Linux).
+The peak memory is reset at the start of every level where the system allows
+it (Linux), otherwise it is the peak since the server started and the level
+is marked with peak_memory_cumulative.
+The report has the same layout as the one of benchmarks.suite, so it can be
+compared with --compare.
+
+Usage, from the src directory:
+    python -m benchmarks.load --concurrency 1 8 32 --duration 10
+    python -m benchmarks.load --url http://localhost:7070 --server-pid 1234 \\
+        --concurrency 16 --rate 200 --output load.json
+    python -m benchmarks.load --compare load.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from benchmarks.corpus import load_corpus
+from benchmarks.suite import compare, environment, significant
+
+ENDPOINTS = ("mapper", "raw")
+
+
+def request_bodies(endpoint: str, fixtures=None) -> list:
+    """
+    Returns the (fixture name, path, body) of every request of the corpus.
+
+    :param endpoint: 'mapper' for /mapper or 'raw' for /mapper/raw.
+    :param fixtures: only use the fixtures with these names.
+    """
+    path = "/mapper" if endpoint == "mapper" else "/mapper/raw"
+    return [(name, path, json.dumps({"metadata": metadata,
+                                     "template": template,
+                                     "mapping": mapping}).encode("utf-8"))
+            for name, metadata, template, mapping in load_corpus(fixtures)]
+
+
+class ProcessUsage:
+    """ Measures the CPU time and memory of the server processes.
+
+    Attributes
+    ----------
+    pids:
+        The processes of the server, or an empty list for the benchmark
+        process itself.
+    peak_reset:
+        True if the peak memory was reset at the start, so it is the peak of
+        the measurement instead of the one since the processes started.
+    """
+
+    def __init__(self, pids: list):
+        self.pids = pids
+        self.start_cpu = 0.0
+        self.start_time = 0.0
+        self.peak_reset = False
+
+    def cpu_seconds(self) -> float:
+        if not self.pids:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_utime + usage.ru_stime
+        ticks = os.sysconf("SC_CLK_TCK")
+        total = 0
+        for pid in self.pids:
+            with open(f"/proc/{pid}/stat") as f:
+                # The fields after the command name, which may have spaces.
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        return total / ticks
+
+    def memory_bytes(self) -> int:
+        """ Returns the peak resident memory of the processes. """
+        if not self.pids:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS bytes.
+            return peak if sys.platform == "darwin" else peak * 1024
+        total = 0
+        for pid in self.pids:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        return total
+
+    def reset_peak(self) -> bool:
+        """ Resets the peak resident memory of the processes (Linux).
+
+        :return: False if the peak could not be reset.
+        """
+        try:
+            for pid in self.pids or ["self"]:
+                with open(f"/proc/{pid}/clear_refs", "w") as f:
+                    f.write("5")
+        except OSError:
+            return False
+        return True
+
+    def start(self):
+        self.peak_reset = self.reset_peak()
+        self.start_cpu = self.cpu_seconds()
+        self.start_time = time.perf_counter()
+
+    def stop(self) -> dict:
+        elapsed = time.perf_counter() - self.start_time
+        cpu = self.cpu_seconds() - self.start_cpu
+        return {"cpu_percent": significant(cpu / elapsed * 100),
+                "peak_memory_bytes": self.memory_bytes(),
+                "peak_memory_cumulative": not self.peak_reset}
+
+
+async def run_level(client, requests: list, concurrency: int,
+                    duration: float, max_requests: int,
+                    rate: float) -> dict:
+    """
+    Sends the requests in turn with a number of concurrent clients.
+
+    :param client: the httpx.AsyncClient to send the requests with.
+    :param requests: the (name, path, body) of the requests of the corpus.
+    :param concurrency: the number of requests sent at the same time.
+    :param duration: stop starting requests after this many seconds.
+    :param max_requests: stop after this many requests, 0 for no limit.
+    :param rate: the number of requests started per second, 0 to send the
+        next request as soon as a client is free.
+    :return: the measurements of the level.
+    """
+    corpus = itertools.cycle(requests)
+    counter = itertools.count()
+    latencies = []
+    statuses = {}
+    errors = 0
+    headers = {"Content-Type": "application/json"}
+    start = time.perf_counter()
+
+    async def client_loop():
+        nonlocal errors
+        while True:
+            index = next(counter)
+            if max_requests and index >= max_requests:
+                return
+            scheduled = start + index / rate if rate else \
+                time.perf_counter()
+            if scheduled - start >= duration:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            _, path, body = next(corpus)
+            try:
+                response = await client.post(path, content=body,
+                                             headers=headers)
+                status = str(response.status_code)
+                failed = response.status_code >= 400
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+                failed = True
+            latencies.append(time.perf_counter() - scheduled)
+            statuses[status] = statuses.get(status, 0) + 1
+            errors += failed
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100,
+                                           method="inclusive")
+    else:
+        percentiles = latencies * 99 or [0.0] * 99
+    return {
+        "requests": len(latencies),
+        "requests_per_second": significant(len(latencies) / elapsed),
+        "latency_ms_p50": significant(percentiles[49] * 1000),
+        "latency_ms_p95": significant(percentiles[94] * 1000),
+        "latency_ms_p99": significant(percentiles[98] * 1000),
+        "latency_ms_max": significant(max(latencies, default=0.0) * 1000),
+        "error_rate": significant(errors / len(latencies))
+        if latencies else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def create_client(url: str, concurrency: int) -> httpx.AsyncClient:
+    """ Returns a client for the server at url, or for the app in-process.
+    """
+    timeout = httpx.Timeout(60.0)
+    if url:
+        limits = httpx.Limits(max_connections=concurrency,
+                              max_keepalive_connections=concurrency)
+        return httpx.AsyncClient(base_url=url, limits=limits,
+                                 timeout=timeout)
+    from main import app
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                             base_url="http://load", timeout=timeout)
+
+
+async def wait_until_ready(url: str, timeout: float):
+    """
+    Waits until GET /ready answers 200.
+
+    :raises TimeoutError: if the server is not ready after timeout seconds.
+    """
+    deadline = time.perf_counter() + timeout
+    async with create_client(url, 1) as client:
+        while True:
+            try:
+                response = await client.get("/ready")
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"the server was not ready after "
+                                   f"{timeout:g} seconds")
+            await asyncio.sleep(0.1)
+
+
+@asynccontextmanager
+async def serve(url: str, ready_timeout: float = 60.0):
+    """
+    Runs the lifespan of the app when it runs in-process, as a server does,
+    and waits until the server is ready.
+
+    httpx's ASGI transport only sends requests, so without the lifespan the
+    profiles are not warmed up and the mapping workers are not started.
+    """
+    if url:
+        await wait_until_ready(url, ready_timeout)
+        yield
+        return
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        await wait_until_ready(url, ready_timeout)
+        yield
+
+
+async def run_load(args, requests: list) -> dict:
+    """ Starts the server and runs every concurrency level. """
+    async with serve(args.url, args.ready_timeout):
+        return await run_levels(args, requests)
+
+
+async def run_levels(args, requests: list) -> dict:
+    """ Runs every concurrency level and returns the report. """
+    usage = ProcessUsage(args.server_pid)
+    cases = {}
+    print(f"{'level':<16}{'requests/s':>12}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'errors':>8}{'cpu %':>8}{'peak MiB':>10}")
+    for concurrency in args.concurrency:
+        async with create_client(args.url, concurrency) as client:
+            # Warm up the caches of the server with every request once.
+            await run_level(client, requests, 1, float("inf"),
+                            len(requests), 0)
+            usage.start()
+            case = await run_level(client, requests, concurrency,
+                                   args.duration, args.requests, args.rate)
+            case.update(usage.stop())
+        name = f"c{concurrency}" + (f"-r{args.rate:g}" if args.rate else "")
+        cases[name] = case
+        print(f"{name:<16}{case['requests_per_second']:>12.1f}"
+              f"{case['latency_ms_p50']:>10.3f}"
+              f"{case['latency_ms_p95']:>10.3f}"
+              f"{case['latency_ms_p99']:>10.3f}"
+              f"{case['error_rate']:>8.1%}{case['cpu_percent']:>8.0f}"
+              f"{case['peak_memory_bytes'] / 2 ** 20:>10.1f}"
+              + ("  (cumulative)" if case["peak_memory_cumulative"] else ""))
+    return cases
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("--url", help="test a running server instead of the "
+                                      "app in-process")
+    parser.add_argument("--server-pid", type=int, nargs="*", default=[],
+                        help="the processes of the server to measure")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="raw")
+    parser.add_argument("--fixtures", nargs="*",
+                        help="only send these fixtures")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--rate", type=float, default=0,
+                        help="requests started per second, 0 for no limit")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds per concurrency level")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="maximum requests per level, 0 for no limit")
+    parser.add_argument("--ready-timeout", type=float, default=60.0,
+                        help="seconds to wait until the server is ready")
+    parser.add_argument("--output", help="save the report to this file")
+    parser.add_argument("--compare", help="compare with a saved report")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    requests = request_bodies(args.endpoint, args.fixtures)
+    if not requests:
+        print("error: no fixtures found", file=sys.stderr)
+        return 2
+
+    try:
+        cases = asyncio.run(run_load(args, requests))
+    except TimeoutError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    report = {
+        "environment": environment(),
+        "config": {"url": args.url or "in-process",
+                   "endpoint": args.endpoint,
+                   "fixtures": [name for name, _, _ in requests],
+                   "duration": args.duration, "rate": args.rate},
+        "cases": cases,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
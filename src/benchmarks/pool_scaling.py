@@ -0,0 +1,64 @@
+""" Measures the throughput of MappingPool for 1 up to N worker processes.
+
+Every fixture of the corpus is mapped as a batch of identical records, first
+in a single process and then with an increasing number of workers.
+
+Usage, from the src directory:
+    python -m benchmarks.pool_scaling --records 2000 --max-workers 8
+"""
+import argparse
+import os
+import time
+
+import utils
+from batch import map_batch_record
+from benchmarks.corpus import load_corpus
+from plan import get_template_plan
+from pool import MappingPool
+
+
+def time_in_process(metadata, template, mapping, records: int) -> float:
+    template_plan = get_template_plan(template)
+    compiled_mapping = utils.get_compiled_mapping(mapping)
+    start = time.perf_counter()
+    for index in range(records):
+        map_batch_record(index, metadata, template_plan, compiled_mapping)
+    return time.perf_counter() - start
+
+
+def time_pool(metadata, template, mapping, records: int, workers: int,
+              chunk_size: int) -> float:
+    with MappingPool(template, mapping, workers, chunk_size) as pool:
+        # Start the workers before the clock starts.
+        list(pool.map([metadata] * workers))
+        start = time.perf_counter()
+        for _ in pool.map(metadata for _ in range(records)):
+            pass
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--fixtures", nargs="*")
+    args = parser.parse_args()
+
+    worker_counts = sorted({1, *range(2, args.max_workers + 1, 2),
+                            args.max_workers})
+    print(f"{'fixture':<16}{'workers':>8}{'records/s':>12}{'speedup':>9}")
+    for name, metadata, template, mapping in load_corpus(args.fixtures):
+        elapsed = time_in_process(metadata, template, mapping, args.records)
+        baseline = args.records / elapsed
+        print(f"{name:<16}{'-':>8}{baseline:>12.1f}{1:>9.2f}")
+        for workers in worker_counts:
+            elapsed = time_pool(metadata, template, mapping, args.records,
+                                workers, args.chunk_size)
+            throughput = args.records / elapsed
+            print(f"{name:<16}{workers:>8}{throughput:>12.1f}"
+                  f"{throughput / baseline:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+""" Measures the mapper on the fixture corpus and on synthetic records.
+
+For every case the record is mapped the way the end-points map it, by
+map_record, which fills out the template and prunes the empty fields in a
+single pass. The suite reports the throughput, the latency percentiles of a
+single record and the peak memory allocated while mapping a record.
+
+The results can be saved as JSON, with sorted keys and one case per key, so
+the results of two versions can be diffed or compared with --compare.
+
+Usage, from the src directory:
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --compare before.json --threshold 0.1
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import json_codec
+import utils
+from benchmarks.corpus import load_corpus
+from benchmarks.synthetic import SCALES, synthetic_corpus
+from mapper import map_record
+from plan import get_template_plan
+
+
+def significant(value: float, digits: int = 4) -> float:
+    """ Rounds a measurement, so the saved results are easy to diff. """
+    return float(f"{value:.{digits}g}")
+
+
+def measure_case(metadata, template, mapping, min_time: float,
+                 min_records: int, max_records: int) -> dict:
+    """
+    Maps a record repeatedly and returns its measurements.
+
+    The template and mapping are compiled before the measurements start, as
+    they are by the caches of a running service.
+    """
+    template_plan = get_template_plan(template)
+    compiled_mapping = utils.get_compiled_mapping(mapping)
+    map_record(metadata, template_plan, compiled_mapping)
+
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_records and (
+            len(latencies) < min_records or
+            time.perf_counter() - start < min_time):
+        record_start = time.perf_counter()
+        map_record(metadata, template_plan, compiled_mapping)
+        latencies.append(time.perf_counter() - record_start)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    map_record(metadata, template_plan, compiled_mapping)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "records": len(latencies),
+        "records_per_second": significant(len(latencies) / elapsed),
+        "latency_ms_p50": significant(percentiles[49] * 1000),
+        "latency_ms_p90": significant(percentiles[89] * 1000),
+        "latency_ms_p99": significant(percentiles[98] * 1000),
+        "latency_ms_max": significant(max(latencies) * 1000),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "json_codec": "orjson" if json_codec.orjson is not None else "json",
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints the change of every case relative to a baseline.
+
+    :param threshold: the relative change of the median latency that is
+        reported as a regression, for example 0.1 for 10%.
+    :return: the names of the cases that regressed.
+    """
+    regressions = []
+    print(f"\n{'case':<24}{'p50 before':>12}{'p50 after':>12}{'change':>9}")
+    for name, case in results["cases"].items():
+        before = baseline["cases"].get(name)
+        if before is None:
+            continue
+        change = case["latency_ms_p50"] / before["latency_ms_p50"] - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:<24}{before['latency_ms_p50']:>12.4g}"
+              f"{case['latency_ms_p50']:>12.4g}{change:>+9.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", nargs="*",
+                        help="only run these fixtures")
+    parser.add_argument("--dimensions", nargs="*", choices=list(SCALES),
+                        help="only scale these synthetic dimensions")
+    parser.add_argument("--no-fixtures", action="store_true")
+    parser.add_argument("--no-synthetic", action="store_true")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="minimum seconds per case")
+    parser.add_argument("--min-records", type=int, default=5)
+    parser.add_argument("--max-records", type=int, default=10000)
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--compare", help="compare with saved results")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    corpus = []
+    if not args.no_fixtures:
+        corpus += load_corpus(args.fixtures)
+    if not args.no_synthetic:
+        corpus += synthetic_corpus(args.dimensions)
+
+    results = {"environment": environment(), "cases": {}}
+    print(f"{'case':<24}{'records/s':>12}{'p50 ms':>10}{'p90 ms':>10}"
+          f"{'p99 ms':>10}{'peak MiB':>10}")
+    for name, metadata, template, mapping in corpus:
+        case = measure_case(metadata, template, mapping, args.min_time,
+                            args.min_records, args.max_records)
+        results["cases"][name] = case
+        print(f"{name:<24}{case['records_per_second']:>12.1f}"
+              f"{case['latency_ms_p50']:>10.3f}"
+              f"{case['latency_ms_p90']:>10.3f}"
+              f"{case['latency_ms_p99']:>10.3f}"
+              f"{case['peak_memory_bytes'] / 2 ** 20:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+""" Synthetic records that scale one dimension of the mapping work.
+
+Every case uses the same small template and mapping with a primitive title
+and description, two basic compounds (author and keyword) and an object to
+compound field (variable). The metadata can be scaled in the number of
+authors, keywords and variables, in the depth at which the record is nested
+and in the size of the description.
+"""
+
+
+def primitive(type_name: str, multiple: bool = False) -> dict:
+    return {"typeName": type_name, "multiple": multiple,
+            "typeClass": "primitive", "value": [] if multiple else ""}
+
+
+def compound(type_name: str, children: list) -> dict:
+    return {"typeName": type_name, "multiple": True, "typeClass": "compound",
+            "value": [{child: primitive(child) for child in children}]}
+
+
+def synthetic_template() -> dict:
+    return {
+        "datasetVersion": {
+            "datasetPersistentId": "",
+            "metadataBlocks": {
+                "citation": {
+                    "fields": [
+                        primitive("title"),
+                        primitive("dsDescriptionValue"),
+                        compound("author", ["authorName",
+                                            "authorAffiliation"]),
+                        compound("keyword", ["keywordValue"]),
+                        compound("variable", ["variableName",
+                                              "variableLabel"]),
+                    ]
+                }
+            }
+        }
+    }
+
+
+def synthetic_mapping(depth: int) -> dict:
+    prefix = ".".join(f"level{level}" for level in range(depth))
+    return {
+        "datasetPersistentId": [f"{prefix}.id"],
+        "title": [f"{prefix}.title"],
+        "dsDescriptionValue": [f"{prefix}.description"],
+        "authorName": [f"{prefix}.authors[*].name"],
+        "authorAffiliation": [f"{prefix}.authors[*].affiliation"],
+        "keywordValue": [f"{prefix}.keywords[*]"],
+        "variable": {
+            "mapping": f"{prefix}.variables[*]",
+            "children": {
+                "variableName": ["name"],
+                "variableLabel": ["label.text"],
+            }
+        },
+    }
+
+
+def synthetic_metadata(authors: int, keywords: int, compounds: int,
+                       depth: int, size: int) -> dict:
+    record = {
+        "id": "doi:10.0000/synthetic",
+        "title": "Synthetic record",
+        "description": "x" * size,
+        "authors": [{"name": f"Author {index}",
+                     "affiliation": f"Affiliation {index}"}
+                    for index in range(authors)],
+        "keywords": [f"keyword {index}" for index in range(keywords)],
+        "variables": [{"name": f"var{index}",
+                       "label": {"text": f"Variable {index}"}}
+                      for index in range(compounds)],
+    }
+    for level in reversed(range(depth)):
+        record = {f"level{level}": record}
+    return record
+
+
+def synthetic_case(authors: int = 1, keywords: int = 1, compounds: int = 1,
+                   depth: int = 1, size: int = 0):
+    """
+    Returns a synthetic record with its template and mapping.
+
+    :param authors: the number of authors.
+    :param keywords: the number of keywords.
+    :param compounds: the number of objects mapped to the variable compound.
+    :param depth: the number of objects the record is nested in, at least 1.
+    :param size: the length of the description in characters.
+    :return: a (metadata, template, mapping) tuple.
+    """
+    return (synthetic_metadata(authors, keywords, compounds, depth, size),
+            synthetic_template(), synthetic_mapping(depth))
+
+
+# The values every dimension is scaled to, the others keep their default.
+SCALES = {
+    "authors": (10, 100, 1000, 10000),
+    "keywords": (10, 100, 1000, 10000),
+    "compounds": (10, 100, 1000, 10000),
+    "depth": (1, 8, 32, 128),
+    "size": (1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024),
+}
+
+
+def synthetic_corpus(dimensions=None):
+    """
+    Returns a synthetic case for every value of every scaled dimension.
+
+    :param dimensions: only scale these dimensions.
+    :return: list of (name, metadata, template, mapping) tuples.
+    """
+    corpus = []
+    for dimension, values in SCALES.items():
+        if dimensions and dimension not in dimensions:
+            continue
+        for value in values:
+            corpus.append((f"{dimension}-{value}",
+                           *synthetic_case(**{dimension: value})))
+    return corpus
@@ -0,0 +1,610 @@
+""" Maps harvested records in bulk, without the HTTP service.
+
+The records are read from a directory of JSON files, a glob of JSON files or
+an NDJSON file, and mapped with a profile or with a template and mapping on
+all cores. The results are written to a directory, one JSON file per record,
+or to an NDJSON file. A checkpoint file records how many records are done,
+and the key of the last one, so an interrupted run continues where it stopped
+when it is started again with the same template and mapping.
+With --stream the records are mapped in a single process and every result is
+written while it is mapped, so a result is never in memory as a whole.
+With --deliver every result is also sent to the import API of a Dataverse
+collection while the next records are mapped, and the status of every
+delivery is written to an NDJSON report. A resumed run does not send the
+records again that the report has as delivered.
+
+Usage, from the src directory:
+    python -m bulk harvest/ --profile cbs --output mapped/
+    python -m bulk records.ndjson --template template.json \\
+        --mapping mapping.json --output mapped.ndjson
+    python -m bulk harvest/ --profile cbs --output mapped/ --deliver \\
+        --dataverse-url https://dataverse.example.org --collection cbs
+"""
+import argparse
+import bisect
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import json_codec
+import settings
+import utils
+from batch import map_batch_result
+from json_writer import iter_record_json
+from pathstats import PATH_STATS, PathStats, mapping_label
+from plan import get_template_plan
+from pool import MappingPool, map_chunk_results
+from profiles import ProfileRegistry
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+ERRORS_FILE = "errors.ndjson"
+
+
+class BulkError(Exception):
+    """ Raised when a bulk run can not start. """
+
+
+def is_ndjson(path: str) -> bool:
+    return path.endswith(NDJSON_SUFFIXES)
+
+
+def find_record_files(source: str) -> list:
+    """
+    Returns the JSON files of a directory or glob, with the key of each file.
+
+    The key of a file is its path relative to the directory, or to the part
+    of the glob before the first wildcard, without the '.json' suffix.
+
+    :param source: a directory or a glob pattern.
+    :return: a list of (key, path) tuples, sorted by key.
+    """
+    if os.path.isdir(source):
+        base = source
+        paths = glob.glob(os.path.join(source, "**", "*.json"),
+                          recursive=True)
+    else:
+        wildcard = min((source.find(character) for character in "*?["
+                        if character in source), default=len(source))
+        base = os.path.dirname(source[:wildcard])
+        paths = glob.glob(source, recursive=True)
+
+    files = []
+    for path in paths:
+        key = os.path.relpath(path, base)
+        if key.endswith(".json"):
+            key = key[:-len(".json")]
+        files.append((key, path))
+    return sorted(files)
+
+
+def iter_file_records(files: list, start: int):
+    """ Yields the (key, JSON bytes) of the files, from index start on. """
+    for key, path in files[start:]:
+        with open(path, "rb") as f:
+            yield key, f.read()
+
+
+def iter_ndjson_records(path: str, start: int):
+    """ Yields the (line number, line) of the non-empty lines of a file,
+    skipping the first start records. """
+    with open(path, "rb") as f:
+        index = 0
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            if index >= start:
+                yield line_number, line
+            index += 1
+
+
+class NDJSONWriter:
+    """ Writes lines to a file that is truncated to the last checkpoint.
+
+    Attributes
+    ----------
+    path:
+        The path of the NDJSON file.
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.file = open(path, "r+b" if os.path.exists(path) else "wb")
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def write_line(self, line: bytes):
+        self.file.write(line)
+
+    def flush(self):
+        """ Passes the lines to the operating system, so they are kept when
+        the process is stopped before the next checkpoint. """
+        self.file.flush()
+
+    def sync(self) -> int:
+        """ Writes the lines to disk and returns the size of the file. """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def error_line(key, error: str) -> bytes:
+    return json_codec.dumps({"id": key, "error": error}) + b"\n"
+
+
+def error_message(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+class NDJSONSink(NDJSONWriter):
+    """ Writes every result as a line {"id": ..., "result": {...}}. Records
+    that fail are written as {"id": ..., "error": "..."}. """
+
+    def write(self, key, result: bytes, error: str):
+        if result is None:
+            self.write_line(error_line(key, error))
+        else:
+            self.write_line(b'{"id":' + json_codec.dumps(key) +
+                            b',"result":' + result + b'}\n')
+
+    def write_chunks(self, key, chunks):
+        """ Writes a result while it is mapped. When mapping fails the part
+        that was written is removed and an error line is written instead.
+
+        :return: the error message, or None.
+        """
+        start = self.file.tell()
+        try:
+            self.write_line(b'{"id":' + json_codec.dumps(key) +
+                            b',"result":')
+            for chunk in chunks:
+                self.write_line(chunk)
+            self.write_line(b'}\n')
+        except Exception as e:
+            self.file.seek(start)
+            self.file.truncate()
+            error = error_message(e)
+            self.write_line(error_line(key, error))
+            return error
+        return None
+
+
+class DirectorySink:
+    """ Writes every result to <directory>/<key>.json. Records that fail are
+    written to the errors.ndjson file in the directory.
+
+    Attributes
+    ----------
+    directory:
+        The output directory.
+    """
+
+    def __init__(self, directory: str, offset: int = 0):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.errors = NDJSONWriter(os.path.join(directory, ERRORS_FILE),
+                                   offset)
+
+    def write(self, key, result: bytes, error: str):
+        if result is None:
+            self.errors.write_line(error_line(key, error))
+            return
+        with open(self._result_path(key), "wb") as f:
+            f.write(result)
+
+    def write_chunks(self, key, chunks):
+        """ Writes a result while it is mapped, to a temporary file that
+        replaces the result file when mapping succeeds.
+
+        :return: the error message, or None.
+        """
+        path = self._result_path(key)
+        temporary_path = path + ".tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except Exception as e:
+            os.remove(temporary_path)
+            error = error_message(e)
+            self.errors.write_line(error_line(key, error))
+            return error
+        os.replace(temporary_path, path)
+        return None
+
+    def _result_path(self, key) -> str:
+        path = os.path.join(self.directory, f"{key}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def sync(self) -> int:
+        return self.errors.sync()
+
+    def close(self):
+        self.errors.close()
+
+
+class Checkpoint:
+    """ The progress of a bulk run, saved in a JSON file.
+
+    Attributes
+    ----------
+    path:
+        The path of the checkpoint file.
+    run:
+        The input, output, template digest and mapping digest of the run. A
+        checkpoint of a different run is not used.
+    done:
+        The number of records that are mapped and written.
+    last_key:
+        The key of the last record that is mapped and written. A run over
+        files resumes after it, so files added since do not move it.
+    failed:
+        The number of those records that failed to map.
+    offset:
+        The size of the NDJSON output or errors file at the checkpoint.
+    delivery_offset:
+        The size of the delivery report at the checkpoint.
+    """
+
+    def __init__(self, path: str, run: dict):
+        self.path = path
+        self.run = run
+        self.done = 0
+        self.last_key = None
+        self.failed = 0
+        self.offset = 0
+        self.delivery_offset = 0
+
+    def load(self) -> bool:
+        """ Loads the checkpoint if it exists, returns True if it did.
+
+        :raises BulkError: if the checkpoint is of a different run.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state["run"] != self.run:
+            raise BulkError(f"The checkpoint {self.path} is of another run: "
+                            f"{state['run']}")
+        self.done = state["done"]
+        self.last_key = state.get("last_key")
+        self.failed = state["failed"]
+        self.offset = state["offset"]
+        self.delivery_offset = state.get("delivery_offset", 0)
+        return True
+
+    def save(self):
+        """ Replaces the checkpoint file, so it is never half written. """
+        state = {"run": self.run, "done": self.done,
+                 "last_key": self.last_key, "failed": self.failed,
+                 "offset": self.offset,
+                 "delivery_offset": self.delivery_offset}
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary_path, self.path)
+
+
+def load_source(args) -> tuple:
+    """ Returns the template plan, compiled mapping and stats label. """
+    if args.profile:
+        try:
+            profile = ProfileRegistry(
+                args.resources_dir,
+                settings.PROFILE_ARTIFACT_DIR).get(args.profile)
+        except KeyError:
+            raise BulkError(f"Unknown mapping profile: {args.profile}")
+        return profile.plan, profile.mapping, args.profile
+    if not (args.template and args.mapping):
+        raise BulkError("Use --profile or --template and --mapping")
+    with open(args.template) as f:
+        template = get_template_plan(json.load(f))
+    with open(args.mapping) as f:
+        mapping = utils.get_compiled_mapping(json.load(f))
+    return template, mapping, mapping_label(mapping)
+
+
+def map_records(records, template, mapping, workers: int, chunk_size: int,
+                start: int, stats_label: str):
+    """
+    Maps (key, record) tuples in order and yields (key, result, error).
+
+    With more than one worker the records are mapped by a MappingPool.
+    """
+    if workers <= 1:
+        path_stats = PathStats(stats_label) if stats_label else None
+        try:
+            for key, record in records:
+                yield (key, *map_batch_result(record, template, mapping,
+                                              path_stats))
+        finally:
+            if path_stats is not None:
+                PATH_STATS.merge(path_stats)
+        return
+
+    keys = deque()
+
+    def record_values():
+        for key, record in records:
+            keys.append(key)
+            yield record
+
+    with MappingPool(template, mapping, workers, chunk_size,
+                     stats_label) as pool:
+        for _, result, error in pool.map(record_values(), start,
+                                         map_chunk_results):
+            yield keys.popleft(), result, error
+
+
+def write_records(results, sink):
+    """ Writes the (key, result, error) tuples and yields (key, error). """
+    for key, result, error in results:
+        sink.write(key, result, error)
+        yield key, error
+
+
+def read_delivered(path: str, offset: int) -> dict:
+    """
+    Returns the statuses of the delivered records in a delivery report
+    after the offset of the checkpoint, by key.
+
+    These records were delivered after the last checkpoint of an
+    interrupted run, so they are not sent again when it is resumed.
+    """
+    delivered = {}
+    if not os.path.exists(path):
+        return delivered
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                status = json_codec.loads(line)
+            except ValueError:
+                # The last line may be cut off when the run was stopped.
+                continue
+            if status.get("status") == "delivered":
+                delivered[status["id"]] = status
+    return delivered
+
+
+def deliver_records(results, delivery, report: NDJSONWriter, counts: dict,
+                    delivered: dict = None):
+    """
+    Delivers the (key, result, error) tuples of mapped records and writes
+    the status of every record to the report.
+
+    A record that is mapped but not delivered is passed on with the error
+    of the delivery, so it counts as failed.
+
+    :param counts: the number of records per delivery status, updated.
+    :param delivered: the statuses of records delivered by an interrupted
+        run, which are not sent again.
+    :return: a generator of (key, result, error) tuples.
+    """
+    for key, result, error, status in delivery.deliver_results(results,
+                                                               delivered):
+        report.write_line(json_codec.dumps(status) + b"\n")
+        report.flush()
+        counts[status["status"]] = counts.get(status["status"], 0) + 1
+        if error is None and status["status"] == "failed":
+            error = f"Delivery failed: {status['error']}"
+        yield key, result, error
+
+
+def create_delivery(args):
+    """ Returns the DataverseDelivery of the --deliver options. """
+    if not (args.dataverse_url and args.collection):
+        raise BulkError("Use --dataverse-url and --collection, or set "
+                        "DATAVERSE_URL and DATAVERSE_COLLECTION, to deliver")
+    if args.stream:
+        raise BulkError("--deliver can not be combined with --stream")
+    # requests is only needed when records are delivered.
+    from deliver import DataverseDelivery
+
+    return DataverseDelivery(args.dataverse_url, args.collection,
+                             settings.DATAVERSE_API_KEY,
+                             max_in_flight=args.in_flight,
+                             retries=args.retries,
+                             backoff=settings.DELIVERY_BACKOFF,
+                             timeout=settings.DELIVERY_TIMEOUT,
+                             release=args.release)
+
+
+def stream_records(records, template, mapping, sink, stats_label: str):
+    """
+    Maps (key, record) tuples one at a time while they are written.
+
+    :return: a generator of (key, error) tuples.
+    """
+    path_stats = PathStats(stats_label) if stats_label else None
+    try:
+        for key, record in records:
+            try:
+                metadata = json_codec.loads(record)
+            except ValueError as e:
+                error = error_message(e)
+                sink.write(key, None, error)
+            else:
+                error = sink.write_chunks(key, iter_record_json(
+                    metadata, template, mapping, settings.STREAM_CHUNK_SIZE,
+                    path_stats=path_stats))
+            yield key, error
+    finally:
+        if path_stats is not None:
+            PATH_STATS.merge(path_stats)
+
+
+def run(args) -> dict:
+    """ Runs a bulk mapping and returns its summary. """
+    template, mapping, stats_label = load_source(args)
+    delivery = create_delivery(args) if args.deliver else None
+
+    run_info = {"input": os.path.abspath(args.input),
+                "output": os.path.abspath(args.output),
+                "template": template.digest, "mapping": mapping.digest}
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip("/\\") +
+                            ".checkpoint", run_info)
+    resumed = checkpoint.load()
+    start = checkpoint.done
+
+    if is_ndjson(args.input):
+        records = iter_ndjson_records(args.input, start)
+    else:
+        files = find_record_files(args.input)
+        if not files:
+            raise BulkError(f"No JSON files found in {args.input}")
+        if checkpoint.last_key is not None:
+            # Files added before the last key since the checkpoint are
+            # left out, the ones after it are mapped.
+            records = iter_file_records(files, bisect.bisect_right(
+                [key for key, _ in files], checkpoint.last_key))
+        else:
+            records = iter_file_records(files, start)
+
+    if is_ndjson(args.output):
+        sink = NDJSONSink(args.output, checkpoint.offset)
+    else:
+        sink = DirectorySink(args.output, checkpoint.offset)
+
+    report = None
+    delivered = {}
+    if delivery is not None:
+        report_path = args.delivery_report or \
+            args.output.rstrip("/\\") + ".delivery.ndjson"
+        delivered_before = read_delivered(report_path,
+                                          checkpoint.delivery_offset) \
+            if resumed else {}
+        report = NDJSONWriter(report_path, checkpoint.delivery_offset)
+
+    def sync():
+        checkpoint.offset = sink.sync()
+        if report is not None:
+            checkpoint.delivery_offset = report.sync()
+        checkpoint.save()
+
+    started = time.perf_counter()
+    mapped = 0
+    failures = []
+    try:
+        if not args.path_stats:
+            stats_label = None
+        if args.stream:
+            results = stream_records(records, template, mapping, sink,
+                                     stats_label)
+        else:
+            results = map_records(records, template, mapping, args.workers,
+                                  args.chunk_size, start, stats_label)
+            if delivery is not None:
+                results = deliver_records(results, delivery, report,
+                                          delivered, delivered_before)
+            results = write_records(results, sink)
+        for key, error in results:
+            mapped += 1
+            checkpoint.done += 1
+            checkpoint.last_key = key
+            if error is not None:
+                checkpoint.failed += 1
+                if len(failures) < args.max_errors:
+                    failures.append({"id": key, "error": error})
+            if checkpoint.done % args.checkpoint_every == 0:
+                sync()
+    finally:
+        sync()
+        sink.close()
+        if delivery is not None:
+            report.close()
+            delivery.close()
+    elapsed = time.perf_counter() - started
+
+    if args.path_stats:
+        with open(args.path_stats, "w") as f:
+            json.dump(PATH_STATS.report(), f, indent=2)
+
+    summary = {
+        "resumed_at": start if resumed else None,
+        "mapped": mapped,
+        "total": checkpoint.done,
+        "failed": checkpoint.failed,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(mapped / elapsed, 1) if elapsed else 0.0,
+        "errors": failures,
+    }
+    if delivery is not None:
+        summary["delivery"] = delivered
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("input", help="a directory, a glob of JSON files "
+                                      "or an NDJSON file")
+    parser.add_argument("--output", required=True,
+                        help="a directory, or an NDJSON file ending with "
+                             f"{' or '.join(NDJSON_SUFFIXES)}")
+    parser.add_argument("--profile", help="the name of a profile")
+    parser.add_argument("--resources-dir", default=settings.RESOURCES_DIR)
+    parser.add_argument("--template", help="a template file")
+    parser.add_argument("--mapping", help="a mapping file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int,
+                        default=settings.BATCH_CHUNK_SIZE)
+    parser.add_argument("--checkpoint",
+                        help="the checkpoint file, by default the output "
+                             "path with '.checkpoint' appended")
+    parser.add_argument("--checkpoint-every", type=int, default=1000,
+                        help="save the checkpoint after this many records")
+    parser.add_argument("--max-errors", type=int, default=20,
+                        help="the number of errors shown in the summary")
+    parser.add_argument("--path-stats",
+                        help="collect path statistics and save them here")
+    parser.add_argument("--stream", action="store_true",
+                        help="write every result while it is mapped, in a "
+                             "single process")
+    delivery = parser.add_argument_group(
+        "delivery", "send the results to the import API of a Dataverse "
+                    "collection, with the API token of DATAVERSE_API_KEY")
+    delivery.add_argument("--deliver", action="store_true",
+                          help="deliver every result while the next ones "
+                               "are mapped")
+    delivery.add_argument("--dataverse-url", default=settings.DATAVERSE_URL)
+    delivery.add_argument("--collection",
+                          default=settings.DATAVERSE_COLLECTION,
+                          help="the alias of the collection")
+    delivery.add_argument("--in-flight", type=int,
+                          default=settings.DELIVERY_MAX_IN_FLIGHT,
+                          help="the most records delivered at the same time")
+    delivery.add_argument("--retries", type=int,
+                          default=settings.DELIVERY_RETRIES)
+    delivery.add_argument("--release", action="store_true",
+                          help="publish the imported datasets")
+    delivery.add_argument("--delivery-report",
+                          help="the NDJSON status report, by default the "
+                               "output path with '.delivery.ndjson' "
+                               "appended")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        summary = run(args)
+    except BulkError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def content_hash(data, sort_keys: bool = True) -> str:
+    """
+    Returns a stable hash of a JSON compatible object.
+
+    By default keys are sorted so two mappings with the same content but a
+    different key order share the same hash.
+
+    :param data: json
+    :param sort_keys: False if the order of the keys matters.
+    :return: hex digest string
+    """
+    serialized = json.dumps(data, sort_keys=sort_keys, separators=(",", ":"),
+                            ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """ A bounded, thread safe least recently used cache.
+
+    Attributes
+    ----------
+    maxsize:
+        The maximum number of entries kept. When a new entry is added to a
+        full cache the least recently used entry is evicted.
+    hits:
+        The number of lookups that found an entry.
+    misses:
+        The number of lookups that did not find an entry.
+    evictions:
+        The number of entries removed to make room for new ones.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_or_create(self, key, factory):
+        """ Returns the entry for key, creating it with factory on a miss.
+
+        The factory is called outside the lock, so two threads missing on the
+        same key at the same time may both build the entry. Both results are
+        equal, so the last one simply wins.
+
+        :param key: the key of the entry.
+        :param factory: a callable without arguments that builds the entry.
+        :return: the cached or newly created entry.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = factory()
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,423 @@
+""" Compressed request and response bodies for the mapper end-points.
+
+Request bodies with a gzip or zstd Content-Encoding are decompressed while
+they are received, so the end-points read the plain JSON or NDJSON without
+the compressed body being kept in memory. Responses are compressed with the
+best encoding the client accepts, streamed responses one message at a time.
+"""
+import zlib
+
+import anyio
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+
+from json_codec import dumps
+
+# The most decompressed bytes passed to the app at once.
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+# The supported encodings, the preferred one first.
+ENCODINGS = ("zstd", "gzip")
+
+
+class DecompressionError(ValueError):
+    """ Raised when a request body can not be decompressed.
+
+    Attributes
+    ----------
+    status_code:
+        The status of the response: 400 for a corrupt body, 413 for a body
+        that is too large and 415 for an unsupported encoding.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ClientMessage(Exception):
+    """ Raised by a decoder when the client sends something other than the
+    body, like a disconnect, which is passed on to the app. """
+
+    def __init__(self, message: dict):
+        super().__init__(message["type"])
+        self.message = message
+
+
+class GzipDecoder:
+    """ Decompresses a gzip stream in chunks of a limited size, receiving
+    the next part of the stream only when the chunks of the previous part
+    have been read. """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._data = b""
+        self._final = False
+
+    async def read_chunk(self) -> bytes:
+        """ Returns the next decompressed chunk, or b"" at the end. """
+        while True:
+            if self._data:
+                chunk = self._decompressor.decompress(self._data,
+                                                      DECOMPRESS_CHUNK_SIZE)
+                self._data = self._decompressor.unconsumed_tail
+                if self._decompressor.eof and self._decompressor.unused_data:
+                    # The next member of a multi-member gzip stream.
+                    self._data = self._decompressor.unused_data
+                    self._decompressor = zlib.decompressobj(
+                        16 + zlib.MAX_WBITS)
+                if chunk:
+                    return chunk
+                continue
+            if self._final:
+                if not self._decompressor.eof:
+                    raise zlib.error("The gzip stream is incomplete")
+                return b""
+            message = await self._receive()
+            if message["type"] != "http.request":
+                raise ClientMessage(message)
+            self._data = message.get("body", b"")
+            self._final = not message.get("more_body", False)
+
+
+class ZstdDecoder:
+    """ Decompresses a zstd stream in chunks of a limited size.
+
+    A zstd decompression object returns all the output of its input at
+    once, so the stream is read with a stream reader in a worker thread,
+    which receives the compressed body from the event loop when it needs
+    more of it.
+    """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._final = False
+        self._reader = zstandard.ZstdDecompressor().stream_reader(
+            self, read_size=DECOMPRESS_CHUNK_SIZE, read_across_frames=True)
+
+    def read(self, size: int = -1) -> bytes:
+        """ Returns the next part of the compressed stream to the reader,
+        b"" at the end. """
+        while not self._final:
+            message = anyio.from_thread.run(self._receive)
+            if message["type"] != "http.request":
+                raise ClientMessage(message)
+            self._final = not message.get("more_body", False)
+            if message.get("body"):
+                return message["body"]
+        return b""
+
+    async def read_chunk(self) -> bytes:
+        """ Returns the next decompressed chunk, or b"" at the end. """
+        return await anyio.to_thread.run_sync(self._reader.read,
+                                              DECOMPRESS_CHUNK_SIZE)
+
+
+DECODERS = {"gzip": GzipDecoder, "x-gzip": GzipDecoder, "zstd": ZstdDecoder}
+DECODE_ERRORS = (zlib.error, ValueError, zstandard.ZstdError)
+
+
+class DecompressionMiddleware:
+    """ Decompresses request bodies with a Content-Encoding header.
+
+    The Content-Encoding and Content-Length headers are removed from the
+    request, so the app sees a plain body. The body is passed on one
+    decompressed chunk at a time, and a part of the compressed body is only
+    decompressed when the app asks for more, so at most max_size bytes are
+    ever decompressed. A request body that can not be decompressed is
+    answered with a 400, 413 or 415 response.
+
+    Attributes
+    ----------
+    max_size:
+        The maximum size of a decompressed request body.
+    """
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = Headers(scope=scope).get("content-encoding", "")
+        encoding = encoding.strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+
+        state = {"started": False, "failed": False}
+
+        async def send_unless_failed(message):
+            if state["failed"]:
+                # The app answers the disconnect it was given; the client
+                # already has the error.
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        async def fail(error: DecompressionError):
+            state["failed"] = True
+            if not state["started"]:
+                await _send_error(send, error.status_code, str(error))
+
+        try:
+            decoder = self._decoder(encoding, receive)
+        except DecompressionError as e:
+            await fail(e)
+            return
+        headers = MutableHeaders(scope=scope)
+        del headers["content-encoding"]
+        if "content-length" in headers:
+            del headers["content-length"]
+        try:
+            await self.app(scope, self._decompressed(receive, decoder, fail),
+                           send_unless_failed)
+        except Exception:
+            if not state["failed"]:
+                raise
+
+    @staticmethod
+    def _decoder(encoding: str, receive):
+        decoder = DECODERS.get(encoding)
+        if decoder is None:
+            raise DecompressionError(
+                415, f"Unsupported Content-Encoding: {encoding}, use one of "
+                     f"{', '.join(ENCODINGS)}")
+        return decoder(receive)
+
+    def _decompressed(self, receive, decoder, fail):
+        """ Returns a receive function that passes on the decompressed body.
+
+        When the body can not be decompressed, fail is awaited with the
+        error and the app receives a disconnect, so it stops reading.
+        """
+        size = 0
+        done = False
+
+        async def receive_decompressed():
+            nonlocal size, done
+            if done:
+                return await receive()
+            try:
+                chunk = await decoder.read_chunk()
+            except ClientMessage as e:
+                return e.message
+            except DECODE_ERRORS as e:
+                await fail(DecompressionError(
+                    400, f"The request body can not be decompressed: {e}"))
+                return {"type": "http.disconnect"}
+            if not chunk:
+                done = True
+                return {"type": "http.request", "body": b"",
+                        "more_body": False}
+            size += len(chunk)
+            if size > self.max_size:
+                await fail(DecompressionError(
+                    413, f"The decompressed request body is larger than "
+                         f"{self.max_size} bytes"))
+                return {"type": "http.disconnect"}
+            return {"type": "http.request", "body": chunk, "more_body": True}
+
+        return receive_decompressed
+
+
+async def _send_error(send, status_code: int, detail: str):
+    body = dumps({"detail": detail})
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def accepted_encoding(accept_encoding: str, encodings: tuple):
+    """
+    Returns the first of the encodings that the client accepts, or None.
+
+    :param accept_encoding: the value of the Accept-Encoding header.
+    :param encodings: the encodings the server uses, the preferred first.
+    """
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                quality = float(parameter[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        chunk = self._compressor.compress(data)
+        if flush:
+            return chunk + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        chunk = self._compressor.compress(data)
+        if flush:
+            return chunk + self._compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return chunk
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class CompressionMiddleware:
+    """ Compresses responses with an encoding the client accepts.
+
+    A response with a single body smaller than min_size is sent as it is.
+    Streamed responses, like the NDJSON of /mapper/batch, are compressed
+    whatever their size, and every part is flushed when it is sent, so the
+    client receives the lines while they are mapped.
+
+    Attributes
+    ----------
+    encodings:
+        The encodings to use, the preferred one first.
+    min_size:
+        The minimum size of a body that is compressed.
+    levels:
+        The compression level per encoding.
+    """
+
+    def __init__(self, app, encodings: tuple, min_size: int, levels: dict):
+        self.app = app
+        self.encodings = tuple(encoding for encoding in encodings
+                               if encoding in ENCODINGS)
+        self.min_size = min_size
+        self.levels = levels
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        encoding = accepted_encoding(headers.get("accept-encoding", ""),
+                                     self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(send, encoding,
+                                         self.levels[encoding],
+                                         self.min_size,
+                                         headers.get("if-none-match", ""))
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """ Compresses the body messages of a single response. """
+
+    def __init__(self, send, encoding: str, level: int, min_size: int,
+                 if_none_match: str = ""):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.min_size = min_size
+        self.if_none_match = if_none_match
+        self._start = None
+        self._encoder = None
+        self._passthrough = False
+
+    async def send(self, message):
+        if self._passthrough:
+            await self._send(message)
+            return
+        if message["type"] == "http.response.start":
+            self._start = message
+            headers = Headers(raw=message.get("headers", []))
+            if message["status"] == 304:
+                await self._send(self._not_modified(headers))
+                self._passthrough = True
+            elif "content-encoding" in headers or message["status"] == 204 \
+                    or headers.get("content-type", "").startswith(
+                        "text/event-stream"):
+                await self._start_passthrough()
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._encoder is None:
+            if not more_body and len(body) < self.min_size:
+                await self._start_passthrough()
+                await self._send(message)
+                return
+            self._encoder = ENCODERS[self.encoding](self.level)
+            if not more_body:
+                body = self._encoder.compress(body, flush=False) + \
+                    self._encoder.finish()
+                await self._send(self._compressed_start(len(body)))
+                await self._send({"type": "http.response.body",
+                                  "body": body})
+                return
+            await self._send(self._compressed_start(None))
+
+        if more_body:
+            body = self._encoder.compress(body, flush=True)
+        else:
+            body = self._encoder.compress(body, flush=False) + \
+                self._encoder.finish()
+        await self._send({"type": "http.response.body", "body": body,
+                          "more_body": more_body})
+
+    async def _start_passthrough(self):
+        self._passthrough = True
+        await self._send(self._start)
+
+    def _not_modified(self, headers: Headers) -> dict:
+        """ Returns the start message of a 304 response, with the weak ETag
+        of the compressed body if that is the one the client has. """
+        etag = headers.get("etag")
+        if not etag or etag.startswith("W/") or \
+                "W/" + etag not in self.if_none_match:
+            return self._start
+        headers = MutableHeaders(raw=list(self._start.get("headers", [])))
+        headers["ETag"] = "W/" + etag
+        return {**self._start, "headers": headers.raw}
+
+    def _compressed_start(self, content_length) -> dict:
+        """ Returns the start message with the headers of the compressed
+        body. content_length is None for a streamed body. """
+        headers = MutableHeaders(raw=list(self._start.get("headers", [])))
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        elif "content-length" in headers:
+            del headers["content-length"]
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # The compressed bytes differ from the ones the ETag names.
+            headers["ETag"] = "W/" + etag
+        return {**self._start, "headers": headers.raw}
+
+
+ENCODERS = {"gzip": GzipEncoder, "zstd": ZstdEncoder}
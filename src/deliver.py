@@ -0,0 +1,230 @@
+""" Delivers mapped records to the native API of a Dataverse installation.
+
+A record with a datasetPersistentId is sent to the import API of the
+collection, /api/dataverses/<collection>/datasets/:import?pid=..., and a
+record without one to /api/dataverses/<collection>/datasets, which creates a
+dataset with a new persistent identifier. The requests share the keep-alive
+connections of one session and are sent by a bounded number of threads, so
+the next records are mapped while the previous ones are delivered.
+
+A create is not idempotent: when its response is lost, the dataset may
+exist anyway, and sending it again creates a duplicate. So a create is only
+retried when the request never reached the server.
+"""
+import random
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+import json_codec
+
+# Statuses of a response that are worth retrying the request for.
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+# Statuses of a response to a create that are worth retrying it for: the
+# server rejected the request without handling it.
+CREATE_RETRY_STATUSES = frozenset((429,))
+# The longest time to wait before a retry.
+MAX_RETRY_DELAY = 60.0
+# The most characters of an error response kept in the status of a record.
+MAX_ERROR_LENGTH = 500
+
+PID_PREFIXES = (("https://doi.org/", "doi:"), ("http://doi.org/", "doi:"),
+                ("https://dx.doi.org/", "doi:"),
+                ("https://hdl.handle.net/", "hdl:"),
+                ("http://hdl.handle.net/", "hdl:"))
+
+
+def normalize_pid(pid: str) -> str:
+    """ Returns a persistent identifier in the form Dataverse expects, for
+    example doi:10.17026/abc for https://doi.org/10.17026/abc. """
+    for prefix, scheme in PID_PREFIXES:
+        if pid.startswith(prefix):
+            return scheme + pid[len(prefix):]
+    return pid
+
+
+def not_sent(error: requests.RequestException) -> bool:
+    """ Returns True if a request failed while connecting, so the server
+    never received it. """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # The MaxRetryError of urllib3, with the error of the connection.
+        reason = getattr(error.args[0], "reason", None)
+        return isinstance(reason, ConnectTimeoutError)
+    return False
+
+
+def persistent_id(result: bytes):
+    """ Returns the normalized datasetPersistentId of a mapped record, or
+    None if it has none. """
+    try:
+        pid = json_codec.loads(result)["datasetVersion"].get(
+            "datasetPersistentId")
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return None
+    return normalize_pid(pid) if isinstance(pid, str) and pid else None
+
+
+class DataverseDelivery:
+    """ Sends mapped records to a collection of a Dataverse installation.
+
+    Attributes
+    ----------
+    url:
+        The base URL of the Dataverse installation.
+    collection:
+        The alias of the collection the datasets are added to.
+    max_in_flight:
+        The most requests that are sent at the same time.
+    retries:
+        The number of times a request is retried after a connection error
+        or a response with a status of RETRY_STATUSES. A create is only
+        retried when it could not connect or got a status of
+        CREATE_RETRY_STATUSES.
+    backoff:
+        The delay before the first retry in seconds, doubled for every next
+        retry. A Retry-After header of the response is used instead.
+    timeout:
+        The timeout of a request in seconds.
+    release:
+        Publish imported datasets at once.
+    """
+
+    def __init__(self, url: str, collection: str, api_key: str = "",
+                 max_in_flight: int = 4, retries: int = 3,
+                 backoff: float = 1.0, timeout: float = 60.0,
+                 release: bool = False):
+        self.url = url.rstrip("/")
+        self.collection = collection
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.release = release
+        self.session = requests.Session()
+        # One pool, with a connection for every request in flight.
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/json"
+        if api_key:
+            self.session.headers["X-Dataverse-key"] = api_key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def request_target(self, pid) -> tuple:
+        """ Returns the URL and query parameters to send a record to. """
+        datasets = f"{self.url}/api/dataverses/{self.collection}/datasets"
+        if pid is None:
+            return datasets, None
+        return f"{datasets}/:import", {"pid": pid,
+                                       "release": "yes" if self.release
+                                       else "no"}
+
+    def retry_delay(self, attempt: int, retry_after) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+        delay = min(self.backoff * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+        # Spread the retries of the threads, so they do not all hit a
+        # recovering server at once.
+        return delay * random.uniform(0.5, 1.0)
+
+    def deliver(self, key, result: bytes) -> dict:
+        """
+        Sends a mapped record, with retries, and returns its status.
+
+        :param key: the id of the record in the status.
+        :param result: the mapped record as JSON bytes.
+        :return: a dict with the id, the status 'delivered' or 'failed', the
+            HTTP status of the last response, the number of attempts and
+            the persistentId or the error.
+        """
+        pid = persistent_id(result)
+        url, params = self.request_target(pid)
+        retry_statuses = RETRY_STATUSES if pid else CREATE_RETRY_STATUSES
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                response = self.session.post(url, params=params, data=result,
+                                             timeout=self.timeout)
+            except requests.RequestException as e:
+                http_status = None
+                error = f"{type(e).__name__}: {e}"
+                retryable = pid is not None or not_sent(e)
+            else:
+                http_status = response.status_code
+                if http_status < 300:
+                    return {"id": key, "status": "delivered",
+                            "http_status": http_status, "attempts": attempt,
+                            "persistentId": self._created_pid(response, pid)}
+                error = response.text[:MAX_ERROR_LENGTH]
+                retry_after = response.headers.get("Retry-After")
+                retryable = http_status in retry_statuses
+            if not retryable or attempt > self.retries:
+                return {"id": key, "status": "failed",
+                        "http_status": http_status, "attempts": attempt,
+                        "error": error}
+            time.sleep(self.retry_delay(attempt, retry_after))
+
+    @staticmethod
+    def _created_pid(response, pid):
+        try:
+            return response.json()["data"]["persistentId"]
+        except (ValueError, KeyError, TypeError):
+            return pid
+
+    def deliver_results(self, results, delivered: dict = None):
+        """
+        Delivers mapped records while the next ones are mapped.
+
+        The records are taken from results only when fewer than
+        max_in_flight requests are running, so a slow server slows down the
+        mapping instead of the records piling up in memory. A record that
+        failed to map is not sent.
+
+        :param results: (key, result, error) tuples of mapped records.
+        :param delivered: the statuses of records that were delivered
+            before, by key. These records are not sent again.
+        :return: a generator of (key, result, error, status) tuples, in the
+            order of results.
+        """
+        delivered = delivered or {}
+        pending = deque()
+        with ThreadPoolExecutor(self.max_in_flight,
+                                thread_name_prefix="delivery") as executor:
+            for key, result, error in results:
+                while len(pending) >= self.max_in_flight:
+                    yield self._finished(*pending.popleft())
+                if result is None:
+                    status = {"id": key, "status": "skipped", "error": error}
+                elif key in delivered:
+                    status = delivered[key]
+                else:
+                    status = executor.submit(self.deliver, key, result)
+                pending.append((key, result, error, status))
+            while pending:
+                yield self._finished(*pending.popleft())
+
+    @staticmethod
+    def _finished(key, result, error, status) -> tuple:
+        if isinstance(status, Future):
+            status = status.result()
+        return key, result, error, status
@@ -0,0 +1,168 @@
+""" Maps records to a delta of the template instead of the whole result.
+
+Most of a mapped record is the template itself: the typeName, typeClass and
+multiple of every field and the values the template already has. A client
+that has the template only needs what differs from it. Two delta formats are
+supported, both rebuilt to the result of map_record by delta_client.py:
+
+values:
+    {"header": {key: value},
+     "fields": {block name: {typeName: value}},
+     "removed": {block name: [typeName]}}
+    header has the header keys whose value differs from the template. fields
+    has the fields whose value differs from the template, a compound as
+    {nested key: value} rows. removed has the fields with a value in the
+    template that are left out of the result. Every other field keeps its
+    template value if it has one and is left out if it is empty. Blocks
+    without changes are left out of fields and removed.
+patch:
+    A JSON Patch (RFC 6902) that turns the template into the result, with
+    'replace' operations for the changed values and 'remove' operations for
+    the fields that are left out. Every empty field of the template is
+    removed, so for templates with many empty fields the patch is larger
+    than a values delta.
+"""
+from mapper import MetadataMapper, map_record
+from plan import EMPTY_VALUES
+
+DELTA_FORMATS = ("values", "patch")
+
+
+def pointer(*keys) -> str:
+    """ Returns the JSON Pointer of a location in the template. """
+    return "".join("/" + str(key).replace("~", "~0").replace("/", "~1")
+                   for key in keys)
+
+
+def compact_default(field):
+    """ Returns the value of a field in the template, without the nested
+    field dictionaries of a compound. """
+    value = field.default
+    if field.type_class != "compound":
+        return value
+    if isinstance(value, list):
+        return [{key: nested.get("value") for key, nested in row.items()}
+                for row in value]
+    return {key: nested.get("value") for key, nested in value.items()}
+
+
+def changed_header(mapper: MetadataMapper) -> list:
+    """
+    Maps the header and returns the keys whose value differs from the
+    template.
+
+    :return: a list of (key, value, locations) tuples, where locations are
+        the JSON Pointers of the key in the template.
+    """
+    plan = mapper.plan
+    with mapper.timings.measure("header"):
+        header = mapper.map_metadata_header()
+    changes = []
+    for key, value in header.items():
+        locations = [pointer(key) for item, default in plan.items
+                     if item == key and default != value]
+        locations += [pointer("datasetVersion", key)
+                      for item, default in plan.version_items
+                      if item == key and default != value]
+        if locations:
+            changes.append((key, value, locations))
+    return changes
+
+
+def mapped_blocks(mapper: MetadataMapper):
+    """
+    Maps the metadata blocks one at a time.
+
+    Like map_metadata_blocks, only the fields that are mapped or have a
+    value in the template are visited.
+
+    :return: a generator of (name, fields, values) tuples, where fields are
+        the FieldPlans of the block and values the value of every field in
+        the result by its position.
+    """
+    _, positions = mapper.mapped_fields
+    for name, _, fields in mapper.plan.blocks:
+        values = {}
+        with mapper.timings.measure("blocks"):
+            for position in positions[name]:
+                value = mapper.map_field_value(fields[position])
+                if value not in EMPTY_VALUES:
+                    values[position] = value
+        yield name, fields, values
+
+
+def values_delta(mapper: MetadataMapper) -> dict:
+    """ Maps a record to a values delta. The mapper has to compact the
+    compounds. """
+    header = {key: value for key, value, _ in changed_header(mapper)}
+    changed_fields = {}
+    removed_fields = {}
+    for name, fields, values in mapped_blocks(mapper):
+        changed = {}
+        removed = []
+        for position, field in enumerate(fields):
+            if position in values:
+                if values[position] != compact_default(field):
+                    changed[field.type_name] = values[position]
+            elif field.default not in EMPTY_VALUES:
+                removed.append(field.type_name)
+        if changed:
+            changed_fields[name] = changed
+        if removed:
+            removed_fields[name] = removed
+    return {"header": header, "fields": changed_fields,
+            "removed": removed_fields}
+
+
+def patch_delta(mapper: MetadataMapper) -> list:
+    """ Maps a record to a JSON Patch of the template. """
+    operations = [{"op": "replace", "path": location, "value": value}
+                  for _, value, locations in changed_header(mapper)
+                  for location in locations]
+    for name, fields, values in mapped_blocks(mapper):
+        # From the last field to the first, so a removal does not move the
+        # fields that are changed after it.
+        for position in range(len(fields) - 1, -1, -1):
+            path = pointer("datasetVersion", "metadataBlocks", name,
+                           "fields", position)
+            if position not in values:
+                operations.append({"op": "remove", "path": path})
+            elif values[position] != fields[position].default:
+                operations.append({"op": "replace", "path": path + "/value",
+                                   "value": values[position]})
+    return operations
+
+
+def map_record_delta(metadata, template, mapping, delta_format: str,
+                     timings=None, path_stats=None):
+    """
+    Maps a single record like map_record and returns a delta of the template.
+
+    :param metadata: The input metadata represented as a JSON object.
+    :param template: The Dataverse JSON template or its TemplatePlan.
+    :param mapping: The mapping or a compiled mapping.
+    :param delta_format: 'values' or 'patch'.
+    :param timings: Timings to record the phases of the mapping in.
+    :param path_stats: PathStats to record the searches of the paths in.
+    :return: a values delta dict or a list of JSON Patch operations.
+    """
+    if delta_format not in DELTA_FORMATS:
+        raise ValueError(f"Unknown delta format: {delta_format}, use one of "
+                         f"{', '.join(DELTA_FORMATS)}")
+    mapper = MetadataMapper(metadata, template, mapping,
+                            prune_empty_fields=True, timings=timings,
+                            path_stats=path_stats,
+                            compact_compounds=delta_format == "values")
+    if delta_format == "values":
+        return values_delta(mapper)
+    return patch_delta(mapper)
+
+
+def map_output(metadata, template, mapping, delta_format: str = None,
+               timings=None, path_stats=None):
+    """ Maps a single record to its result, or to a delta of the template if
+    delta_format is not None. """
+    if delta_format is None:
+        return map_record(metadata, template, mapping, timings, path_stats)
+    return map_record_delta(metadata, template, mapping, delta_format,
+                            timings, path_stats)
@@ -0,0 +1,178 @@
+""" Rebuilds the Dataverse JSON from a delta returned by the mapper.
+
+With ?delta=values or ?delta=patch the mapper end-points return only what
+differs from the template, see delta.py for the formats. This module turns
+such a delta and the template back into the full Dataverse JSON, the same as
+the response without delta. It only uses the standard library, so it can be
+copied into a client as it is.
+
+Usage:
+    python delta_client.py template.json delta.json
+    python delta_client.py template.json batch.ndjson --batch
+"""
+import argparse
+import copy
+import json
+import sys
+
+# Fields with these values are left out of the result.
+EMPTY_VALUES = ('', [], {})
+
+
+def expand_compound(field: dict, value):
+    """ Returns the value of a compound with the nested field dictionaries
+    of the template around the compact values. """
+    nested_fields = field["value"]
+    if isinstance(nested_fields, list):
+        nested_fields = nested_fields[0]
+
+    def expand_row(row: dict) -> dict:
+        result = {}
+        for key, nested_value in row.items():
+            nested = dict(nested_fields[key])
+            if "value" in nested:
+                nested["value"] = nested_value
+            result[key] = nested
+        return result
+
+    if isinstance(value, list):
+        return [expand_row(row) for row in value]
+    return expand_row(value)
+
+
+def rebuild_fields(fields: list, changed: dict, removed: list) -> list:
+    """ Returns the fields of a metadata block in the result. """
+    result = []
+    for field in fields:
+        type_name = field.get("typeName")
+        if type_name in changed:
+            field = dict(field)
+            if "value" in field:
+                value = changed[type_name]
+                if field.get("typeClass") == "compound":
+                    value = expand_compound(field, value)
+                field["value"] = value
+            result.append(field)
+        elif type_name not in removed and \
+                field.get("value") not in EMPTY_VALUES:
+            result.append(copy.deepcopy(field))
+    return result
+
+
+def rebuild(template: dict, delta: dict) -> dict:
+    """
+    Rebuilds the mapped Dataverse JSON from a values delta.
+
+    :param template: the Dataverse JSON template the record was mapped to.
+    :param delta: the values delta of the record.
+    :return: the Dataverse JSON, the template is not changed.
+    """
+    header = delta.get("header", {})
+    changed_fields = delta.get("fields", {})
+    removed_fields = delta.get("removed", {})
+
+    metadata_blocks = {}
+    for name, block in template["datasetVersion"]["metadataBlocks"].items():
+        metadata_blocks[name] = {
+            key: rebuild_fields(value, changed_fields.get(name, {}),
+                                removed_fields.get(name, []))
+            if key == "fields" else copy.deepcopy(value)
+            for key, value in block.items()
+        }
+
+    def rebuild_items(items: dict, nested_key: str, nested_value) -> dict:
+        result = {}
+        for key, value in items.items():
+            if key == nested_key:
+                result[key] = nested_value
+            elif key in header:
+                result[key] = header[key]
+            else:
+                result[key] = copy.deepcopy(value)
+        return result
+
+    dataset_version = rebuild_items(template["datasetVersion"],
+                                    "metadataBlocks", metadata_blocks)
+    return rebuild_items(template, "datasetVersion", dataset_version)
+
+
+def _resolve(document, path: str) -> tuple:
+    """ Returns the container and key of the location of a JSON Pointer. """
+    keys = [key.replace("~1", "/").replace("~0", "~")
+            for key in path.split("/")[1:]]
+    if not keys:
+        raise ValueError("The whole document can not be patched")
+    container = document
+    for key in keys[:-1]:
+        container = container[int(key) if isinstance(container, list)
+                              else key]
+    key = keys[-1]
+    return container, int(key) if isinstance(container, list) else key
+
+
+def apply_patch(document, patch: list):
+    """
+    Applies the replace, add and remove operations of a JSON Patch.
+
+    :param document: the template, which is not changed.
+    :param patch: the patch delta of a record.
+    :return: the patched copy of the document.
+    """
+    document = copy.deepcopy(document)
+    for operation in patch:
+        container, key = _resolve(document, operation["path"])
+        op = operation["op"]
+        if op == "remove":
+            del container[key]
+        elif op == "replace":
+            if isinstance(container, dict) and key not in container:
+                raise KeyError(f"No value to replace at {operation['path']}")
+            container[key] = operation["value"]
+        elif op == "add":
+            if isinstance(container, list):
+                container.insert(key, operation["value"])
+            else:
+                container[key] = operation["value"]
+        else:
+            raise ValueError(f"Unsupported patch operation: {op}")
+    return document
+
+
+def rebuild_delta(template: dict, delta):
+    """ Rebuilds the Dataverse JSON from a values delta or a patch. """
+    if isinstance(delta, list):
+        return apply_patch(template, delta)
+    return rebuild(template, delta)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("template", help="the template file")
+    parser.add_argument("delta", help="a delta, or the NDJSON response of "
+                                      "/mapper/batch with --batch")
+    parser.add_argument("--batch", action="store_true",
+                        help="rebuild every line of a batch response")
+    args = parser.parse_args(argv)
+
+    with open(args.template) as f:
+        template = json.load(f)
+    with open(args.delta) as f:
+        if not args.batch:
+            json.dump(rebuild_delta(template, json.load(f)), sys.stdout)
+            sys.stdout.write("\n")
+            return 0
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if "result" in result:
+                result["result"] = rebuild_delta(template, result["result"])
+            sys.stdout.write(json.dumps(result) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
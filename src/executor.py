@@ -0,0 +1,163 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BACKENDS = ("thread", "process")
+
+
+def ping() -> bool:
+    """ A job that does nothing, used to start the workers. """
+    return True
+
+
+class Overloaded(Exception):
+    """ Raised when a job is not admitted because the queue is full. """
+
+
+class MappingExecutor:
+    """ Runs mapping jobs in a pool of a set size with a bounded queue.
+
+    At most 'workers' jobs run at the same time. Up to 'max_queue' more jobs
+    wait for a free worker, every job after that is rejected straight away,
+    so a burst of requests can not make the latency grow without a limit.
+
+    Attributes
+    ----------
+    backend:
+        'thread' to run the jobs in a pool of threads, or 'process' to run
+        them in a pool of worker processes. Jobs and their arguments must be
+        picklable for the 'process' backend.
+    workers:
+        The number of jobs that run at the same time.
+    max_queue:
+        The number of jobs that can wait for a free worker.
+    executor:
+        The pool of the backend. It is created when the first job runs, or
+        by start, and is created again after shutdown.
+    """
+
+    def __init__(self, backend: str, workers: int, max_queue: int):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown executor backend: {backend}")
+        self.backend = backend
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = None
+        self.running = 0
+        self.waiting = 0
+        self._slots = None
+        self._loop = None
+        self._admitted = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def run(self, function, *args):
+        """
+        Runs function(*args) in the pool and returns its result.
+
+        :raises Overloaded: if all workers are busy and the queue is full.
+        """
+        loop = await self._acquire()
+        self.running += 1
+        try:
+            future = self.get_executor().submit(function, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The worker stays busy until the job is done, even when the request
+        # is cancelled, so the slot is released by the job itself.
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def check_admission(self):
+        """
+        Rejects a job straight away when it would not be admitted.
+
+        :raises Overloaded: if all workers are busy and the queue is full.
+        """
+        if self.running >= self.workers and self.waiting >= self.max_queue:
+            self._rejected += 1
+            raise Overloaded(f"{self.waiting} mapping jobs are waiting")
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds a worker slot for a job that does not run in the pool.
+
+        Streamed responses are mapped while they are sent, and extracted
+        request bodies while they are received, outside of the pool, but
+        count as a running job so the number of mappings at the same time
+        stays limited. The job waits for a free worker like any other,
+        check_admission rejects it before the response is started.
+        """
+        await self._acquire(check=False)
+        self.running += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, check: bool = True):
+        """ Waits for a free worker and returns the running event loop. """
+        if check:
+            self.check_admission()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.workers - self.running)
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - start
+        self._admitted += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        return loop
+
+    def get_executor(self):
+        if self.executor is None:
+            if self.backend == "process":
+                self.executor = ProcessPoolExecutor(self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(self.workers)
+        return self.executor
+
+    def start(self):
+        """ Starts every worker, so the first jobs do not wait for them. """
+        executor = self.get_executor()
+        futures = [executor.submit(ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _release(self):
+        self.running -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """ Returns the queue depth and the time jobs waited for a worker. """
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "wait_seconds_total": self._wait_total,
+            "wait_seconds_max": self._wait_max,
+            "wait_seconds_avg": (self._wait_total / self._admitted
+                                 if self._admitted else 0.0),
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
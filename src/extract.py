@@ -0,0 +1,331 @@
+import codecs
+import json
+import re
+
+import settings
+from cache import LRUCache
+from paths import parse_simple_prefix
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# The characters of a string up to its closing quote, or up to a backslash
+# at the end of the buffer.
+STRING_CHARACTERS = re.compile(r'(?:[^"\\]|\\.)*', re.DOTALL)
+SCALAR = re.compile(r'[^,\]}\s]+')
+# Everything that can be skipped while looking for the end of a container.
+PLAIN_TEXT = re.compile(r'[^"\[\]{}]+')
+
+NEEDED_PATHS_CACHE = LRUCache(settings.MAPPING_CACHE_SIZE)
+
+
+class ExtractError(ValueError):
+    """ Raised when the document is not valid JSON. """
+
+
+class NeededPaths:
+    """ A trie of the parts of a document the paths of a mapping read.
+
+    Attributes
+    ----------
+    keys:
+        The NeededPaths of the keys of an object at this location.
+    indexes:
+        The NeededPaths of the items of an array at this location.
+    full:
+        True if the entire value at this location is needed.
+    """
+    __slots__ = ("keys", "indexes", "full")
+
+    def __init__(self):
+        self.keys = {}
+        self.indexes = {}
+        self.full = False
+
+    def add(self, steps: tuple):
+        """ Marks the value at the end of the steps as needed. """
+        node = self
+        for step in steps:
+            if node.full:
+                return
+            if isinstance(step, int):
+                if step < 0:
+                    # Counting from the end needs the entire array.
+                    break
+                node = node.indexes.setdefault(step, NeededPaths())
+            else:
+                node = node.keys.setdefault(step, NeededPaths())
+        node.full = True
+        node.keys = {}
+        node.indexes = {}
+
+
+def needed_paths(mapping) -> NeededPaths:
+    """
+    Returns the parts of a document that the paths of a mapping read.
+
+    For paths that are not simple, the value at their simple prefix is
+    needed. The children of an object to compound mapping are searched in
+    the objects found by its 'mapping' path, so those objects are needed as
+    a whole.
+
+    :param mapping: a compiled mapping.
+    :return: NeededPaths
+    """
+    needed = NeededPaths()
+    for path_list in mapping.values():
+        if isinstance(path_list, dict):
+            path_list = [path_list["mapping"]]
+        for path in path_list:
+            needed.add(parse_simple_prefix(path.expression))
+    return needed
+
+
+def get_needed_paths(mapping) -> NeededPaths:
+    """ Returns the needed paths of a compiled mapping, using the cache. """
+    return NEEDED_PATHS_CACHE.get_or_create(
+        mapping.digest, lambda: needed_paths(mapping))
+
+
+class StreamingExtractor:
+    """ Parses a JSON document from a stream, keeping only the needed parts.
+
+    The stream is read in chunks. Values that are not needed are skipped
+    without creating Python objects, so the memory used is close to the size
+    of the needed parts. Skipped items of arrays are replaced by None, so the
+    indexes of the remaining items do not change.
+
+    Attributes
+    ----------
+    stream:
+        A binary file-like object with a read method.
+    chunk_size:
+        The number of bytes read from the stream at once.
+    """
+
+    def __init__(self, stream, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+        self._capture = None
+        self._capture_start = 0
+
+    def extract(self, needed: NeededPaths):
+        """
+        Returns the document with only the needed parts.
+
+        :param needed: the needed parts of the document.
+        :raises ExtractError: if the document is not valid JSON.
+        """
+        value = self._value(needed)
+        self._skip_whitespace()
+        if self._peek() != "":
+            raise ExtractError("Extra data after the JSON document")
+        return value
+
+    def _fill(self) -> bool:
+        """ Reads the next chunk of the stream in to the buffer. """
+        if self._eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self._eof = True
+        try:
+            text = self._decoder.decode(data, final=self._eof)
+        except UnicodeDecodeError as e:
+            raise ExtractError(f"Invalid UTF-8 in the JSON document: {e}") \
+                from e
+        if self._capture is not None:
+            self._capture.append(
+                self._buffer[self._capture_start:self._position])
+            self._capture_start = 0
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return True
+
+    def _peek(self) -> str:
+        """ Returns the next character, or '' at the end of the document. """
+        while self._position >= len(self._buffer):
+            if not self._fill():
+                return ""
+        return self._buffer[self._position]
+
+    def _expect(self, character: str):
+        if self._peek() != character:
+            raise ExtractError(f"Expected '{character}' at "
+                               f"'{self._buffer[self._position:][:20]}'")
+        self._position += 1
+
+    def _match(self, pattern):
+        """ Matches a pattern that must not be cut off by the buffer end. """
+        while True:
+            match = pattern.match(self._buffer, self._position)
+            if match is not None and match.end() < len(self._buffer):
+                break
+            if not self._fill():
+                match = pattern.match(self._buffer, self._position)
+                break
+        if match is None:
+            raise ExtractError(
+                f"Invalid JSON at '{self._buffer[self._position:][:20]}'")
+        self._position = match.end()
+        return match.group()
+
+    def _match_string(self) -> str:
+        """ Matches a string, which may span many chunks.
+
+        The parts of the string are collected while the buffer is refilled,
+        so a long string is scanned and copied only once.
+        """
+        if self._peek() != '"':
+            raise ExtractError(
+                f"Expected a string at '{self._buffer[self._position:][:20]}'")
+        parts = []
+        start = self._position
+        scan = start + 1
+        while True:
+            end = STRING_CHARACTERS.match(self._buffer, scan).end()
+            if end < len(self._buffer) and self._buffer[end] == '"':
+                self._position = end + 1
+                parts.append(self._buffer[start:self._position])
+                return "".join(parts)
+            # Stopped at the end of the buffer, or at a backslash at its end
+            # that escapes the first character of the next chunk, which is
+            # kept in the buffer.
+            parts.append(self._buffer[start:end])
+            self._position = end
+            if not self._fill():
+                raise ExtractError("Unterminated string in the JSON document")
+            start = scan = 0
+
+    def _skip_whitespace(self):
+        self._match(WHITESPACE)
+
+    def _value(self, needed: NeededPaths):
+        self._skip_whitespace()
+        if needed.full:
+            return self._capture_value()
+        character = self._peek()
+        if character == "{":
+            return self._object(needed)
+        if character == "[":
+            return self._array(needed)
+        return self._scalar()
+
+    def _object(self, needed: NeededPaths) -> dict:
+        result = {}
+        self._expect("{")
+        self._skip_whitespace()
+        if self._peek() == "}":
+            self._position += 1
+            return result
+        while True:
+            self._skip_whitespace()
+            key = json.loads(self._match_string())
+            self._skip_whitespace()
+            self._expect(":")
+            child = needed.keys.get(key)
+            if child is None:
+                self._skip_value()
+            else:
+                result[key] = self._value(child)
+            self._skip_whitespace()
+            if self._peek() == ",":
+                self._position += 1
+                continue
+            self._expect("}")
+            return result
+
+    def _array(self, needed: NeededPaths) -> list:
+        result = []
+        self._expect("[")
+        self._skip_whitespace()
+        if self._peek() == "]":
+            self._position += 1
+            return result
+        while True:
+            child = needed.indexes.get(len(result))
+            if child is None:
+                self._skip_value()
+                result.append(None)
+            else:
+                result.append(self._value(child))
+            self._skip_whitespace()
+            if self._peek() == ",":
+                self._position += 1
+                continue
+            self._expect("]")
+            return result
+
+    def _scalar(self):
+        if self._peek() == '"':
+            token = self._match_string()
+        else:
+            token = self._match(SCALAR)
+        try:
+            return json.loads(token)
+        except ValueError as e:
+            raise ExtractError(f"Invalid JSON value '{token[:20]}'") from e
+
+    def _capture_value(self):
+        """ Parses the next value as a whole with the json module. """
+        self._capture = []
+        self._capture_start = self._position
+        self._skip_value()
+        self._capture.append(
+            self._buffer[self._capture_start:self._position])
+        text = "".join(self._capture)
+        self._capture = None
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            raise ExtractError(str(e)) from e
+
+    def _skip_value(self):
+        """ Moves past the next value without parsing it. """
+        self._skip_whitespace()
+        character = self._peek()
+        if character == '"':
+            self._match_string()
+            return
+        if character not in "[{":
+            self._match(SCALAR)
+            return
+
+        depth = 0
+        while True:
+            character = self._peek()
+            if character == "":
+                raise ExtractError("Unexpected end of the JSON document")
+            if character in "[{":
+                depth += 1
+                self._position += 1
+            elif character in "]}":
+                depth -= 1
+                self._position += 1
+                if depth == 0:
+                    return
+            elif character == '"':
+                self._match_string()
+            else:
+                self._match_plain_text()
+
+    def _match_plain_text(self):
+        """ Moves past text outside of strings, it may end at the buffer end.
+        """
+        match = PLAIN_TEXT.match(self._buffer, self._position)
+        self._position = match.end()
+
+
+def extract(stream, mapping, chunk_size: int = 64 * 1024):
+    """
+    Parses a JSON document, keeping only the parts the mapping reads.
+
+    :param stream: a binary file-like object with the JSON document.
+    :param mapping: a compiled mapping.
+    :param chunk_size: the number of bytes read from the stream at once.
+    :return: the document with only the needed parts.
+    """
+    extractor = StreamingExtractor(stream, chunk_size)
+    return extractor.extract(get_needed_paths(mapping))
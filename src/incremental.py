@@ -0,0 +1,163 @@
+import json
+
+import utils
+from mapper import MetadataMapper
+from plan import EMPTY_VALUES, FieldPlan, get_template_plan
+
+
+class RemapError(ValueError):
+    """ Raised when the previous result is not a mapping result. """
+
+
+def path_expressions(paths) -> tuple:
+    """ Returns the expressions of a list of compiled paths. """
+    return tuple(getattr(path, "expression", path) for path in paths)
+
+
+def mapping_signature(path_list):
+    """ Returns a comparable value of the paths of a single mapping key. """
+    if isinstance(path_list, dict):
+        children = path_list["children"]
+        return ("object", path_expressions([path_list["mapping"]]),
+                tuple(sorted((child, path_expressions(paths))
+                             for child, paths in children.items())))
+    return path_expressions(path_list)
+
+
+def field_signature(field: FieldPlan) -> str:
+    """ Returns a comparable value of the definition of a template field. """
+    return json.dumps([field.layout, field.default])
+
+
+def field_dependencies(field: FieldPlan) -> set:
+    """
+    Returns the mapping keys that the value of a template field depends on:
+    its own typeName and the typeNames of the nested fields of a compound.
+    """
+    return set(field.type_names)
+
+
+def changed_mapping_keys(old_mapping, new_mapping) -> set:
+    """ Returns the keys of the mapping whose paths changed. """
+    old_mapping = utils.get_compiled_mapping(old_mapping)
+    new_mapping = utils.get_compiled_mapping(new_mapping)
+    return {key for key in old_mapping.keys() | new_mapping.keys()
+            if key not in old_mapping or key not in new_mapping or
+            mapping_signature(old_mapping[key]) !=
+            mapping_signature(new_mapping[key])}
+
+
+def changed_fields(old_template, old_mapping, new_template,
+                   new_mapping) -> set:
+    """
+    Returns the typeNames of the fields that have to be mapped again.
+
+    A field has to be mapped again when it is new, when its definition in
+    the template changed or when a mapping key it depends on changed. This
+    includes header keys.
+
+    :return: a set of typeNames of header keys and block fields.
+    """
+    old_plan = get_template_plan(old_template)
+    new_plan = get_template_plan(new_template)
+    changed_keys = changed_mapping_keys(old_mapping, new_mapping)
+
+    old_header = dict(old_plan.items + old_plan.version_items)
+    new_header = dict(new_plan.items + new_plan.version_items)
+    changed = {key for key in new_plan.header_keys
+               if key in changed_keys or key not in old_header or
+               old_header[key] != new_header[key]}
+
+    old_fields = {(name, field.type_name): field_signature(field)
+                  for name, _, fields in old_plan.blocks for field in fields}
+    for name, _, fields in new_plan.blocks:
+        for field in fields:
+            if old_fields.get((name, field.type_name)) != \
+                    field_signature(field) or \
+                    field_dependencies(field) & changed_keys:
+                changed.add(field.type_name)
+    return changed
+
+
+def remap_record(previous: dict, metadata, template, mapping,
+                 fields) -> dict:
+    """
+    Updates a previous result by mapping only the given fields again.
+
+    The previous result must have been mapped from the same metadata with
+    empty fields removed, like map_record does, with a template that has the
+    same fields as the given template apart from the given fields. Every
+    other field is copied from the previous result.
+
+    :param previous: the previous result.
+    :param metadata: the input metadata the previous result was mapped from.
+    :param template: the new template or its TemplatePlan.
+    :param mapping: the new mapping or a compiled mapping.
+    :param fields: the typeNames of the fields to map again.
+    :return: the new result, equal to mapping the record from scratch.
+    :raises RemapError: if the previous result has no metadata blocks.
+    """
+    try:
+        previous_version = previous["datasetVersion"]
+        previous_blocks = previous_version["metadataBlocks"]
+    except (KeyError, TypeError):
+        raise RemapError("The previous result has no "
+                         "datasetVersion.metadataBlocks")
+
+    mapper = MetadataMapper(metadata, template, mapping,
+                            prune_empty_fields=True)
+    plan = mapper.plan
+
+    header = {}
+    for key in plan.header_keys:
+        if key in fields:
+            mapped_values = mapper.map_value(key) \
+                if key in mapper.mapping else []
+            if mapped_values:
+                header[key] = mapped_values[0]
+        elif key in previous:
+            header[key] = previous[key]
+        elif key in previous_version:
+            header[key] = previous_version[key]
+
+    blocks = {}
+    for name, _, block_fields in plan.blocks:
+        previous_fields = {
+            field["typeName"]: field
+            for field in previous_blocks.get(name, {}).get("fields", [])
+        }
+        mapped_fields = []
+        for field in block_fields:
+            if field.type_name not in fields:
+                if field.type_name in previous_fields:
+                    mapped_fields.append(previous_fields[field.type_name])
+                continue
+            value = mapper.map_field_value(field)
+            if value not in EMPTY_VALUES:
+                mapped_fields.append(field.build(value))
+        blocks[name] = mapped_fields
+    return plan.build(header, blocks)
+
+
+def remap(previous: dict, metadata, template, mapping,
+          previous_template=None, previous_mapping=None) -> tuple:
+    """
+    Updates a previous result after the template or mapping changed.
+
+    :param previous: the previous result.
+    :param metadata: the input metadata the previous result was mapped from.
+    :param template: the new template.
+    :param mapping: the new mapping.
+    :param previous_template: the template of the previous result, by default
+        the new template.
+    :param previous_mapping: the mapping of the previous result, by default
+        the new mapping.
+    :return: the new result and the set of typeNames that were mapped again.
+    :raises RemapError: if the previous result has no metadata blocks.
+    """
+    fields = changed_fields(
+        template if previous_template is None else previous_template,
+        mapping if previous_mapping is None else previous_mapping,
+        template, mapping)
+    return remap_record(previous, metadata, template, mapping, fields), \
+        fields
@@ -0,0 +1,62 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+INPUT_KEYS = ("metadata", "template", "mapping")
+
+
+class InputError(ValueError):
+    """ Raised when a request body is not a valid mapper input. """
+
+
+def loads(data: bytes):
+    """
+    Parses a JSON document, with orjson when it is installed.
+
+    :param data: the JSON document as bytes or str.
+    :raises ValueError: if the document is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> bytes:
+    """ Serializes a value to compact JSON bytes, with orjson if installed.
+
+    orjson does not serialize integers of more than 64 bits and keys that
+    are not strings, these values are serialized with the json module.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def parse_input(body: bytes) -> dict:
+    """
+    Parses a mapper request body without validating its values.
+
+    Only the top level of the body is checked, the metadata, template and
+    mapping are used as they are parsed.
+
+    :param body: the request body.
+    :return: dict with the metadata, template and mapping.
+    :raises InputError: if the body is not a JSON object with those keys.
+    """
+    try:
+        input_data = loads(body)
+    except ValueError as e:
+        raise InputError(f"Invalid JSON: {e}") from e
+    if not isinstance(input_data, dict):
+        raise InputError("The body must be a JSON object")
+    missing = [key for key in INPUT_KEYS if key not in input_data]
+    if missing:
+        raise InputError(f"Missing fields: {', '.join(missing)}")
+    return input_data
@@ -0,0 +1,117 @@
+""" Writes the mapped Dataverse JSON while the fields are mapped.
+
+map_record builds the whole filled out template before it is serialized, so
+the result is in memory as objects and as bytes at the same time. The writer
+maps and serializes one field at a time instead, so only the field that is
+being mapped is in memory as objects. The bytes are the same as those of
+json_codec.dumps(map_record(...)).
+"""
+from json_codec import dumps
+from mapper import MetadataMapper
+from plan import copy_value
+
+
+def _iter_items(items, header: dict, nested_key: str, nested_chunks):
+    """ Yields a JSON object of the template items, with the header values
+    and the chunks of nested_chunks() as the value of nested_key. """
+    yield b"{"
+    for index, (key, value) in enumerate(items):
+        yield (b"," if index else b"") + dumps(key) + b":"
+        if key == nested_key:
+            yield from nested_chunks()
+        elif key in header:
+            yield dumps(header[key])
+        else:
+            yield dumps(copy_value(value))
+    yield b"}"
+
+
+def iter_mapped_json(mapper: MetadataMapper):
+    """
+    Maps a record and yields its JSON in chunks, one field at a time.
+
+    The keys are in the same order as in the result of map_metadata.
+
+    :param mapper: the MetadataMapper of the record.
+    :return: a generator of bytes.
+    """
+    plan = mapper.plan
+    with mapper.timings.measure("header"):
+        header = mapper.map_metadata_header()
+
+    def block_chunks(name, fields):
+        yield b"["
+        for index, field in enumerate(mapper.iter_block_fields(name,
+                                                               fields)):
+            if index:
+                yield b","
+            yield dumps(field)
+        yield b"]"
+
+    def blocks_chunks():
+        yield b"{"
+        for index, (name, items, fields) in enumerate(plan.blocks):
+            yield (b"," if index else b"") + dumps(name) + b":"
+            yield from _iter_items(items, {}, "fields",
+                                   lambda: block_chunks(name, fields))
+        yield b"}"
+
+    def version_chunks():
+        return _iter_items(plan.version_items, header, "metadataBlocks",
+                           blocks_chunks)
+
+    return _iter_items(plan.items, header, "datasetVersion", version_chunks)
+
+
+def iter_record_json(metadata, template, mapping, chunk_size: int,
+                     timings=None, path_stats=None):
+    """
+    Maps a single record like map_record and yields its JSON in chunks.
+
+    The small pieces of JSON are joined until they are at least chunk_size
+    bytes. A single field larger than that is yielded as it is, so it is
+    never copied.
+
+    :param metadata: The input metadata represented as a JSON object.
+    :param template: The Dataverse JSON template or its TemplatePlan.
+    :param mapping: The mapping or a compiled mapping.
+    :param chunk_size: the size the small pieces of JSON are joined to.
+    :param timings: Timings to record the phases of the mapping in.
+    :param path_stats: PathStats to record the searches of the paths in.
+    :return: a generator of bytes.
+    """
+    mapper = MetadataMapper(metadata, template, mapping,
+                            prune_empty_fields=True, timings=timings,
+                            path_stats=path_stats)
+    buffer = []
+    size = 0
+    for chunk in iter_mapped_json(mapper):
+        if len(chunk) >= chunk_size:
+            if buffer:
+                yield b"".join(buffer)
+                buffer.clear()
+                size = 0
+            yield chunk
+            continue
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def write_record_json(file, metadata, template, mapping,
+                      chunk_size: int = 64 * 1024) -> int:
+    """
+    Maps a single record and writes its JSON to a binary file.
+
+    :return: the number of bytes written.
+    """
+    written = 0
+    for chunk in iter_record_json(metadata, template, mapping, chunk_size):
+        file.write(chunk)
+        written += len(chunk)
+    return written
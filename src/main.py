@@ -1,10 +1,170 @@
-from fastapi import FastAPI
+import asyncio
+import hashlib
+import json
+from contextlib import asynccontextmanager, suppress
+from tempfile import SpooledTemporaryFile
+from time import perf_counter
+from typing import Literal
 
-from mapper import MetadataMapper
-from schema.input import Input
+import anyio.from_thread
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import settings
+import utils
+from cache import content_hash
+from compression import CompressionMiddleware, DecompressionMiddleware
+from batch import BatchError, iter_ndjson_lines, map_batch_record
+from delta import map_output
+from executor import MappingExecutor, Overloaded
+from extract import ExtractError, extract
+from incremental import RemapError, remap
+from json_codec import InputError, dumps, parse_input
+from json_writer import iter_record_json
+from metrics import (PROMETHEUS_MEDIA_TYPE, PhaseMetrics,
+                     ServerTimingMiddleware, render_result_cache)
+from pathstats import PATH_STATS, PathStats, mapping_label
+from plan import get_template_plan
+from pool import MappingPool
+from profiles import ProfileRegistry
+from result_cache import create_result_cache, etag_matches, result_key
+from schema.input import BatchInput, Input, ProfileInput, RemapInput
+from timing import Timings
 from version import get_version
 
-app = FastAPI()
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# The delta formats of the ?delta= query parameter, see delta.py.
+DeltaFormat = Literal["values", "patch"]
+
+profiles = ProfileRegistry(settings.RESOURCES_DIR,
+                           settings.PROFILE_ARTIFACT_DIR, settings.SAMPLES_DIR)
+
+
+class FastJSONResponse(Response):
+    """ A JSON response that is serialized with json_codec.dumps. """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+executor = MappingExecutor(settings.MAPPER_BACKEND, settings.MAPPER_WORKERS,
+                           settings.MAPPER_QUEUE_SIZE)
+
+# The worker processes of /mapper/batch, shared by every batch. The batches
+# limit their own chunks in flight, so nothing waits in its queue.
+batch_executor = MappingExecutor("process", settings.BATCH_WORKERS, 0)
+
+result_cache = create_result_cache(settings.RESULT_CACHE,
+                                   settings.RESULT_CACHE_SIZE,
+                                   settings.RESULT_CACHE_MAX_BYTES,
+                                   settings.RESULT_CACHE_PATH)
+
+
+def mapper_version() -> str:
+    """ Returns the version of the service, which is part of result keys. """
+    try:
+        return get_version()
+    except OSError:
+        return "dev"
+
+
+class Readiness:
+    """ The state of the warm-up of the service.
+
+    Attributes
+    ----------
+    ready:
+        True once the profiles are loaded and warmed up.
+    profiles:
+        The names of the profiles that were warmed up.
+    failed:
+        The error of every profile that could not be warmed up, by its name.
+        These profiles are loaded again when they are first used.
+    error:
+        The error of the last warm-up that failed, which is tried again, or
+        None.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.profiles = []
+        self.failed = {}
+        self.error = None
+
+
+readiness = Readiness()
+
+
+def warm_up() -> tuple:
+    """ Loads and warms up every profile and starts the mapping workers.
+
+    :return: the names of the profiles that were warmed up and the errors
+        of the ones that failed.
+    """
+    mapper_version()
+    warmed, failed = profiles.warm_up()
+    executor.start()
+    return warmed, failed
+
+
+async def run_warm_up():
+    """ Runs the warm-up until it succeeds. """
+    while True:
+        try:
+            readiness.profiles, readiness.failed = await run_in_threadpool(
+                warm_up)
+        except Exception as e:
+            readiness.error = f"{type(e).__name__}: {e}"
+            await asyncio.sleep(settings.WARM_UP_RETRY_DELAY)
+            continue
+        readiness.error = None
+        readiness.ready = True
+        return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if batch_executor.workers > 1:
+        # Forked before the server handles requests.
+        batch_executor.start()
+    if settings.PRELOAD_PROFILES:
+        warm_up_task = asyncio.create_task(run_warm_up())
+    else:
+        readiness.ready = True
+        warm_up_task = None
+    yield
+    if warm_up_task is not None:
+        # A warm-up that is running is finished, a retry is not started.
+        warm_up_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await warm_up_task
+    executor.shutdown()
+    batch_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+phase_metrics = PhaseMetrics(settings.METRICS_MAX_LABELS)
+app.add_middleware(ServerTimingMiddleware, metrics=phase_metrics)
+app.add_middleware(DecompressionMiddleware,
+                   max_size=settings.MAX_DECOMPRESSED_SIZE)
+app.add_middleware(CompressionMiddleware,
+                   encodings=settings.RESPONSE_COMPRESSION,
+                   min_size=settings.COMPRESSION_MIN_SIZE,
+                   levels={"gzip": settings.GZIP_LEVEL,
+                           "zstd": settings.ZSTD_LEVEL})
+
+
+def get_profile(name: str):
+    try:
+        return profiles.get(name)
+    except KeyError:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown mapping profile: {name}")
 
 
 @app.get("/version")
@@ -13,11 +173,520 @@ async def info():
     return {"version": result}
 
 
+@app.get("/ready")
+async def ready():
+    """ Returns 200 once the service is warmed up, before that 503. """
+    content = {"ready": readiness.ready, "profiles": readiness.profiles,
+               "failed": readiness.failed, "error": readiness.error}
+    return JSONResponse(content, status_code=200 if readiness.ready else 503)
+
+
+@app.get("/mapping-cache")
+async def mapping_cache_stats():
+    return utils.MAPPING_CACHE.stats()
+
+
+@app.get("/mapper-queue")
+async def mapper_queue_stats():
+    return executor.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    body = phase_metrics.render()
+    if result_cache is not None:
+        body += render_result_cache(
+            await run_in_threadpool(result_cache.stats))
+    return Response(body, media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+@app.get("/path-stats")
+async def path_stats_report():
+    """ Returns the statistics of every path per profile or mapping. """
+    return {"enabled": settings.PATH_STATS, "mappings": PATH_STATS.report()}
+
+
+@app.delete("/path-stats")
+async def clear_path_stats():
+    PATH_STATS.clear()
+    return {"enabled": settings.PATH_STATS, "mappings": {}}
+
+
+@app.get("/result-cache")
+async def result_cache_stats():
+    if result_cache is None:
+        return {"backend": "none"}
+    return result_cache.stats()
+
+
+@app.delete("/result-cache")
+async def clear_result_cache():
+    if result_cache is not None:
+        await run_in_threadpool(result_cache.clear)
+    return await result_cache_stats()
+
+
+@app.get("/profiles")
+def list_profiles():
+    return {"profiles": profiles.names()}
+
+
+class RequestBodyReader:
+    """ A file-like object to read the request body from a worker thread. """
+
+    def __init__(self, request: Request):
+        self.chunks = request.stream().__aiter__()
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return anyio.from_thread.run(self.chunks.__anext__)
+        except StopAsyncIteration:
+            return b""
+
+
+def serialize(result: dict, timings: Timings) -> bytes:
+    with timings.measure("serialize"):
+        return dumps(result)
+
+
+def new_path_stats(label: str):
+    """ Returns a PathStats if path statistics are collected, else None. """
+    return PathStats(label) if settings.PATH_STATS else None
+
+
+def map_input(metadata, template, mapping, timings: Timings = None,
+              delta_format: str = None) -> tuple:
+    """ Maps a record with a template and mapping from the request.
+
+    :return: a (JSON body, Timings, PathStats) tuple. The timings are
+        labelled with the template digest, the PathStats is None if path
+        statistics are not collected.
+    """
+    timings = timings or Timings()
+    with timings.measure("compile"):
+        plan = get_template_plan(template)
+        mapping = utils.get_compiled_mapping(mapping)
+    timings.label = f"template:{(plan.digest or 'inline')[:12]}"
+    path_stats = new_path_stats(mapping_label(mapping))
+    result = map_output(metadata, plan, mapping, delta_format, timings,
+                        path_stats)
+    return serialize(result, timings), timings, path_stats
+
+
+def remap_input(input_data: RemapInput) -> tuple:
+    """ Updates a previous result after its template or mapping changed. """
+    timings = Timings()
+    with timings.measure("compile"):
+        plan = get_template_plan(input_data.template)
+        mapping = utils.get_compiled_mapping(input_data.mapping)
+    timings.label = f"template:{(plan.digest or 'inline')[:12]}"
+    with timings.measure("remap"):
+        result, _ = remap(input_data.previous, input_data.metadata, plan,
+                          mapping, input_data.previous_template,
+                          input_data.previous_mapping)
+    return serialize(result, timings), timings, None
+
+
+def map_raw_input(body: bytes, delta_format: str = None) -> tuple:
+    timings = Timings()
+    with timings.measure("parse"):
+        input_data = parse_input(body)
+    return map_input(input_data["metadata"], input_data["template"],
+                     input_data["mapping"], timings, delta_format)
+
+
+def map_profile_metadata(name: str, metadata,
+                         delta_format: str = None) -> tuple:
+    mapping_profile = profiles.get(name)
+    timings = Timings(name)
+    path_stats = new_path_stats(name)
+    result = map_output(metadata, mapping_profile.plan,
+                        mapping_profile.mapping, delta_format, timings,
+                        path_stats)
+    return serialize(result, timings), timings, path_stats
+
+
+def map_extracted_metadata(stream, mapping_profile,
+                           delta_format: str = None) -> tuple:
+    timings = Timings(mapping_profile.name)
+    with timings.measure("extract"):
+        metadata = extract(stream, mapping_profile.mapping)
+    path_stats = new_path_stats(mapping_profile.name)
+    result = map_output(metadata, mapping_profile.plan,
+                        mapping_profile.mapping, delta_format, timings,
+                        path_stats)
+    return serialize(result, timings), timings, path_stats
+
+
+def json_response(request: Request, body: bytes, timings: Timings,
+                  path_stats: PathStats = None) -> Response:
+    """ Returns a mapped body, reporting its timings on the request. """
+    request.state.timings.merge(timings)
+    if path_stats is not None:
+        PATH_STATS.merge(path_stats)
+    return Response(body, media_type=FastJSONResponse.media_type)
+
+
+async def run_mapping(request: Request, function, *args) -> Response:
+    """ Runs a mapping job in the executor, answers 503 when it is full.
+
+    The time between receiving the request and running the job is recorded
+    as the 'parse' phase, the time the job took in the executor, including
+    the time it waited for a worker, as the 'execute' phase.
+    """
+    request_timings = request.state.timings
+    request_timings.add("parse", perf_counter() - request_timings.start)
+    try:
+        with request_timings.measure("execute"):
+            body, timings, path_stats = await executor.run(function,
+                                                           *args)
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except utils.MappingError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return json_response(request, body, timings, path_stats)
+
+
+def overloaded_error(error: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=str(error),
+        headers={"Retry-After": str(settings.MAPPER_RETRY_AFTER)}
+    )
+
+
+async def stream_mapping(metadata, template, mapping, stats_label: str):
+    """ Maps a record while its JSON is sent, holding a worker slot. """
+    path_stats = new_path_stats(stats_label)
+    chunks = iter_record_json(metadata, template, mapping,
+                              settings.STREAM_CHUNK_SIZE,
+                              path_stats=path_stats)
+    try:
+        async with executor.slot():
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+    finally:
+        if path_stats is not None:
+            PATH_STATS.merge(path_stats)
+
+
+async def resume_chunks(first_chunk: bytes, chunks):
+    """ Yields first_chunk and then the rest of chunks. """
+    try:
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+async def streamed_response(metadata, template, mapping, stats_label: str,
+                            delta_format: str = None) -> StreamingResponse:
+    """ Returns a response that is mapped while it is sent.
+
+    The result is never in memory as a whole, but it is not cached and has
+    no Server-Timing header. The first chunk is mapped before the response
+    is started, so an error in it is answered with an error status. An
+    error after that aborts the response before its end. A delta is small,
+    so it is not streamed.
+    """
+    if delta_format is not None:
+        raise HTTPException(status_code=422,
+                            detail="stream can not be combined with delta")
+    try:
+        executor.check_admission()
+    except Overloaded as e:
+        raise overloaded_error(e)
+    chunks = stream_mapping(metadata, template, mapping, stats_label)
+    try:
+        first_chunk = await chunks.__anext__()
+    except utils.MappingError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return StreamingResponse(resume_chunks(first_chunk, chunks),
+                             media_type=FastJSONResponse.media_type)
+
+
+def result_kind(kind: str, delta_format: str = None) -> str:
+    """ Returns the kind of a result key, which differs per delta format. """
+    return kind if delta_format is None else f"{kind}:delta-{delta_format}"
+
+
+def input_result_key(metadata, template, mapping,
+                     delta_format: str = None) -> str:
+    return result_key(mapper_version(), result_kind("mapper", delta_format),
+                      content_hash(metadata),
+                      get_template_plan(template).digest,
+                      utils.get_compiled_mapping(mapping).digest)
+
+
+def raw_result_key(body: bytes, delta_format: str = None) -> str:
+    return result_key(mapper_version(), result_kind("raw", delta_format),
+                      hashlib.sha256(body).hexdigest())
+
+
+def profile_result_key(name: str, metadata, delta_format: str = None) -> str:
+    mapping_profile = profiles.get(name)
+    return result_key(mapper_version(), result_kind("profile", delta_format),
+                      content_hash(metadata), mapping_profile.plan.digest,
+                      mapping_profile.mapping.digest)
+
+
+async def run_cached_mapping(request: Request, key_function, key_args: tuple,
+                             function, *args) -> Response:
+    """ Runs a mapping job, unless its result is known or cached.
+
+    Without a result cache this is run_mapping. With a result cache the key
+    of the result is the hash of the inputs, which is sent as the ETag. A
+    request with a matching If-None-Match header gets a 304 response and a
+    cached result is returned without running the job.
+    """
+    if result_cache is None:
+        return await run_mapping(request, function, *args)
+
+    timings = request.state.timings
+    with timings.measure("cache"):
+        key = await run_in_threadpool(key_function, *key_args)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        body = await run_in_threadpool(result_cache.get, key)
+
+    if body is not None:
+        response = Response(body, media_type=FastJSONResponse.media_type)
+    else:
+        response = await run_mapping(request, function, *args)
+        await run_in_threadpool(result_cache.set, key, response.body)
+    response.headers["ETag"] = etag
+    return response
+
+
+async def iterate_list(items):
+    for item in items:
+        yield item
+
+
+async def map_batch_lines(records, template, mapping, stats_label: str,
+                          delta_format: str = None):
+    """ Maps the records one by one and yields the NDJSON result lines. """
+    path_stats = new_path_stats(stats_label)
+    index = 0
+    try:
+        async for record in records:
+            yield await run_in_threadpool(map_batch_record, index, record,
+                                          template, mapping, path_stats,
+                                          delta_format)
+            index += 1
+    finally:
+        if path_stats is not None:
+            PATH_STATS.merge(path_stats)
+
+
+async def stream_batch(records, template, mapping, stats_label: str,
+                       delta_format: str = None):
+    """ Yields the NDJSON result lines of a batch.
+
+    With more than one batch worker the records are mapped by the worker
+    processes of batch_executor, otherwise they are mapped in the server
+    process.
+    """
+    index = 0
+    try:
+        if batch_executor.workers > 1:
+            if not settings.PATH_STATS:
+                stats_label = None
+            with MappingPool(template, mapping, batch_executor.workers,
+                             stats_label=stats_label,
+                             delta_format=delta_format,
+                             executor=batch_executor.get_executor()) as pool:
+                async for line in pool.map_async(records):
+                    yield line
+                    index += 1
+        else:
+            async for line in map_batch_lines(records, template, mapping,
+                                              stats_label, delta_format):
+                yield line
+                index += 1
+    except BatchError as e:
+        yield json.dumps({"index": index, "error": str(e)}).encode() + b"\n"
+
+
+async def spool_body(request: Request) -> SpooledTemporaryFile:
+    """ Reads the whole body of a request into a temporary file.
+
+    A streamed response listens for the disconnect of the client on the
+    same channel the body is received on, so a body that is still read
+    while the response is sent loses its chunks to that listener. The body
+    is kept in memory up to BATCH_SPOOL_SIZE bytes and written to disk
+    after that.
+    """
+    body = SpooledTemporaryFile(max_size=settings.BATCH_SPOOL_SIZE)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(body.write, chunk)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+
+async def iter_file_chunks(file, chunk_size: int = 65536):
+    """ Yields the chunks of a file, read in the threadpool, and closes it.
+    """
+    with file:
+        while True:
+            chunk = await run_in_threadpool(file.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def read_batch_header(records) -> dict:
+    """ Reads the template and mapping from the first line of a batch. """
+    try:
+        header = json.loads(await records.__anext__())
+    except (StopAsyncIteration, BatchError, ValueError):
+        header = None
+    if not isinstance(header, dict) or "template" not in header or \
+            "mapping" not in header:
+        raise HTTPException(
+            status_code=422,
+            detail="The first NDJSON line must contain a template and mapping"
+        )
+    return header
+
+
 # TODO: use Response model
 @app.post("/mapper")
-def map_metadata(input_data: Input):
-    mapper = MetadataMapper(input_data.metadata, input_data.template,
-                            input_data.mapping)
-    mapper.map_metadata()
-    mapper.remove_empty_fields()
-    return mapper.template
+async def map_metadata(input_data: Input, request: Request,
+                       stream: bool = False,
+                       delta: DeltaFormat | None = None):
+    inputs = (input_data.metadata, input_data.template, input_data.mapping)
+    if stream:
+        mapping = await run_in_threadpool(utils.get_compiled_mapping,
+                                          input_data.mapping)
+        return await streamed_response(input_data.metadata,
+                                       input_data.template, mapping,
+                                       mapping_label(mapping), delta)
+    return await run_cached_mapping(request, input_result_key,
+                                    (*inputs, delta), map_input, *inputs,
+                                    None, delta)
+
+
+@app.post("/mapper/raw", response_class=FastJSONResponse)
+async def map_raw_metadata(request: Request,
+                           delta: DeltaFormat | None = None):
+    """ Maps metadata like /mapper, without validating the body with Pydantic.
+
+    The body is parsed and the result is serialized with orjson when it is
+    installed.
+    """
+    body = await request.body()
+    try:
+        return await run_cached_mapping(request, raw_result_key,
+                                        (body, delta), map_raw_input, body,
+                                        delta)
+    except InputError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/mapper/remap")
+async def remap_metadata(input_data: RemapInput, request: Request):
+    """ Updates a previous result after the template or mapping changed.
+
+    Only the fields that depend on a changed mapping key or template field
+    are mapped again, the other fields are copied from the previous result.
+    """
+    try:
+        return await run_mapping(request, remap_input, input_data)
+    except RemapError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/mapper/batch")
+async def map_metadata_batch(request: Request, profile: str | None = None,
+                             delta: DeltaFormat | None = None):
+    """ Maps a batch of records and streams the results back as NDJSON.
+
+    The records are either the 'metadata' list of a JSON body, or the lines
+    of an NDJSON body. Without a profile the template and mapping are taken
+    from the JSON body or from the first NDJSON line.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        body = await spool_body(request)
+        records = iter_ndjson_lines(iter_file_chunks(body),
+                                    settings.BATCH_MAX_LINE_SIZE)
+        source = None if profile else await read_batch_header(records)
+    else:
+        try:
+            batch_input = BatchInput.model_validate(await request.json())
+        except (ValidationError, ValueError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        records = iterate_list(batch_input.metadata)
+        source = {"template": batch_input.template,
+                  "mapping": batch_input.mapping}
+
+    if profile:
+        mapping_profile = get_profile(profile)
+        template = mapping_profile.plan
+        mapping = mapping_profile.mapping
+        stats_label = profile
+    elif source["template"] is None or source["mapping"] is None:
+        raise HTTPException(
+            status_code=422,
+            detail="A batch needs a profile or a template and mapping"
+        )
+    else:
+        try:
+            template = get_template_plan(source["template"])
+            mapping = utils.get_compiled_mapping(source["mapping"])
+        except Exception as e:
+            raise HTTPException(status_code=422,
+                                detail=f"Invalid template or mapping: {e}")
+        stats_label = mapping_label(mapping)
+
+    return StreamingResponse(
+        stream_batch(records, template, mapping, stats_label, delta),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@app.post("/mapper/{profile}")
+async def map_metadata_with_profile(profile: str, input_data: ProfileInput,
+                                    request: Request, stream: bool = False,
+                                    delta: DeltaFormat | None = None):
+    mapping_profile = get_profile(profile)
+    if stream:
+        return await streamed_response(input_data.metadata,
+                                       mapping_profile.plan,
+                                       mapping_profile.mapping, profile,
+                                       delta)
+    inputs = (profile, input_data.metadata, delta)
+    return await run_cached_mapping(request, profile_result_key, inputs,
+                                    map_profile_metadata, *inputs)
+
+
+@app.post("/mapper/{profile}/extract")
+async def map_metadata_with_extraction(profile: str, request: Request,
+                                       delta: DeltaFormat | None = None):
+    """ Maps the raw metadata in the request body with a profile.
+
+    The body is parsed while it is received and only the parts of the
+    metadata that the mapping of the profile reads are kept. The body can
+    not be sent to a worker process, so the mapping runs in a thread that
+    holds a worker slot of the executor, like a streamed response.
+    """
+    mapping_profile = get_profile(profile)
+    try:
+        executor.check_admission()
+    except Overloaded as e:
+        raise overloaded_error(e)
+    try:
+        with request.state.timings.measure("execute"):
+            async with executor.slot():
+                body, timings, path_stats = await run_in_threadpool(
+                    map_extracted_metadata, RequestBodyReader(request),
+                    mapping_profile, delta)
+    except ExtractError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return json_response(request, body, timings, path_stats)
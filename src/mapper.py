@@ -1,8 +1,13 @@
-import copy
+from time import perf_counter
 from typing import Any
-from fastapi import HTTPException
 
 import utils
+from paths import Resolver
+from plan import EMPTY_VALUES, FieldPlan, as_field_plan, get_template_plan
+from timing import NO_TIMINGS
+
+# Nested fields with these values are removed from the rows of a compound.
+EMPTY_NESTED_VALUES = ('', [])
 
 
 class MetadataMapper:
@@ -24,52 +29,112 @@ class MetadataMapper:
                         compound (the value contains one or more nested fields)
             multiple  - a boolean that states if the value is a list or not
             value     - the actual value of the field
+        After map_metadata the template is the filled out template.
+    plan:
+        The template compiled to a TemplatePlan. The filled out template is
+        built from the plan, so the template given to the mapper is never
+        changed and can be reused. Plans are kept in the template cache.
     mapping:
         A dictionary that has the typeName of a field in the template as a key,
         and a list of paths to corresponding values in the input metadata
         as the value. For example: "title": "path/to/the/value/in/metadata".
+        The mapping is cleaned and compiled once and then taken from the
+        mapping cache for every mapper created with the same mapping.
+    prune_empty_fields:
+        If True, empty fields, empty nested fields and empty rows of multiple
+        compounds are left out while the template is filled out. The result
+        is the same as calling remove_empty_fields after map_metadata, without
+        the second pass over the result.
+    resolver:
+        Searches the paths of the mapping in the metadata. Paths that share a
+        prefix only resolve that prefix once.
+    timings:
+        Records the time spent compiling, mapping the header, the blocks and
+        the compounds within the blocks. Nothing is recorded by default.
+    path_stats:
+        A PathStats that records every search of a path of the mapping, or
+        None to not collect path statistics.
+    compact_compounds:
+        If True, the rows of a compound have the values of the nested fields
+        instead of the nested field dictionaries, as in a values delta.
     """
 
     def __init__(self, metadata: list | dict | Any,
                  template: list | dict | Any,
-                 mapping: list | dict | Any):
+                 mapping: list | dict | Any,
+                 prune_empty_fields: bool = False, timings=None,
+                 path_stats=None, compact_compounds: bool = False):
         self.metadata = metadata
-        self.mapping = utils.clean_mapping(mapping)
+        self.prune_empty_fields = prune_empty_fields
+        self.compact_compounds = compact_compounds
+        self.timings = timings or NO_TIMINGS
+        self.path_stats = path_stats
+        with self.timings.measure("compile"):
+            self.mapping = utils.get_compiled_mapping(mapping)
+            self.plan = get_template_plan(template)
+            self._mapped_fields = self.plan.mapped_fields(self.mapping)
         self.template = template
+        self.resolver = Resolver(metadata)
+        self._object_resolver = None
+
+    @property
+    def mapped_fields(self) -> tuple:
+        """ The header keys and the positions of the fields per block that
+        are visited when empty fields are pruned, see
+        TemplatePlan.mapped_fields. """
+        return self._mapped_fields
+
+    def get_resolver(self, metadata):
+        """ Returns a resolver for metadata other than the input metadata.
+
+        The resolver of the last object is kept, so all children of a
+        compound that are mapped from the same object share the resolver.
+        """
+        if metadata is self.metadata:
+            return self.resolver
+        if self._object_resolver is None or \
+                self._object_resolver.data is not metadata:
+            self._object_resolver = Resolver(metadata)
+        return self._object_resolver
 
     def map_metadata(self):
         """ Maps the source metadata to a dataverse template.
 
         First maps all fields in the top level of the dataverse metadata.
         After maps the metadataBlocks inside the dataverseVersion field.
+        The filled out template is built from the template plan, the template
+        that was given to the mapper is not changed.
 
         :return: The mapped metadata, specificly the filled out template.
         """
-        self.map_metadata_header()
-        self.map_metadata_blocks()
+        with self.timings.measure("header"):
+            header = self.map_metadata_header()
+        with self.timings.measure("blocks"):
+            fields = self.map_metadata_blocks()
+        self.template = self.plan.build(header, fields)
         return self.template
 
     def map_metadata_header(self):
         """ Maps the source to the header of the dataverse template
 
-        First, the top level of the dictionary is mapped to the template.
-        After, the values inside the datasetVersion dictionary are mapped.
+        The header consists of the keys in the top level of the template and
+        the keys inside the datasetVersion dictionary.
 
         This excludes the mapping of the metadataBlocks inside datasetVersion.
         This is done in the map_metadata_blocks method.
-        """
 
-        self.process_dictionary(self.template)
-        dataset_version = self.template["datasetVersion"]
-        self.process_dictionary(dataset_version)
+        Only the header keys in the mapping are visited, the others keep
+        the value of the template.
 
-    def process_dictionary(self, dictionary):
-        """ Maps all values in a give dict (data) """
-        for key, value in dictionary.items():
-            if key in self.mapping:
-                mapped_values = self.map_value(key)
-                if mapped_values:
-                    dictionary[key] = self.map_value(key)[0]
+        :return: a dictionary with the mapped values of the header keys.
+        """
+        header = {}
+        header_keys, _ = self._mapped_fields
+        for key in header_keys:
+            mapped_values = self.map_value(key)
+            if mapped_values:
+                header[key] = mapped_values[0]
+        return header
 
     def map_metadata_blocks(self):
         """ Maps the values in the metadata on to the template
@@ -78,25 +143,52 @@ class MetadataMapper:
         template. For every field in the template it determines the type and
         maps the value accordingly.
 
-        :return: the template with the mapped values.
+        When empty fields are pruned, only the fields that are mapped or have
+        a value in the template are visited, found with the field index of
+        the template plan. Every other field would be left out anyway.
+
+        :return: a dictionary with the list of mapped fields per block name.
         """
-        metadata_blocks = self.template["datasetVersion"]["metadataBlocks"]
-        for template_fields in metadata_blocks.values():
-            for field in template_fields["fields"]:
-                # guard clause for singular default values
-                if field['value'] and field['typeClass'] != 'compound' and \
-                        not field['multiple']:
-                    continue
-                elif field['typeClass'] == 'compound':
-                    self.map_compound(field)
-                # guard clause to skip unmappable primitives
-                elif not self.map_value(field['typeName']):
-                    continue
-                elif field['multiple']:
-                    field['value'].extend(self.map_value(field['typeName']))
-                else:
-                    field['value'] = self.map_value(field['typeName'])[0]
-        return self.template
+        return {name: list(self.iter_block_fields(name, fields))
+                for name, _, fields in self.plan.blocks}
+
+    def iter_block_fields(self, name: str, fields: tuple):
+        """ Maps the fields of a metadata block one at a time.
+
+        :param name: the name of the metadata block.
+        :param fields: the FieldPlans of the fields of the block.
+        :return: a generator of the mapped field dictionaries.
+        """
+        if self.prune_empty_fields:
+            _, positions = self._mapped_fields
+            fields = [fields[position] for position in positions[name]]
+        for field in fields:
+            value = self.map_field_value(field)
+            if self.prune_empty_fields and value in EMPTY_VALUES:
+                continue
+            yield field.build(value)
+
+    def map_field_value(self, field: FieldPlan):
+        """ Returns the mapped value of a field in the template.
+
+        :param field: the plan of the field in the template.
+        :return: the value of the field.
+        """
+        # guard clause for singular default values
+        if field.default and field.type_class != 'compound' and \
+                not field.multiple:
+            return field.default_value()
+        if field.type_class == 'compound':
+            with self.timings.measure("compounds"):
+                return self.map_compound(field)
+
+        mapped_values = self.map_value(field.type_name)
+        # guard clause to skip unmappable primitives
+        if not mapped_values:
+            return field.default_value()
+        if field.multiple:
+            return field.default_value() + mapped_values
+        return mapped_values[0]
 
     def map_value(self, type_name: str, mapping: dict = None,
                   metadata: dict = None):
@@ -116,14 +208,40 @@ class MetadataMapper:
             mapping = self.mapping
 
         if metadata is None:
-            metadata = self.metadata
+            resolver = self.resolver
+        else:
+            resolver = self.get_resolver(metadata)
 
         if type_name not in mapping:
             return []
+        return self.search_paths(type_name, mapping[type_name], resolver)
+
+    def search_path(self, type_name: str, path, resolver):
+        """ Returns the value found at a single path of a field, recording
+        the search in the path statistics.
 
+        :param type_name: the name of the field in the template.
+        :param path: the compiled path mapped to the field.
+        :param resolver: the Resolver of the metadata to search.
+        """
+        if self.path_stats is None:
+            return resolver.search(path)
+        start = perf_counter()
+        value = resolver.search(path)
+        self.path_stats.record(type_name, path, perf_counter() - start, value)
+        return value
+
+    def search_paths(self, type_name: str, paths: list, resolver) -> list:
+        """ Returns all values found at the paths of a field.
+
+        :param type_name: the name of the field in the template.
+        :param paths: the compiled paths mapped to the field.
+        :param resolver: the Resolver of the metadata to search.
+        :return: a list of values belonging to the field.
+        """
         mapped_values = []
-        for path in mapping[type_name]:
-            mapped_value = utils.drill_down(metadata, path)
+        for path in paths:
+            mapped_value = self.search_path(type_name, path, resolver)
             if not mapped_value:
                 continue
             if isinstance(mapped_value, list):
@@ -132,7 +250,7 @@ class MetadataMapper:
                 mapped_values.append(mapped_value)
         return mapped_values
 
-    def map_compound(self, field: dict):
+    def map_compound(self, field: FieldPlan | dict):
         """ This method handles the different ways of mapping to a compound.
 
         There are currently three different ways of mapping to a compound.
@@ -148,20 +266,21 @@ class MetadataMapper:
         but to just take the first item in every list for every child field.
 
         :param field: The compound field that requires mapping.
+        :return: The value of the compound field.
         """
-        if field['typeName'] in self.mapping and isinstance(
-                self.mapping[field['typeName']], dict):
+        field = as_field_plan(field)
+        if field.type_name in self.mapping and isinstance(
+                self.mapping[field.type_name], dict):
             results = self.map_object_onto_compound(field)
-            if not field['multiple']:
-                field['value'] = results[0] if results else {}
-            else:
-                field['value'] = results
-        elif not field['multiple']:
-            field['value'] = self.map_compound_field(field)
+            if not field.multiple:
+                return results[0] if results else {}
+            return results
+        elif not field.multiple:
+            return self.map_compound_field(field)
         else:
-            field['value'] = self.map_compound_multiple_field(field)
+            return self.map_compound_multiple_field(field)
 
-    def map_object_onto_compound(self, field: dict):
+    def map_object_onto_compound(self, field: FieldPlan | dict):
         """ Maps an entire object from the source metadata to a compound.
 
         This method maps an entire object retrieved from the source
@@ -173,43 +292,49 @@ class MetadataMapper:
         :param field: The compound to map an object onto.
         :return: List of instances of the compound that was mapped.
         """
-        compound_mapping = self.mapping[field['typeName']]
-        compound_objects = utils.drill_down(
-            self.metadata,
-            compound_mapping['mapping']
-        )
+        field = as_field_plan(field)
+        compound_mapping = self.mapping[field.type_name]
+        compound_objects = self.search_path(
+            field.type_name, compound_mapping['mapping'], self.resolver)
         if compound_objects is None:
             return []
         child_mappings = compound_mapping['children']
+        children = [(key, child, child_mappings.get(child.type_name, ()))
+                    for key, child in field.children]
+        # Only the rows of multiple compounds are pruned, like
+        # remove_empty_fields does.
+        prune = self.prune_empty_fields and field.multiple
         result_dict_list = []
         for compound_object in compound_objects:
-            # Make a copy of the template object to use for mapping to.
-            template_value = field['value']
-            if isinstance(template_value, list):
-                compound_template_children = copy.deepcopy(template_value[0])
-            else:
-                compound_template_children = copy.deepcopy(template_value)
-            for _, child in compound_template_children.items():
-                type_name = child['typeName']
-                mapped_values = self.map_value(type_name, child_mappings,
-                                               compound_object)
-                self.set_child_value(child, mapped_values)
-            dict_copy = copy.deepcopy(compound_template_children)
-            result_dict_list.append(dict_copy)
+            # One resolver per object, shared by all of its children.
+            resolver = Resolver(compound_object)
+            result_dict = {}
+            for key, child, paths in children:
+                mapped_values = self.search_paths(child.type_name, paths,
+                                                  resolver)
+                value = self.get_child_value(child, mapped_values)
+                if prune and value in EMPTY_NESTED_VALUES:
+                    continue
+                result_dict[key] = value if self.compact_compounds else \
+                    child.build(value)
+            if result_dict or not prune:
+                result_dict_list.append(result_dict)
         return result_dict_list
 
-    def set_child_value(self, child, mapped_values):
-        """ Sets the retrieved child values in the compound field.
+    @staticmethod
+    def get_child_value(child: FieldPlan, mapped_values: list):
+        """ Returns the value of a child field in the compound field.
 
         :param child: The child field in the compound field.
-        :param mapped_values: The values to be added to the child field.
+        :param mapped_values: The values retrieved for the child field.
         """
-        if child['multiple']:
-            child['value'].extend(mapped_values)
+        if child.multiple:
+            return child.default_value() + mapped_values
         elif mapped_values:
-            child['value'] = mapped_values[0]
+            return mapped_values[0]
+        return child.default_value()
 
-    def map_compound_field(self, compound_template_field: dict):
+    def map_compound_field(self, compound_template_field: FieldPlan | dict):
         """ Maps compound field where only a single nested object is expected.
 
         A compound field that is not a multiple will have a single dictionary
@@ -223,18 +348,22 @@ class MetadataMapper:
         :param compound_template_field: the field containing the nested fields.
         :return: a dictionary containing the nested fields with mapped values.
         """
+        compound_template_field = as_field_plan(compound_template_field)
+        compact = self.compact_compounds
         result_dict = {}
-        for k, v in compound_template_field['value'].items():
-            if v['value']:
-                result_dict[k] = v
-                continue
-            mapped_value = self.map_value(v['typeName'])
-            if mapped_value:
-                v['value'] = mapped_value[0]
-                result_dict[k] = v
+        for k, v in compound_template_field.children:
+            if v.default:
+                value = v.default_value()
+            else:
+                mapped_value = self.map_value(v.type_name)
+                if not mapped_value:
+                    continue
+                value = mapped_value[0]
+            result_dict[k] = value if compact else v.build(value)
         return result_dict
 
-    def map_compound_multiple_field(self, compound_template_field: dict):
+    def map_compound_multiple_field(self,
+                                    compound_template_field: FieldPlan | dict):
         """ Maps compound field where the value of the field can have a list of
         dictionaries that contain nested fields.
 
@@ -244,18 +373,18 @@ class MetadataMapper:
         This list dictionary is used to create the result dictionary list.
         This list contains all dictionaries with sets of nested fields.
 
-        TODO: Handle empty nested field values by removing them.
         :param compound_template_field: a compound field from the template.
         :return: a list of dictionaries with sets of nested fields.
         """
-        compound_dict = compound_template_field['value'][0]
-        list_dict = self.create_mapped_value_list_dict(compound_dict)
-        template_dict_copy = copy.deepcopy(compound_dict)
-        result_dict_list = self.create_result_dict_list(list_dict,
-                                                        template_dict_copy)
+        compound_template_field = as_field_plan(compound_template_field)
+        children = compound_template_field.children
+        list_dict = self.create_mapped_value_list_dict(children)
+        result_dict_list = self.create_result_dict_list(
+            list_dict, dict(children), self.prune_empty_fields,
+            self.compact_compounds)
         return result_dict_list
 
-    def create_mapped_value_list_dict(self, compound_dict: dict):
+    def create_mapped_value_list_dict(self, children: tuple):
         """ Creates a dictionary to use for filling the nested fields.
 
         Loops through all nested fields in the compound. For a field name
@@ -263,42 +392,46 @@ class MetadataMapper:
         If there is already a default value in place, the value is added to the
         list.
 
-        :param compound_dict: The nested fields for mapping values to.
+        :param children: The (key, FieldPlan) pairs of the nested fields.
         :return: a dictionary where the key is the name of a nested field
         and the value is a list of all values belonging to that nested field.
         """
         list_dict = {}
-        for k, v in compound_dict.items():
-            list_dict[k] = []
-            if v['value']:
-                list_dict[k].append(v['value'])
+        for k, v in children:
+            if v.default:
+                list_dict[k] = [v.default_value()]
                 continue
-            mapped_value = self.map_value(v['typeName'])
-            if mapped_value:
-                list_dict[k].extend(mapped_value)
+            list_dict[k] = self.map_value(v.type_name)
         return list_dict
 
     @staticmethod
-    def create_result_dict_list(list_dict: dict, template_dict):
+    def create_result_dict_list(list_dict: dict, children: dict,
+                                prune: bool = False, compact: bool = False):
         """ Creates the nested field dictionaries to be used as the compound
         field value.
 
-        TODO: Merging the dicts could made to be more efficient.
+        Every nested field is built from its FieldPlan, so no copies of the
+        template are needed. The dictionaries are filled one nested field at
+        a time, so the work is linear in the number of values, also when the
+        lists differ a lot in length.
         :param list_dict: a dictionary where the key is the name of a nested field
         and the value is a list of all values belonging to that nested field.
-        :param template_dict: The nested fields for mapping values to.
+        :param children: The FieldPlan of every nested field by its key.
+        :param prune: leave out empty nested fields and empty dictionaries.
+        :param compact: use the values instead of nested field dictionaries.
         :return:
         """
-        result_dict_list = []
         longest_list_length = max(len(item) for item in list_dict.values())
-        for index in range(longest_list_length):
-            result_dict = {}
-            for k, v in list_dict.items():
-                if 0 <= index < len(v):
-                    template_dict[k]['value'] = v[index]
-                    result_dict[k] = template_dict[k]
-            dict_copy = copy.deepcopy(result_dict)
-            result_dict_list.append(dict_copy)
+        result_dict_list = [{} for _ in range(longest_list_length)]
+        for k, v in list_dict.items():
+            build = children[k].build
+            for result_dict, value in zip(result_dict_list, v):
+                if prune and value in EMPTY_NESTED_VALUES:
+                    continue
+                result_dict[k] = value if compact else build(value)
+        if prune:
+            return [result_dict for result_dict in result_dict_list
+                    if result_dict]
         return result_dict_list
 
     def remove_empty_fields(self):
@@ -312,18 +445,36 @@ class MetadataMapper:
                     remove_empty_compound_field(field)
             metadata_block['fields'] = [field for field in
                                         metadata_block['fields'] if
-                                        field.get('value') not in ('', [], {})]
+                                        field.get('value') not in EMPTY_VALUES]
 
 
 def remove_empty_compound_field(compoundField):
-    # TODO: leaves an empty object in the result.
     if isinstance(compoundField["value"], list):
         # Remove key-value pairs with empty "value" keys
-        compoundField["value"] = [
+        items = (
             {
                 key: value
                 for key, value in item.items()
-                if value.get("value") not in ('', [])
+                if value.get("value") not in EMPTY_NESTED_VALUES
             }
             for item in compoundField["value"]
-        ]
+        )
+        # Remove the objects that are left empty
+        compoundField["value"] = [item for item in items if item]
+
+
+def map_record(metadata, template, mapping, timings=None,
+               path_stats=None) -> dict:
+    """ Maps a single metadata record and removes the empty fields.
+
+    :param metadata: The input metadata represented as a JSON object.
+    :param template: The Dataverse JSON template or its TemplatePlan.
+    :param mapping: The mapping or a compiled mapping.
+    :param timings: Timings to record the phases of the mapping in.
+    :param path_stats: PathStats to record the searches of the paths in.
+    :return: The filled out template without empty fields.
+    """
+    mapper = MetadataMapper(metadata, template, mapping,
+                            prune_empty_fields=True, timings=timings,
+                            path_stats=path_stats)
+    return mapper.map_metadata()
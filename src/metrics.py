@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from time import perf_counter
+
+from starlette.datastructures import MutableHeaders
+
+from timing import Timings
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the buckets of the phase histograms.
+PHASE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The label of profiles and templates beyond the maximum number of labels.
+OTHER_LABEL = "other"
+
+
+class Histogram:
+    """ A Prometheus histogram of a single set of label values.
+
+    Attributes
+    ----------
+    buckets:
+        The upper bounds of the buckets, in increasing order.
+    counts:
+        The number of observations per bucket, not cumulative. The last
+        count is of the observations above the last bucket.
+    sum:
+        The sum of all observations.
+    """
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class PhaseMetrics:
+    """ Histograms of the time spent per phase, per profile or template.
+
+    Observations are made on the event loop, so no locking is needed.
+
+    Attributes
+    ----------
+    max_labels:
+        The maximum number of profile or template labels. Observations of
+        later labels are counted under the 'other' label, so templates sent
+        with the requests can not grow the metrics without a limit.
+    """
+
+    def __init__(self, max_labels: int, buckets: tuple = PHASE_BUCKETS):
+        self.max_labels = max_labels
+        self.buckets = buckets
+        self.histograms = {}
+        self._labels = set()
+
+    def observe(self, timings: Timings):
+        label = timings.label or ""
+        if label not in self._labels:
+            if len(self._labels) >= self.max_labels:
+                label = OTHER_LABEL
+            self._labels.add(label)
+        for phase, seconds in timings.phases.items():
+            histogram = self.histograms.get((phase, label))
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.histograms[(phase, label)] = histogram
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """ Returns the histograms in the Prometheus text format. """
+        name = "mapper_phase_seconds"
+        lines = [
+            f"# HELP {name} Time spent in a phase of a mapping request.",
+            f"# TYPE {name} histogram",
+        ]
+        for (phase, label), histogram in sorted(self.histograms.items()):
+            labels = f'phase="{phase}",profile="{escape_label(label)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def render_result_cache(stats: dict) -> str:
+    """ Returns the hits and misses of the result cache in the Prometheus
+    text format. """
+    name = "mapper_result_cache_lookups_total"
+    return "\n".join([
+        f"# HELP {name} Lookups of mapping results in the result cache.",
+        f"# TYPE {name} counter",
+        f'{name}{{result="hit"}} {stats["hits"]}',
+        f'{name}{{result="miss"}} {stats["misses"]}',
+    ]) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n",
+                                                                   "\\n")
+
+
+class ServerTimingMiddleware:
+    """ Measures mapping requests and reports their phases.
+
+    Every HTTP request gets a Timings object in request.state.timings. When
+    the end-point labels the timings, the phases are sent in a Server-Timing
+    header and observed in the phase metrics.
+    """
+
+    def __init__(self, app, metrics: PhaseMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        scope.setdefault("state", {})["timings"] = timings
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and \
+                    timings.label is not None:
+                timings.add("total", perf_counter() - timings.start)
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+                self.metrics.observe(timings)
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
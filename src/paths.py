@@ -0,0 +1,195 @@
+import re
+
+import jmespath
+
+# A single step of a simple path: a plain or quoted key followed by indexes.
+STEP_PATTERN = re.compile(
+    r'(?:(?P<key>[A-Za-z_][A-Za-z0-9_]*)|"(?P<quoted_key>[^"\\]+)")'
+    r'(?P<indexes>(?:\[-?[0-9]+\])*)'
+)
+INDEX_PATTERN = re.compile(r'\[(-?[0-9]+)\]')
+
+
+def parse_simple_path(path: str):
+    """
+    Returns the steps of a simple path or None if the path is not simple.
+
+    A simple path is a dotted path of plain or quoted keys where every key
+    can be followed by list indexes, for example 'a."b:c"[0].d'. Every other
+    jmespath expression, like projections and filters, is not simple.
+
+    :param path: a cleaned path.
+    :return: a tuple of keys (str) and indexes (int), or None.
+    """
+    steps = []
+    position = 0
+    while True:
+        match = STEP_PATTERN.match(path, position)
+        if match is None:
+            return None
+        steps.append(match.group("key") or match.group("quoted_key"))
+        steps.extend(int(index) for index in
+                     INDEX_PATTERN.findall(match.group("indexes")))
+        position = match.end()
+        if position == len(path):
+            return tuple(steps)
+        if path[position] != ".":
+            return None
+        position += 1
+
+
+def parse_simple_prefix(path: str):
+    """
+    Returns the steps of the longest simple prefix of a path.
+
+    The prefix is where the part of the path that is not simple is searched,
+    for example 'a.b' for 'a.b[*].c'. If the rest of the path can also read
+    data outside of the prefix, like 'a.b || c' does, the prefix is empty.
+
+    :param path: a cleaned path.
+    :return: a tuple of keys (str) and indexes (int).
+    """
+    steps = []
+    position = 0
+    while True:
+        match = STEP_PATTERN.match(path, position)
+        if match is None:
+            break
+        steps.append(match.group("key") or match.group("quoted_key"))
+        steps.extend(int(index) for index in
+                     INDEX_PATTERN.findall(match.group("indexes")))
+        position = match.end()
+        if not path.startswith(".", position) or \
+                STEP_PATTERN.match(path, position + 1) is None:
+            break
+        position += 1
+
+    rest = path[position:]
+    if rest and (rest[0] not in ".[" or "||" in rest or "&&" in rest):
+        return ()
+    return tuple(steps)
+
+
+def apply_step(value, step):
+    """ Applies a single key or index step the way jmespath does. """
+    if step.__class__ is str:
+        return value.get(step) if isinstance(value, dict) else None
+    if not isinstance(value, list):
+        return None
+    try:
+        return value[step]
+    except IndexError:
+        return None
+
+
+class PathNode:
+    """ A node in a PathTrie, every node is a step from its parent node. """
+    __slots__ = ("step", "children")
+
+    def __init__(self, step=None):
+        self.step = step
+        self.children = {}
+
+
+class SimplePath:
+    """ A compiled simple path.
+
+    Attributes
+    ----------
+    expression:
+        The path the SimplePath was compiled from.
+    nodes:
+        The nodes in the PathTrie for every step of the path.
+    """
+    __slots__ = ("expression", "nodes")
+
+    def __init__(self, expression: str, nodes: tuple):
+        self.expression = expression
+        self.nodes = nodes
+
+    def search(self, data):
+        for node in self.nodes:
+            if data is None:
+                return None
+            data = apply_step(data, node.step)
+        return data
+
+
+class PathTrie:
+    """ Compiles paths, merging the steps of simple paths in to a trie.
+
+    Simple paths that start with the same steps share the nodes of those
+    steps. A Resolver uses this to resolve a shared prefix only once per
+    document. Paths that are not simple are compiled by jmespath.
+    """
+
+    def __init__(self):
+        self.root = PathNode()
+
+    def compile(self, path: str):
+        """
+        Returns the path compiled to a SimplePath or a jmespath expression.
+
+        Both have a search method that takes the data to search.
+
+        :param path: a cleaned path.
+        """
+        steps = parse_simple_path(path)
+        if steps is None:
+            return jmespath.compile(path)
+
+        node = self.root
+        nodes = []
+        for step in steps:
+            # 0 == False and 1 == True, so the type is part of the key.
+            key = (step.__class__, step)
+            if key not in node.children:
+                node.children[key] = PathNode(step)
+            node = node.children[key]
+            nodes.append(node)
+        return SimplePath(path, tuple(nodes))
+
+
+class Resolver:
+    """ Searches compiled paths in a single document.
+
+    The value of every trie node that has been resolved is remembered, so a
+    prefix shared by several simple paths is only resolved once.
+
+    Attributes
+    ----------
+    data:
+        The document to search.
+    """
+    __slots__ = ("data", "_values")
+
+    def __init__(self, data):
+        self.data = data
+        self._values = {}
+
+    def search(self, path):
+        """
+        Returns the value found at the end of the path.
+
+        :param path: a SimplePath, a compiled jmespath expression or a string.
+        """
+        if isinstance(path, str):
+            return jmespath.search(path, self.data)
+        if path.__class__ is not SimplePath:
+            return path.search(self.data)
+
+        nodes = path.nodes
+        values = self._values
+        value = self.data
+        start = 0
+        for depth in range(len(nodes) - 1, -1, -1):
+            if nodes[depth] in values:
+                value = values[nodes[depth]]
+                start = depth + 1
+                break
+        for node in nodes[start:]:
+            if value is None:
+                return None
+            value = apply_step(value, node.step)
+            values[node] = value
+        return value
@@ -0,0 +1,147 @@
+import threading
+from collections import OrderedDict
+
+import settings
+
+
+class PathStat:
+    """ The statistics of a single path of a field in a mapping.
+
+    Attributes
+    ----------
+    evaluations:
+        The number of times the path was searched.
+    hits:
+        The number of searches that found a value that was not empty.
+    seconds:
+        The total time spent searching the path.
+    values:
+        The total number of values the hits added to the field.
+    """
+    __slots__ = ("evaluations", "hits", "seconds", "values")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.seconds = 0.0
+        self.values = 0
+
+    def merge(self, other):
+        self.evaluations += other.evaluations
+        self.hits += other.hits
+        self.seconds += other.seconds
+        self.values += other.values
+
+
+class PathStats:
+    """ Collects the statistics of the paths of one mapping.
+
+    A PathStats is not thread-safe. Every mapping job collects its own and
+    merges it into the PathStatsRegistry when it is done. PathStats are
+    picklable, so worker processes can return them.
+
+    Attributes
+    ----------
+    label:
+        The name of the profile, or the label of the mapping.
+    paths:
+        The PathStat per (typeName, path expression) tuple.
+    """
+    __slots__ = ("label", "paths")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.paths = {}
+
+    def record(self, type_name: str, path, seconds: float, value):
+        """ Records a single search of a path.
+
+        :param type_name: the field the path is mapped to.
+        :param path: the compiled path or the path string.
+        :param seconds: the time the search took.
+        :param value: the value that was found.
+        """
+        key = (type_name, getattr(path, "expression", path))
+        stat = self.paths.get(key)
+        if stat is None:
+            stat = self.paths[key] = PathStat()
+        stat.evaluations += 1
+        stat.seconds += seconds
+        if value:
+            stat.hits += 1
+            stat.values += len(value) if isinstance(value, list) else 1
+
+    def merge(self, other):
+        for key, other_stat in other.paths.items():
+            stat = self.paths.get(key)
+            if stat is None:
+                stat = self.paths[key] = PathStat()
+            stat.merge(other_stat)
+
+    def report(self) -> list:
+        """ Returns the statistics of every path, sorted by field and path.
+        """
+        report = []
+        for (type_name, path), stat in sorted(self.paths.items()):
+            report.append({
+                "typeName": type_name,
+                "path": path,
+                "evaluations": stat.evaluations,
+                "hits": stat.hits,
+                "hit_rate": stat.hits / stat.evaluations,
+                "seconds_total": stat.seconds,
+                "seconds_avg": stat.seconds / stat.evaluations,
+                "result_size_avg": (stat.values / stat.hits
+                                    if stat.hits else 0.0),
+            })
+        return report
+
+
+class PathStatsRegistry:
+    """ The path statistics of the server process, per profile or mapping.
+
+    Every mapping sent with a request gets its own label, so only the
+    statistics of the most recently used labels are kept.
+
+    Attributes
+    ----------
+    maxsize:
+        The maximum number of labels kept. When statistics of a new label
+        are added to a full registry, those of the least recently used
+        label are dropped.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def merge(self, path_stats: PathStats):
+        with self._lock:
+            stats = self._stats.get(path_stats.label)
+            if stats is None:
+                stats = PathStats(path_stats.label)
+                self._stats[path_stats.label] = stats
+                while len(self._stats) > self.maxsize:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(path_stats.label)
+            stats.merge(path_stats)
+
+    def report(self) -> dict:
+        """ Returns the report of every profile or mapping by its label. """
+        with self._lock:
+            return {label: stats.report()
+                    for label, stats in sorted(self._stats.items())}
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def mapping_label(mapping) -> str:
+    """ Returns the label of a compiled mapping that is not a profile. """
+    return f"mapping:{mapping.digest[:12]}"
+
+
+PATH_STATS = PathStatsRegistry(settings.PATH_STATS_MAX_LABELS)
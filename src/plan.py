@@ -0,0 +1,225 @@
+import copy
+
+import settings
+from cache import LRUCache, content_hash
+
+TEMPLATE_CACHE = LRUCache(settings.TEMPLATE_CACHE_SIZE)
+
+# Fields with these values are removed from the result.
+EMPTY_VALUES = ('', [], {})
+
+
+def copy_value(value):
+    """ Returns a copy of a template value that can be safely handed out. """
+    if isinstance(value, (str, bool, int, float)) or value is None:
+        return value
+    return copy.deepcopy(value)
+
+
+class FieldPlan:
+    """ Describes how to build a field of the Dataverse JSON template.
+
+    Attributes
+    ----------
+    type_name:
+        The name of the field.
+    type_class:
+        primitive, controlledVocabulary or compound.
+    multiple:
+        True if the value of the field is a list.
+    default:
+        The value of the field in the template.
+    children:
+        For compound fields, a tuple of (key, FieldPlan) pairs describing the
+        nested fields. It is empty for other fields.
+    layout:
+        The (key, value) pairs of the field in the template, with the value
+        of the 'value' key left out. Used to build the field with the keys in
+        the same order as the template.
+    type_names:
+        The typeName of the field and of its nested fields, the mapping keys
+        the value of the field can be mapped from.
+    has_default:
+        True if the field has a value when nothing is mapped to it: a field
+        with a value in the template, or a compound with a nested field that
+        has a value in the template.
+    """
+    __slots__ = ("type_name", "type_class", "multiple", "default", "children",
+                 "layout", "type_names", "has_default", "_constants")
+
+    def __init__(self, field: dict):
+        self.type_name = field.get("typeName")
+        self.type_class = field.get("typeClass")
+        self.multiple = field.get("multiple")
+        self.default = field.get("value")
+        self.layout = tuple((key, None if key == "value" else value)
+                            for key, value in field.items())
+        self._constants = dict(self.layout)
+
+        self.children = ()
+        if self.type_class == "compound":
+            nested_fields = self.default
+            if isinstance(nested_fields, list):
+                nested_fields = nested_fields[0]
+            self.children = tuple((key, FieldPlan(child))
+                                  for key, child in nested_fields.items())
+
+        self.type_names = (self.type_name,) + tuple(
+            child.type_name for _, child in self.children)
+        if self.type_class == "compound":
+            self.has_default = any(child.default
+                                   for _, child in self.children)
+        else:
+            self.has_default = self.default not in EMPTY_VALUES
+
+    def build(self, value) -> dict:
+        """ Returns a new field dictionary with the given value. """
+        field = self._constants.copy()
+        if "value" in field:
+            field["value"] = value
+        return field
+
+    def default_value(self):
+        """ Returns a copy of the value of the field in the template. """
+        return copy_value(self.default)
+
+
+def as_field_plan(field) -> FieldPlan:
+    """ Returns the FieldPlan of a template field dictionary. """
+    if isinstance(field, FieldPlan):
+        return field
+    return FieldPlan(field)
+
+
+class TemplatePlan:
+    """ A Dataverse JSON template compiled to build filled out copies.
+
+    The template the plan is compiled from is not kept or changed. Every call
+    to build creates new dictionaries, so one plan can be used to map any
+    number of records.
+
+    Attributes
+    ----------
+    digest:
+        The content hash of the template.
+    items:
+        The (key, value) pairs of the top level of the template.
+    version_items:
+        The (key, value) pairs of the datasetVersion of the template.
+    blocks:
+        A tuple of (name, items, fields) for every metadata block, where
+        items are the (key, value) pairs of the block and fields is a tuple
+        of the FieldPlans of the fields of the block.
+    header_keys:
+        The keys in the top level and in the datasetVersion that can be
+        mapped, everything except datasetVersion and metadataBlocks.
+    field_index:
+        The locations of every typeName in the template, as a tuple of
+        (block name, position) pairs. The block name is None for header keys.
+        Nested fields have the location of their compound.
+    default_fields:
+        The positions of the fields that have a value without a mapping,
+        per block name.
+    """
+    __slots__ = ("digest", "items", "version_items", "blocks", "header_keys",
+                 "field_index", "default_fields")
+
+    def __init__(self, template: dict, digest: str = None):
+        self.digest = digest
+        self.items = tuple(template.items())
+        dataset_version = template["datasetVersion"]
+        self.version_items = tuple(dataset_version.items())
+        self.blocks = tuple(
+            (name, tuple(block.items()),
+             tuple(FieldPlan(field) for field in block["fields"]))
+            for name, block in dataset_version["metadataBlocks"].items()
+        )
+        self.header_keys = tuple(
+            key for key, _ in self.items + self.version_items
+            if key not in ("datasetVersion", "metadataBlocks")
+        )
+
+        field_index = {key: [(None, key)] for key in self.header_keys}
+        self.default_fields = {}
+        for name, _, fields in self.blocks:
+            self.default_fields[name] = tuple(
+                position for position, field in enumerate(fields)
+                if field.has_default)
+            for position, field in enumerate(fields):
+                for type_name in field.type_names:
+                    locations = field_index.setdefault(type_name, [])
+                    if (name, position) not in locations:
+                        locations.append((name, position))
+        self.field_index = {type_name: tuple(locations)
+                            for type_name, locations in field_index.items()}
+
+    def mapped_fields(self, mapping) -> tuple:
+        """
+        Returns the parts of the template that have to be visited to map it.
+
+        Only the fields that a key of the mapping maps to and the fields
+        that have a value without a mapping are visited. Every other field
+        is left empty, whatever the metadata is.
+
+        :param mapping: the mapping, only its keys are used.
+        :return: a tuple of the mapped header keys and a dict of the sorted
+            positions of the fields to visit per block name.
+        """
+        header_keys = []
+        positions = {name: set(fields)
+                     for name, fields in self.default_fields.items()}
+        for type_name in mapping:
+            for name, position in self.field_index.get(type_name, ()):
+                if name is None:
+                    header_keys.append(position)
+                else:
+                    positions[name].add(position)
+        return header_keys, {name: sorted(block_positions)
+                             for name, block_positions in positions.items()}
+
+    def build(self, header: dict, fields: dict) -> dict:
+        """ Builds the filled out template.
+
+        :param header: the mapped values of the header keys.
+        :param fields: a list of field dictionaries per metadata block name.
+        :return: the filled out template.
+        """
+        metadata_blocks = {}
+        for name, items, _ in self.blocks:
+            metadata_blocks[name] = {
+                key: fields[name] if key == "fields" else copy_value(value)
+                for key, value in items
+            }
+
+        dataset_version = self._build_items(self.version_items, header,
+                                            "metadataBlocks", metadata_blocks)
+        return self._build_items(self.items, header,
+                                 "datasetVersion", dataset_version)
+
+    @staticmethod
+    def _build_items(items, header, nested_key, nested_value) -> dict:
+        result = {}
+        for key, value in items:
+            if key == nested_key:
+                result[key] = nested_value
+            elif key in header:
+                result[key] = header[key]
+            else:
+                result[key] = copy_value(value)
+        return result
+
+
+def get_template_plan(template) -> TemplatePlan:
+    """
+    Returns the plan of the template, using the template cache when possible.
+
+    :param template: json or TemplatePlan
+    :return: TemplatePlan
+    """
+    if isinstance(template, TemplatePlan):
+        return template
+    # The output keeps the key order of the template, so it is part of the
+    # hash.
+    digest = content_hash(template, sort_keys=False)
+    return TEMPLATE_CACHE.get_or_create(
+        digest, lambda: TemplatePlan(template, digest))
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import settings
+import utils
+from batch import map_batch_record, map_batch_result
+from cache import LRUCache
+from pathstats import PATH_STATS, PathStats
+from plan import get_template_plan
+
+# The template and mapping of a worker process, set once by init_worker.
+_worker_template = None
+_worker_mapping = None
+_worker_stats_label = None
+_worker_delta_format = None
+# The template, mapping, stats label and delta format of the jobs of a shared
+# pool that a worker process mapped chunks of, by the key of the job.
+_worker_jobs = LRUCache(settings.MAPPING_CACHE_SIZE)
+
+
+def init_worker(template, mapping, stats_label: str = None,
+                delta_format: str = None):
+    """ Prepares a worker process to map records with template and mapping.
+
+    :param template: the template or a template plan.
+    :param mapping: the mapping or a compiled mapping.
+    :param stats_label: collect path statistics under this label, or None.
+    :param delta_format: map records to a delta in this format, or None.
+    """
+    global _worker_template, _worker_mapping, _worker_stats_label, \
+        _worker_delta_format
+    _worker_template = get_template_plan(template)
+    _worker_mapping = utils.get_compiled_mapping(mapping)
+    _worker_stats_label = stats_label
+    _worker_delta_format = delta_format
+
+
+class MappingJob:
+    """ The template and mapping of the records mapped by a shared pool.
+
+    The job is sent to a worker with every chunk, as the pickled template
+    and mapping. A worker only unpickles them the first time it maps a chunk
+    of the job, after that they are taken from its cache by the key.
+
+    Attributes
+    ----------
+    key:
+        The hash of the pickled job.
+    payload:
+        The pickled template plan, compiled mapping, stats label and delta
+        format.
+    """
+
+    def __init__(self, template, mapping, stats_label: str = None,
+                 delta_format: str = None):
+        self.payload = pickle.dumps((get_template_plan(template),
+                                     utils.get_compiled_mapping(mapping),
+                                     stats_label, delta_format))
+        self.key = hashlib.sha256(self.payload).hexdigest()
+
+    def load(self) -> tuple:
+        return pickle.loads(self.payload)
+
+
+def map_job_chunk(job: MappingJob, chunk: list, chunk_function) -> tuple:
+    """ Maps a chunk of a job in a worker process of a shared pool. """
+    global _worker_template, _worker_mapping, _worker_stats_label, \
+        _worker_delta_format
+    _worker_template, _worker_mapping, _worker_stats_label, \
+        _worker_delta_format = _worker_jobs.get_or_create(job.key, job.load)
+    return chunk_function(chunk)
+
+
+def map_chunk(chunk: list) -> tuple:
+    """ Maps a chunk of (index, record) tuples in a worker process.
+
+    :return: the NDJSON result lines, in the order of the chunk, and the
+        PathStats of the chunk or None.
+    """
+    path_stats = None
+    if _worker_stats_label is not None:
+        path_stats = PathStats(_worker_stats_label)
+    lines = [map_batch_record(index, record, _worker_template,
+                              _worker_mapping, path_stats,
+                              _worker_delta_format)
+             for index, record in chunk]
+    return lines, path_stats
+
+
+def map_chunk_results(chunk: list) -> tuple:
+    """ Maps a chunk like map_chunk, but returns the results themselves.
+
+    :return: (index, result JSON bytes, error message) tuples, in the order
+        of the chunk, and the PathStats of the chunk or None.
+    """
+    path_stats = None
+    if _worker_stats_label is not None:
+        path_stats = PathStats(_worker_stats_label)
+    results = [(index, *map_batch_result(record, _worker_template,
+                                         _worker_mapping, path_stats,
+                                         _worker_delta_format))
+               for index, record in chunk]
+    return results, path_stats
+
+
+def chunk_lines(result: tuple) -> list:
+    """ Returns the lines or results of a mapped chunk, merging its path
+    statistics. """
+    lines, path_stats = result
+    if path_stats is not None:
+        PATH_STATS.merge(path_stats)
+    return lines
+
+
+class MappingPool:
+    """ A pool of worker processes that map records in parallel.
+
+    Every worker compiles the template and mapping once when it starts.
+    Records are sent to the workers in chunks and the results are returned
+    in the order of the input. At most two chunks per worker are in flight,
+    so the memory used does not depend on the number of records.
+
+    Given an executor, the records are mapped by its worker processes, which
+    are shared with other pools, and the template and mapping are sent with
+    every chunk as a MappingJob. Closing the pool then leaves the executor
+    running.
+
+    Attributes
+    ----------
+    workers:
+        The number of worker processes.
+    chunk_size:
+        The number of records sent to a worker at once.
+    stats_label:
+        If not None, the workers collect path statistics, which are merged
+        into PATH_STATS under this label.
+    delta_format:
+        If not None, the records are mapped to a delta of the template in
+        this format.
+    """
+
+    def __init__(self, template, mapping,
+                 workers: int = None, chunk_size: int = None,
+                 stats_label: str = None, delta_format: str = None,
+                 executor: ProcessPoolExecutor = None):
+        self.workers = workers or settings.BATCH_WORKERS
+        self.chunk_size = chunk_size or settings.BATCH_CHUNK_SIZE
+        self.max_pending = 2 * self.workers
+        if executor is None:
+            self.executor = ProcessPoolExecutor(self.workers,
+                                                initializer=init_worker,
+                                                initargs=(template, mapping,
+                                                          stats_label,
+                                                          delta_format))
+            self._job = None
+        else:
+            self.executor = executor
+            self._job = MappingJob(template, mapping, stats_label,
+                                   delta_format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._job is None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def map(self, records, start: int = 0, chunk_function=map_chunk):
+        """ Maps an iterable of records and yields the NDJSON result lines.
+
+        :param records: the metadata records as JSON objects or NDJSON lines.
+        :param start: the index of the first record.
+        :param chunk_function: the function that maps a chunk in a worker,
+            map_chunk_results yields result tuples instead of lines.
+        """
+        indexed_records = enumerate(records, start)
+        pending = deque()
+        try:
+            while True:
+                chunk = list(islice(indexed_records, self.chunk_size))
+                if chunk:
+                    pending.append(self._submit(chunk, chunk_function))
+                if pending and (len(pending) >= self.max_pending or
+                                not chunk):
+                    yield from chunk_lines(pending.popleft().result())
+                elif not chunk:
+                    return
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def map_async(self, records):
+        """ Maps an async iterable of records and yields the result lines.
+
+        When reading the records fails, the lines of the records that were
+        already read are yielded before the error is raised.
+
+        :param records: the metadata records as JSON objects or NDJSON lines.
+        """
+        pending = deque()
+        chunk = []
+        error = None
+        try:
+            try:
+                index = 0
+                async for record in records:
+                    chunk.append((index, record))
+                    index += 1
+                    if len(chunk) < self.chunk_size:
+                        continue
+                    pending.append(asyncio.wrap_future(self._submit(chunk)))
+                    chunk = []
+                    if len(pending) >= self.max_pending:
+                        for line in chunk_lines(await pending.popleft()):
+                            yield line
+            except Exception as e:
+                error = e
+
+            if chunk:
+                pending.append(asyncio.wrap_future(self._submit(chunk)))
+            while pending:
+                for line in chunk_lines(await pending.popleft()):
+                    yield line
+        finally:
+            # The chunks of a cancelled batch that did not start are not
+            # mapped, the workers may be shared with other batches.
+            for future in pending:
+                future.cancel()
+        if error is not None:
+            raise error
+
+    def _submit(self, chunk: list, chunk_function=map_chunk):
+        if self._job is None:
+            return self.executor.submit(chunk_function, chunk)
+        return self.executor.submit(map_job_chunk, self._job, chunk,
+                                    chunk_function)
@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+
+import utils
+from artifacts import load_artifact, save_artifact
+from cache import content_hash
+from mapper import map_record
+from plan import TemplatePlan
+
+MAPPING_SUFFIX = "-mapping.json"
+TEMPLATE_SUFFIX = "_dataverse_template.json"
+SAMPLE_SUFFIX = "-sample.json"
+
+
+class Profile:
+    """ A named template and mapping pair that is kept in memory.
+
+    Attributes
+    ----------
+    name:
+        The name of the profile, for example 'cbs' or 'ssh'.
+    template:
+        The Dataverse JSON template.
+    plan:
+        The compiled template. Mappers build their results from the plan, so
+        the template is never changed.
+    mapping:
+        The compiled mapping of the profile.
+    """
+
+    def __init__(self, name: str, template: dict, mapping: dict):
+        self.name = name
+        self.template = template
+        self.plan = TemplatePlan(template,
+                                 content_hash(template, sort_keys=False))
+        self.mapping = utils.compile_mapping(mapping)
+
+
+def find_profiles(resources_dir: str) -> dict:
+    """
+    Returns the template and mapping file of every profile in resources_dir.
+
+    A profile exists for every mapping in resources_dir/mappings named
+    '<profile>-mapping.json' that has a template in resources_dir/templates
+    named '<profile>_dataverse_template.json'.
+
+    :param resources_dir: the directory containing the mappings and templates.
+    :return: dict of profile name to a (template path, mapping path) tuple.
+    """
+    mappings_dir = os.path.join(resources_dir, "mappings")
+    templates_dir = os.path.join(resources_dir, "templates")
+    if not os.path.isdir(mappings_dir):
+        return {}
+
+    profile_files = {}
+    for file_name in sorted(os.listdir(mappings_dir)):
+        if not file_name.endswith(MAPPING_SUFFIX):
+            continue
+        name = file_name[:-len(MAPPING_SUFFIX)]
+        template_path = os.path.join(templates_dir, name + TEMPLATE_SUFFIX)
+        if os.path.isfile(template_path):
+            mapping_path = os.path.join(mappings_dir, file_name)
+            profile_files[name] = (template_path, mapping_path)
+    return profile_files
+
+
+def load_profile(name: str, template_path: str, mapping_path: str) -> Profile:
+    with open(template_path) as f:
+        template = json.load(f)
+    with open(mapping_path) as f:
+        mapping = json.load(f)
+    return Profile(name, template, mapping)
+
+
+def load_sample(resources_dir: str, name: str,
+                samples_dir: str = None) -> dict:
+    """
+    Returns the sample record of a profile, used to warm up the profile.
+
+    The sample of a profile is resources_dir/samples/<profile>-sample.json,
+    or else samples_dir/<profile>-sample.json, where the service keeps the
+    samples of the known profiles. Without a sample an empty record is used,
+    which still runs every path of the mapping once.
+    """
+    directories = [os.path.join(resources_dir, "samples")]
+    if samples_dir:
+        directories.append(samples_dir)
+    for directory in directories:
+        sample_path = os.path.join(directory, name + SAMPLE_SUFFIX)
+        if os.path.isfile(sample_path):
+            with open(sample_path) as f:
+                return json.load(f)
+    return {}
+
+
+class ProfileRegistry:
+    """ Loads the profiles in a resources directory once and keeps them.
+
+    Profiles are loaded the first time they are requested.
+
+    Attributes
+    ----------
+    resources_dir:
+        The directory containing the 'mappings' and 'templates' directories.
+    artifact_dir:
+        The directory of the compiled profile artifacts, or None. A profile
+        with an up to date artifact is loaded from it instead of being
+        compiled.
+    samples_dir:
+        The directory of the sample records the profiles are warmed up with,
+        after resources_dir/samples, or None.
+    """
+
+    def __init__(self, resources_dir: str, artifact_dir: str = None,
+                 samples_dir: str = None):
+        self.resources_dir = resources_dir
+        self.artifact_dir = artifact_dir
+        self.samples_dir = samples_dir
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> list:
+        return sorted(find_profiles(self.resources_dir))
+
+    def get(self, name: str) -> Profile:
+        """ Returns the profile with the given name.
+
+        :param name: the name of the profile.
+        :raises KeyError: if the resources contain no profile with that name.
+        """
+        profile = self._profiles.get(name)
+        if profile is not None:
+            return profile
+
+        with self._lock:
+            if name not in self._profiles:
+                profile_files = find_profiles(self.resources_dir)
+                if name not in profile_files:
+                    raise KeyError(name)
+                self._profiles[name] = self._load(name,
+                                                  *profile_files[name])
+        return self._profiles[name]
+
+    def _load(self, name: str, template_path: str,
+              mapping_path: str) -> Profile:
+        if self.artifact_dir:
+            profile = load_artifact(self.artifact_dir, name, template_path,
+                                    mapping_path)
+            if profile is not None:
+                return profile
+        return load_profile(name, template_path, mapping_path)
+
+    def build_artifacts(self, artifact_dir: str) -> list:
+        """ Compiles every profile and saves it as an artifact.
+
+        :param artifact_dir: the directory to save the artifacts in.
+        :return: the paths of the artifacts.
+        """
+        built = []
+        for name, (template_path, mapping_path) in find_profiles(
+                self.resources_dir).items():
+            profile = load_profile(name, template_path, mapping_path)
+            built.append(save_artifact(artifact_dir, profile, template_path,
+                                       mapping_path))
+        return built
+
+    def warm_up(self) -> tuple:
+        """ Loads every profile and maps its sample record once.
+
+        A profile that fails to load or map is skipped, so the other
+        profiles are still warmed up. It is loaded again when it is first
+        used.
+
+        :return: the names of the profiles that were warmed up, and the
+            error of every profile that failed by its name.
+        """
+        warmed = []
+        failed = {}
+        for name in self.names():
+            try:
+                profile = self.get(name)
+                map_record(load_sample(self.resources_dir, name,
+                                       self.samples_dir),
+                           profile.plan, profile.mapping)
+            except Exception as e:
+                failed[name] = f"{type(e).__name__}: {e}"
+                continue
+            warmed.append(name)
+        return warmed, failed
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BACKENDS = ("none", "memory", "sqlite")
+
+
+def result_key(*parts: str) -> str:
+    """ Returns the key of a mapping result from the hashes of its inputs.
+    """
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """ Returns True if an If-None-Match header value matches the ETag. """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/")
+            for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class MemoryResultCache:
+    """ A least recently used cache of serialized mapping results.
+
+    Entries are evicted when there are more than maxsize entries or when
+    the results take more than max_bytes together.
+
+    Attributes
+    ----------
+    maxsize:
+        The maximum number of results kept.
+    max_bytes:
+        The maximum total size of the results kept.
+    """
+
+    def __init__(self, maxsize: int, max_bytes: int):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """ Returns the cached result bytes for key, or None. """
+        with self._lock:
+            body = self._data.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._data[key] = body
+            self.bytes += len(body)
+            while len(self._data) > self.maxsize or \
+                    self.bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteResultCache:
+    """ A least recently used cache of serialized mapping results on disk.
+
+    The results are kept in an SQLite database, so they survive a restart.
+    It has the same limits as the MemoryResultCache.
+
+    Attributes
+    ----------
+    path:
+        The path of the database file.
+    maxsize:
+        The maximum number of results kept.
+    max_bytes:
+        The maximum total size of the results kept.
+    """
+
+    def __init__(self, path: str, maxsize: int, max_bytes: int):
+        self.path = path
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+            "body BLOB NOT NULL, size INTEGER NOT NULL, "
+            "used REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    def _totals(self) -> tuple:
+        """ Returns the number and total size of the stored results. """
+        return self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+
+    def get(self, key: str):
+        """ Returns the cached result bytes for key, or None. """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE results SET used = ? WHERE key = ?",
+                (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, body: bytes):
+        """ Stores a result and evicts the least recently used ones.
+
+        The totals are read in the same transaction as the eviction, so
+        several processes that share the database enforce the limits on the
+        same numbers.
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (key, body, len(body), time.time()))
+                self._evict()
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _evict(self):
+        size, total = self._totals()
+        while size > self.maxsize or total > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM results ORDER BY used LIMIT 64"
+            ).fetchall()
+            for key, result_size in rows:
+                if size <= self.maxsize and total <= self.max_bytes:
+                    break
+                self._connection.execute(
+                    "DELETE FROM results WHERE key = ?", (key,))
+                size -= 1
+                total -= result_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM results")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, total = self._totals()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "size": size,
+            "maxsize": self.maxsize,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def create_result_cache(backend: str, maxsize: int, max_bytes: int,
+                        path: str = None):
+    """
+    Returns the result cache of a backend, or None for the 'none' backend.
+
+    :param backend: 'none', 'memory' or 'sqlite'.
+    :param maxsize: the maximum number of results kept.
+    :param max_bytes: the maximum total size of the results kept.
+    :param path: the database file of the 'sqlite' backend.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown result cache backend: {backend}")
+    if backend == "memory":
+        return MemoryResultCache(maxsize, max_bytes)
+    if backend == "sqlite":
+        return SQLiteResultCache(path, maxsize, max_bytes)
+    return None
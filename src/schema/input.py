@@ -8,3 +8,21 @@ class Input(BaseModel):
     template: list | dict | Any
     mapping: list | dict | Any
 
+
+class ProfileInput(BaseModel):
+    metadata: list | dict | Any
+
+
+class BatchInput(BaseModel):
+    metadata: list[Any]
+    template: list | dict | Any = None
+    mapping: list | dict | Any = None
+
+
+class RemapInput(BaseModel):
+    previous: dict
+    metadata: list | dict | Any
+    template: list | dict | Any
+    mapping: list | dict | Any
+    previous_template: list | dict | Any = None
+    previous_mapping: list | dict | Any = None
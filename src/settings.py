@@ -0,0 +1,121 @@
+import os
+
+# Maximum number of compiled mappings kept in memory.
+MAPPING_CACHE_SIZE = int(os.environ.get("MAPPING_CACHE_SIZE", "64"))
+
+# Directory containing the 'mappings' and 'templates' of the profiles.
+RESOURCES_DIR = os.environ.get("RESOURCES_DIR", "resources")
+
+# Maximum size in bytes of a single record in an NDJSON batch.
+BATCH_MAX_LINE_SIZE = int(os.environ.get("BATCH_MAX_LINE_SIZE",
+                                         str(64 * 1024 * 1024)))
+
+# Size in bytes up to which an NDJSON batch body is kept in memory while it
+# is read, a larger body is written to a temporary file.
+BATCH_SPOOL_SIZE = int(os.environ.get("BATCH_SPOOL_SIZE",
+                                      str(16 * 1024 * 1024)))
+
+# Number of worker processes used to map a batch. With 1 the records of a
+# batch are mapped in the server process.
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "1"))
+
+# Number of records sent to a batch worker process at once.
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "64"))
+
+# Backend that runs the mappings of the mapper end-points, 'thread' for a
+# pool of threads or 'process' for a pool of worker processes.
+MAPPER_BACKEND = os.environ.get("MAPPER_BACKEND", "thread")
+
+# Number of mappings that run at the same time.
+MAPPER_WORKERS = int(os.environ.get("MAPPER_WORKERS",
+                                    str(os.cpu_count() or 1)))
+
+# Number of mappings that can wait for a worker. Requests beyond this are
+# answered with a 503 response.
+MAPPER_QUEUE_SIZE = int(os.environ.get("MAPPER_QUEUE_SIZE", "64"))
+
+# Seconds a client is asked to wait in the Retry-After header of a 503.
+MAPPER_RETRY_AFTER = int(os.environ.get("MAPPER_RETRY_AFTER", "1"))
+
+# Maximum number of profiles and templates with their own label in the
+# /metrics histograms, later ones are counted as 'other'.
+METRICS_MAX_LABELS = int(os.environ.get("METRICS_MAX_LABELS", "100"))
+
+# Collect statistics of every path of the mappings, see /path-stats.
+PATH_STATS = os.environ.get("PATH_STATS", "false").lower() == "true"
+
+# Maximum number of profiles and mappings whose path statistics are kept,
+# the least recently used ones are dropped first.
+PATH_STATS_MAX_LABELS = int(os.environ.get("PATH_STATS_MAX_LABELS", "100"))
+
+# Load and warm up every profile at startup, /ready returns 503 until the
+# warm-up is done.
+PRELOAD_PROFILES = os.environ.get("PRELOAD_PROFILES",
+                                  "true").lower() == "true"
+
+# Directory of the sample records the profiles are warmed up with, used for
+# profiles without a sample in RESOURCES_DIR/samples.
+SAMPLES_DIR = os.environ.get("SAMPLES_DIR", "samples")
+
+# Seconds to wait before the warm-up is tried again after it failed.
+WARM_UP_RETRY_DELAY = float(os.environ.get("WARM_UP_RETRY_DELAY", "5"))
+
+# Backend of the result cache: 'none', 'memory' or 'sqlite'. With a result
+# cache the mapper end-points return an ETag and support If-None-Match.
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "none")
+
+# Maximum number of results kept in the result cache.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "10000"))
+
+# Maximum total size in bytes of the results kept in the result cache.
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES",
+                                            str(256 * 1024 * 1024)))
+
+# Database file of the 'sqlite' result cache.
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH",
+                                   "cache/results.sqlite3")
+
+# Directory of the compiled profile artifacts, built with
+# 'python -m artifacts'. Empty to always compile the profiles.
+PROFILE_ARTIFACT_DIR = os.environ.get("PROFILE_ARTIFACT_DIR",
+                                      "cache/profiles")
+
+# The Dataverse installation and collection that 'python -m bulk --deliver'
+# sends the mapped records to, and the API token it uses.
+DATAVERSE_URL = os.environ.get("DATAVERSE_URL", "")
+DATAVERSE_COLLECTION = os.environ.get("DATAVERSE_COLLECTION", "")
+DATAVERSE_API_KEY = os.environ.get("DATAVERSE_API_KEY", "")
+
+# Maximum number of records delivered to Dataverse at the same time.
+DELIVERY_MAX_IN_FLIGHT = int(os.environ.get("DELIVERY_MAX_IN_FLIGHT", "4"))
+
+# Number of retries of a delivery, the delay before the first retry in
+# seconds, doubled for every next one, and the timeout of a request.
+DELIVERY_RETRIES = int(os.environ.get("DELIVERY_RETRIES", "3"))
+DELIVERY_BACKOFF = float(os.environ.get("DELIVERY_BACKOFF", "1.0"))
+DELIVERY_TIMEOUT = float(os.environ.get("DELIVERY_TIMEOUT", "60"))
+
+# Encodings used to compress responses, the preferred one first, 'zstd'
+# and 'gzip'. Empty to never compress responses.
+RESPONSE_COMPRESSION = tuple(
+    encoding.strip() for encoding in
+    os.environ.get("RESPONSE_COMPRESSION", "zstd,gzip").split(",")
+    if encoding.strip()
+)
+
+# Responses smaller than this many bytes are not compressed.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+# Compression levels of the response encodings.
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", "3"))
+
+# Maximum size in bytes of a compressed request body after decompression.
+MAX_DECOMPRESSED_SIZE = int(os.environ.get("MAX_DECOMPRESSED_SIZE",
+                                           str(512 * 1024 * 1024)))
+
+# Minimum size in bytes of the chunks of a streamed mapping response.
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "65536"))
+
+# Maximum number of compiled templates kept in memory.
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", "64"))
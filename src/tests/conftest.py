@@ -0,0 +1,35 @@
+import json
+import shutil
+
+import pytest
+
+
+def open_json_file(json_path):
+    with open(json_path) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def easy_input():
+    return {
+        "metadata": open_json_file(
+            "test-data/input-data/easy-test-metadata.json"),
+        "template": open_json_file(
+            "test-data/test-templates/easy_dataverse_template.json"),
+        "mapping": open_json_file("test-data/test-mappings/easy-mapping.json")
+    }
+
+
+@pytest.fixture()
+def resources_dir(tmp_path):
+    """ A resources directory containing only the 'easy' profile. """
+    (tmp_path / "mappings").mkdir()
+    (tmp_path / "templates").mkdir()
+    shutil.copy("test-data/test-mappings/easy-mapping.json",
+                tmp_path / "mappings" / "easy-mapping.json")
+    shutil.copy("test-data/test-templates/easy_dataverse_template.json",
+                tmp_path / "templates" / "easy_dataverse_template.json")
+    # A mapping without a template is not a profile.
+    shutil.copy("test-data/test-mappings/liss-old-mapping.json",
+                tmp_path / "mappings" / "liss-old-mapping.json")
+    return str(tmp_path)
@@ -0,0 +1,79 @@
+import importlib.util
+import json
+
+import pytest
+
+from .. import artifacts, profiles
+from ..artifacts import artifact_path, load_artifact, main
+from ..mapper import map_record
+from ..profiles import ProfileRegistry, find_profiles
+from .conftest import open_json_file
+
+METADATA = "test-data/input-data/easy-test-metadata.json"
+RESULT = "test-data/expected-result-data/easy-clean-result.json"
+
+
+@pytest.fixture()
+def artifact_dir(resources_dir, tmp_path):
+    directory = str(tmp_path / "artifacts")
+    assert main(["--resources-dir", resources_dir,
+                 "--output", directory]) == 0
+    return directory
+
+
+def test_profile_is_loaded_from_artifact(resources_dir, artifact_dir,
+                                         monkeypatch):
+    def compile_profile(*args):
+        raise AssertionError("The profile was compiled")
+
+    monkeypatch.setattr(profiles, "load_profile", compile_profile)
+    profile = ProfileRegistry(resources_dir, artifact_dir).get("easy")
+
+    assert map_record(open_json_file(METADATA), profile.plan,
+                      profile.mapping) == open_json_file(RESULT)
+
+
+def test_stale_artifact_is_rejected(resources_dir, artifact_dir):
+    template_path, mapping_path = find_profiles(resources_dir)["easy"]
+    assert load_artifact(artifact_dir, "easy", template_path,
+                         mapping_path) is not None
+
+    mapping = open_json_file(mapping_path)
+    mapping["title"] = ["nothing.here"]
+    with open(mapping_path, "w") as f:
+        json.dump(mapping, f)
+
+    assert load_artifact(artifact_dir, "easy", template_path,
+                         mapping_path) is None
+    profile = ProfileRegistry(resources_dir, artifact_dir).get("easy")
+    assert profile.mapping["title"][0].expression == "nothing.here"
+
+
+def test_broken_artifact_is_rejected(resources_dir, artifact_dir):
+    with open(artifact_path(artifact_dir, "easy"), "wb") as f:
+        f.write(b"not a pickle")
+
+    assert load_artifact(artifact_dir, "easy",
+                         *find_profiles(resources_dir)["easy"]) is None
+    assert ProfileRegistry(resources_dir, artifact_dir).get("easy").name == \
+        "easy"
+
+
+def test_artifact_of_other_jmespath_is_rejected(resources_dir, artifact_dir,
+                                                monkeypatch):
+    paths = find_profiles(resources_dir)["easy"]
+    assert load_artifact(artifact_dir, "easy", *paths) is not None
+
+    # The parsed jmespath expressions of another version may not load.
+    monkeypatch.setattr(artifacts.jmespath, "__version__", "0.0.0")
+    artifacts.compiler_version.cache_clear()
+    try:
+        assert load_artifact(artifact_dir, "easy", *paths) is None
+    finally:
+        artifacts.compiler_version.cache_clear()
+
+
+def test_compiler_modules_are_found():
+    # The source of every module is part of the compiler version.
+    for name in artifacts.COMPILER_MODULES:
+        assert importlib.util.find_spec(name).origin.endswith(f"{name}.py")
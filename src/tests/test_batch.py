@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from ..batch import BatchError, iter_ndjson_lines
+from .conftest import open_json_file
+
+
+async def collect_lines(chunks, max_line_size=1024):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    return [line async for line in iter_ndjson_lines(stream(), max_line_size)]
+
+
+def test_iter_ndjson_lines():
+    chunks = [b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": 3}']
+    lines = asyncio.run(collect_lines(chunks))
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+    with pytest.raises(BatchError):
+        asyncio.run(collect_lines([b"x" * 10, b"x" * 10], max_line_size=15))
+
+
+@pytest.fixture()
+def client():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+    return TestClient(main.app)
+
+
+def test_batch_endpoint_json(client, easy_input):
+    expected_result = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    body = dict(easy_input, metadata=[easy_input["metadata"]] * 3)
+
+    response = client.post("/mapper/batch", json=body)
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"index": i, "result": expected_result}
+                     for i in range(3)]
+
+
+def test_batch_endpoint_ndjson(client, easy_input):
+    header = {"template": easy_input["template"],
+              "mapping": easy_input["mapping"]}
+    record = json.dumps(easy_input["metadata"])
+    body = "\n".join([json.dumps(header), record, "{not json", record])
+
+    response = client.post("/mapper/batch", content=body,
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert "result" in lines[0] and "result" in lines[2]
+    assert "error" in lines[1]
+
+
+@pytest.mark.parametrize("profile", [False, True])
+def test_batch_endpoint_ndjson_chunks(client, easy_input, resources_dir,
+                                      profile, monkeypatch):
+    from .. import main
+    from ..profiles import ProfileRegistry
+
+    monkeypatch.setattr(main, "profiles", ProfileRegistry(resources_dir))
+    header = {"template": easy_input["template"],
+              "mapping": easy_input["mapping"]}
+    record = json.dumps(easy_input["metadata"])
+    lines = [record] * 3 if profile else [json.dumps(header)] + [record] * 3
+    body = "\n".join(lines).encode()
+    # The body is sent in several chunks that split the lines.
+    chunks = [body[i:i + 1000] for i in range(0, len(body), 1000)]
+    result = []
+
+    def post():
+        result.append(client.post(
+            "/mapper/batch", params={"profile": "easy"} if profile else {},
+            content=iter(chunks),
+            headers={"Content-Type": "application/x-ndjson"}))
+
+    # The body used to be lost to the disconnect listener of the response.
+    thread = threading.Thread(target=post, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert result, "the request did not return"
+
+    expected = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    assert result[0].status_code == 200
+    assert [json.loads(line) for line in result[0].text.splitlines()] == \
+        [{"index": i, "result": expected} for i in range(3)]
+
+
+def test_batch_endpoint_without_mapping(client, easy_input):
+    response = client.post("/mapper/batch", json={"metadata": []})
+    assert response.status_code == 422
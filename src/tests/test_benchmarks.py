@@ -0,0 +1,68 @@
+import asyncio
+import sys
+
+import pytest
+
+from ..benchmarks.compound_scaling import entry_counts, measure_scaling
+from ..benchmarks.suite import measure_case
+from ..benchmarks.synthetic import synthetic_case
+from ..mapper import map_record
+
+
+def test_synthetic_case_scales():
+    metadata, template, mapping = synthetic_case(authors=3, compounds=2,
+                                                 depth=4, size=10)
+    fields = {
+        field["typeName"]: field["value"]
+        for field in map_record(metadata, template, mapping)[
+            "datasetVersion"]["metadataBlocks"]["citation"]["fields"]
+    }
+    assert len(fields["author"]) == 3
+    assert len(fields["keyword"]) == 1
+    assert fields["variable"][1]["variableLabel"]["value"] == "Variable 1"
+    assert fields["dsDescriptionValue"] == "x" * 10
+
+
+def test_measure_case():
+    case = measure_case(*synthetic_case(), min_time=0, min_records=5,
+                        max_records=5)
+    assert case["records"] == 5
+    assert case["latency_ms_p50"] <= case["latency_ms_max"]
+
+
+def test_compound_scaling():
+    assert entry_counts(100000) == [1000, 10000, 100000]
+    assert entry_counts(500) == [500]
+    rows = measure_scaling("keywords", [10, 20], repeat=1)
+    assert [row[0] for row in rows] == [10, 20]
+    assert rows[0][3] == 1.0
+
+
+def test_load_level():
+    pytest.importorskip("httpx")
+    from ..benchmarks.load import (ProcessUsage, create_client,
+                                   request_bodies, run_level, serve)
+
+    requests = request_bodies("raw", ["easy"])
+    requests.append(("bad", "/mapper/raw", b"{}"))
+
+    async def run():
+        # The lifespan of the app runs the warm-up, /ready waits for it.
+        async with serve(None, 30):
+            async with create_client(None, 2) as client:
+                assert (await client.get("/ready")).json()["ready"]
+                return await run_level(client, requests, 2, 60, 6, 0)
+
+    usage = ProcessUsage([])
+    usage.start()
+    case = asyncio.run(run())
+
+    assert case["requests"] == 6
+    assert case["statuses"] == {"200": 3, "422": 3}
+    assert case["error_rate"] == 0.5
+    assert case["latency_ms_p50"] <= case["latency_ms_p99"]
+    measured = usage.stop()
+    assert measured["peak_memory_bytes"] > 0
+    # The peak is reset at the start of every level on Linux.
+    assert measured["peak_memory_cumulative"] == (not sys.platform.startswith(
+        "linux"))
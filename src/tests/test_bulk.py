@@ -0,0 +1,155 @@
+import json
+import shutil
+
+import pytest
+
+from ..bulk import Checkpoint, main
+from .conftest import open_json_file
+
+METADATA = "test-data/input-data/easy-test-metadata.json"
+TEMPLATE = "test-data/test-templates/easy_dataverse_template.json"
+MAPPING = "test-data/test-mappings/easy-mapping.json"
+RESULT = "test-data/expected-result-data/easy-clean-result.json"
+
+
+@pytest.fixture()
+def input_dir(tmp_path):
+    """ A directory with three easy records and one that is not JSON. """
+    directory = tmp_path / "harvest"
+    (directory / "sub").mkdir(parents=True)
+    for name in ["a", "b", "sub/c"]:
+        shutil.copy(METADATA, directory / f"{name}.json")
+    (directory / "d.json").write_text("{not json")
+    return directory
+
+
+@pytest.fixture()
+def input_ndjson(tmp_path):
+    metadata = json.dumps(open_json_file(METADATA))
+    path = tmp_path / "records.ndjson"
+    path.write_text("\n".join([metadata, "", metadata, "{not json",
+                               metadata]) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bulk_directory(input_dir, tmp_path, capsys, workers):
+    output = tmp_path / "mapped"
+    exit_code = main([str(input_dir), "--output", str(output),
+                      "--template", TEMPLATE, "--mapping", MAPPING,
+                      "--workers", str(workers), "--chunk-size", "1"])
+
+    summary = json.loads(capsys.readouterr().out)
+    assert exit_code == 1
+    assert (summary["total"], summary["failed"]) == (4, 1)
+    assert summary["errors"][0]["id"] == "d"
+    expected = open_json_file(RESULT)
+    for name in ["a", "b", "sub/c"]:
+        assert open_json_file(output / f"{name}.json") == expected
+    error, = (output / "errors.ndjson").read_text().splitlines()
+    assert json.loads(error)["id"] == "d"
+
+
+def test_bulk_ndjson_resumes(input_ndjson, tmp_path, capsys):
+    output = tmp_path / "mapped.ndjson"
+    args = [str(input_ndjson), "--output", str(output),
+            "--template", TEMPLATE, "--mapping", MAPPING, "--workers", "1"]
+    assert main(args) == 1
+    complete = output.read_bytes()
+    capsys.readouterr()
+
+    # Interrupt the run after the first record, while the second record
+    # was half written.
+    checkpoint_path = str(output) + ".checkpoint"
+    checkpoint = Checkpoint(checkpoint_path,
+                            open_json_file(checkpoint_path)["run"])
+    checkpoint.load()
+    first_line = complete.split(b"\n")[0] + b"\n"
+    checkpoint.done, checkpoint.failed = 1, 0
+    checkpoint.offset = len(first_line)
+    checkpoint.save()
+    output.write_bytes(first_line + b'{"id": 3, "res')
+
+    assert main(args) == 1
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["resumed_at"] == 1
+    assert (summary["mapped"], summary["total"]) == (3, 4)
+    assert output.read_bytes() == complete
+
+    lines = [json.loads(line) for line in complete.splitlines()]
+    assert [line["id"] for line in lines] == [1, 3, 4, 5]
+    assert lines[0]["result"] == open_json_file(RESULT)
+    assert "error" in lines[2]
+
+
+def test_bulk_directory_resumes_after_last_key(input_dir, tmp_path, capsys):
+    output = tmp_path / "mapped"
+    args = [str(input_dir), "--output", str(output),
+            "--template", TEMPLATE, "--mapping", MAPPING, "--workers", "1"]
+    assert main(args) == 1
+    capsys.readouterr()
+
+    # Interrupt the run after the first two files, then add a file before
+    # and one after the last key.
+    checkpoint_path = str(output) + ".checkpoint"
+    checkpoint = Checkpoint(checkpoint_path,
+                            open_json_file(checkpoint_path)["run"])
+    checkpoint.load()
+    assert checkpoint.last_key == "sub/c"
+    checkpoint.done, checkpoint.failed, checkpoint.last_key = 2, 0, "b"
+    checkpoint.offset = 0
+    checkpoint.save()
+    shutil.copy(METADATA, input_dir / "0.json")
+    shutil.copy(METADATA, input_dir / "e.json")
+
+    assert main(args) == 1
+    summary = json.loads(capsys.readouterr().out)
+    # d and sub/c are mapped again, e is new and 0 is before the last key.
+    assert (summary["resumed_at"], summary["mapped"]) == (2, 3)
+    assert (output / "e.json").exists()
+    assert not (output / "0.json").exists()
+
+
+def test_bulk_checkpoint_of_other_mapping(input_ndjson, tmp_path, capsys):
+    output = tmp_path / "mapped.ndjson"
+    args = [str(input_ndjson), "--output", str(output),
+            "--template", TEMPLATE, "--workers", "1"]
+    assert main(args + ["--mapping", MAPPING]) == 1
+    capsys.readouterr()
+
+    other_mapping = tmp_path / "other-mapping.json"
+    other_mapping.write_text(json.dumps({"title": ["title"]}))
+    # Resuming would append the results of another mapping.
+    assert main(args + ["--mapping", str(other_mapping)]) == 2
+    assert "of another run" in capsys.readouterr().err
+
+
+def test_bulk_profile(resources_dir, input_ndjson, tmp_path, capsys):
+    output = tmp_path / "mapped.ndjson"
+    assert main([str(input_ndjson), "--output", str(output),
+                 "--profile", "easy", "--resources-dir", resources_dir,
+                 "--workers", "1"]) == 1
+    assert main([str(input_ndjson), "--output", str(tmp_path / "other"),
+                 "--profile", "unknown", "--resources-dir",
+                 resources_dir]) == 2
+
+
+@pytest.mark.parametrize("output_name", ["mapped", "mapped.ndjson"])
+def test_bulk_stream(input_dir, tmp_path, capsys, output_name):
+    output = tmp_path / output_name
+    exit_code = main([str(input_dir), "--output", str(output),
+                      "--template", TEMPLATE, "--mapping", MAPPING,
+                      "--stream"])
+
+    summary = json.loads(capsys.readouterr().out)
+    assert exit_code == 1
+    assert (summary["total"], summary["failed"]) == (4, 1)
+    expected = open_json_file(RESULT)
+    if output_name == "mapped":
+        assert open_json_file(output / "sub/c.json") == expected
+        assert not list(output.glob("**/*.tmp"))
+    else:
+        lines = [json.loads(line) for line in output.read_text().splitlines()]
+        assert [line.get("result") == expected for line in lines] == [
+            True, True, False, True]
+        assert lines[2]["id"] == "d"
@@ -0,0 +1,195 @@
+import gzip
+import json
+import tracemalloc
+
+import pytest
+import zstandard
+
+from ..compression import (CompressionMiddleware, DecompressionMiddleware,
+                           accepted_encoding)
+from .conftest import open_json_file
+
+
+@pytest.fixture()
+def client():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+    return TestClient(main.app)
+
+
+def echo_client(middleware, **options):
+    """ Returns a client of a small app wrapped in a middleware. """
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import Response, StreamingResponse
+    from starlette.routing import Route
+
+    async def echo(request: Request):
+        return Response(await request.body(), headers={"ETag": '"echo"'},
+                        media_type="application/octet-stream")
+
+    async def stream(request: Request):
+        async def lines():
+            for i in range(3):
+                yield f"line {i}\n".encode()
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    app = Starlette(routes=[Route("/echo", echo, methods=["POST"]),
+                            Route("/stream", stream, methods=["GET"])])
+    return TestClient(middleware(app, **options))
+
+
+def test_accepted_encoding():
+    encodings = ("zstd", "gzip")
+    assert accepted_encoding("gzip, deflate, br, zstd", encodings) == "zstd"
+    assert accepted_encoding("gzip, zstd;q=0", encodings) == "gzip"
+    assert accepted_encoding("*;q=0.5", encodings) == "zstd"
+    assert accepted_encoding("*, zstd;q=0", encodings) == "gzip"
+    assert accepted_encoding("identity", encodings) is None
+    assert accepted_encoding("", encodings) is None
+
+
+def test_gzip_request_body(client, easy_input):
+    expected_result = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    body = gzip.compress(json.dumps(easy_input).encode())
+
+    for path in ("/mapper", "/mapper/raw"):
+        response = client.post(path, content=body,
+                               headers={"Content-Type": "application/json",
+                                        "Content-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.json() == expected_result
+
+
+def test_compressed_batch_response(client, easy_input):
+    body = dict(easy_input, metadata=[easy_input["metadata"]] * 3)
+
+    with client.stream("POST", "/mapper/batch", json=body,
+                       headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert "Accept-Encoding" in response.headers["vary"]
+        raw = b"".join(response.iter_raw())
+
+    lines = gzip.decompress(raw).decode().splitlines()
+    assert [json.loads(line)["index"] for line in lines] == [0, 1, 2]
+
+
+def test_compressed_response(client, easy_input):
+    response = client.post("/mapper", json=easy_input,
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    response = client.post("/mapper", json=easy_input,
+                           headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_small_response_is_not_compressed():
+    client = echo_client(CompressionMiddleware,
+                         encodings=("gzip",), min_size=100,
+                         levels={"gzip": 6})
+
+    small = client.post("/echo", content=b"x" * 99,
+                        headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert small.headers["etag"] == '"echo"'
+    assert small.content == b"x" * 99
+
+    with client.stream("POST", "/echo", content=b"x" * 100,
+                       headers={"Accept-Encoding": "gzip"}) as large:
+        raw = b"".join(large.iter_raw())
+    assert large.headers["content-encoding"] == "gzip"
+    assert int(large.headers["content-length"]) == len(raw)
+    assert large.headers["etag"] == 'W/"echo"'
+    assert gzip.decompress(raw) == b"x" * 100
+
+    # Streamed responses are compressed whatever their size.
+    streamed = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert streamed.headers["content-encoding"] == "gzip"
+    assert streamed.text == "line 0\nline 1\nline 2\n"
+
+
+def test_decompression_errors():
+    client = echo_client(DecompressionMiddleware, max_size=1000)
+
+    response = client.post("/echo", content=gzip.compress(b"x" * 1000),
+                           headers={"Content-Encoding": "gzip"})
+    assert response.content == b"x" * 1000
+
+    response = client.post("/echo", content=gzip.compress(b"x" * 1001),
+                           headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+
+    response = client.post("/echo", content=b"not gzip",
+                           headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 400
+
+    response = client.post("/echo", content=gzip.compress(b"x")[:-4],
+                           headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 400
+
+    response = client.post("/echo", content=b"x",
+                           headers={"Content-Encoding": "br"})
+    assert response.status_code == 415
+
+
+def test_multi_member_gzip():
+    client = echo_client(DecompressionMiddleware, max_size=1000)
+    body = gzip.compress(b"first ") + gzip.compress(b"second")
+
+    response = client.post("/echo", content=body,
+                           headers={"Content-Encoding": "gzip"})
+    assert response.content == b"first second"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_decompression_bomb(encoding):
+    if encoding == "zstd":
+        compress = zstandard.ZstdCompressor().compress
+    else:
+        compress = gzip.compress
+    client = echo_client(DecompressionMiddleware, max_size=1_000_000)
+    # Compresses over a thousand times.
+    body = compress(b"\0" * 200_000_000)
+    assert len(body) < 250_000
+
+    tracemalloc.start()
+    try:
+        response = client.post("/echo", content=body,
+                               headers={"Content-Encoding": encoding})
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert response.status_code == 413
+    # The body is decompressed a chunk at a time, not as a whole.
+    assert peak < 20_000_000
+
+
+def test_zstd_round_trip():
+    client = echo_client(DecompressionMiddleware, max_size=1000)
+    body = zstandard.ZstdCompressor().compress(b"x" * 500)
+
+    response = client.post("/echo", content=body,
+                           headers={"Content-Encoding": "zstd"})
+    assert response.content == b"x" * 500
+
+    response = client.post("/echo", content=b"not zstd",
+                           headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 400
+
+    client = echo_client(CompressionMiddleware,
+                         encodings=("zstd", "gzip"), min_size=10,
+                         levels={"zstd": 3, "gzip": 6})
+    with client.stream("POST", "/echo", content=b"x" * 500,
+                       headers={"Accept-Encoding": "zstd"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "zstd"
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(raw) == \
+        b"x" * 500
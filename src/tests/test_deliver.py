@@ -0,0 +1,257 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from ..bulk import main
+
+requests = pytest.importorskip("requests")
+
+from ..deliver import DataverseDelivery, normalize_pid  # noqa: E402
+
+METADATA = "test-data/input-data/easy-test-metadata.json"
+TEMPLATE = "test-data/test-templates/easy_dataverse_template.json"
+MAPPING = "test-data/test-mappings/easy-mapping.json"
+
+
+class StubDataverse(ThreadingHTTPServer):
+    """ A Dataverse import API that answers 503 to the first request of
+    every dataset and rejects datasets without a title. """
+
+    daemon_threads = True
+
+    def __init__(self, delay: float = 0.0, create_status: int = None):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.delay = delay
+        # The status of every response to a create, if not None.
+        self.create_status = create_status
+        self.lock = threading.Lock()
+        self.requests = []
+        self.clients = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        url = urlsplit(self.path)
+        pid = parse_qs(url.query).get("pid", [None])[0]
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+            server.clients.add(self.client_address)
+            first = (url.path, pid) not in [(path, pid) for path, pid, _ in
+                                            server.requests]
+            server.requests.append((url.path, pid,
+                                    self.headers.get("X-Dataverse-key")))
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        if first and pid is not None:
+            self.respond(503, {"status": "ERROR"}, {"Retry-After": "0"})
+        elif pid is None and server.create_status is not None:
+            self.respond(server.create_status, {"status": "ERROR"},
+                         {"Retry-After": "0"})
+        elif not body["datasetVersion"]["metadataBlocks"]:
+            self.respond(400, {"status": "ERROR", "message": "No title"})
+        else:
+            self.respond(201, {"status": "OK",
+                               "data": {"persistentId": pid or "doi:new"}})
+
+    def respond(self, status: int, body: dict, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_dataverse(**options) -> StubDataverse:
+    server = StubDataverse(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture()
+def dataverse():
+    server = start_dataverse(delay=0.02)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def record(pid="https://doi.org/10.5072/a", blocks=True) -> bytes:
+    version = {"metadataBlocks": {"citation": {}} if blocks else {}}
+    if pid:
+        version["datasetPersistentId"] = pid
+    return json.dumps({"datasetVersion": version}).encode()
+
+
+def test_normalize_pid():
+    assert normalize_pid("https://doi.org/10.5072/a") == "doi:10.5072/a"
+    assert normalize_pid("https://hdl.handle.net/1/2") == "hdl:1/2"
+    assert normalize_pid("doi:10.5072/a") == "doi:10.5072/a"
+
+
+def test_deliver_results(dataverse):
+    results = [("a", record("https://doi.org/10.5072/a"), None),
+               ("new", record(pid=None), None),
+               ("bad", record(pid=None, blocks=False), None),
+               ("unmapped", None, "ValueError: not JSON")]
+
+    with DataverseDelivery(dataverse.url, "root", api_key="secret",
+                           max_in_flight=2, backoff=0) as delivery:
+        statuses = [status for _, _, _, status in
+                    delivery.deliver_results(iter(results))]
+
+    assert [status["id"] for status in statuses] == \
+        ["a", "new", "bad", "unmapped"]
+    assert statuses[0] == {"id": "a", "status": "delivered",
+                           "http_status": 201, "attempts": 2,
+                           "persistentId": "doi:10.5072/a"}
+    assert statuses[1]["persistentId"] == "doi:new"
+    # A rejected dataset is not retried.
+    assert (statuses[2]["status"], statuses[2]["http_status"],
+            statuses[2]["attempts"]) == ("failed", 400, 1)
+    assert statuses[3]["status"] == "skipped"
+
+    assert ("/api/dataverses/root/datasets/:import", "doi:10.5072/a",
+            "secret") in dataverse.requests
+    assert ("/api/dataverses/root/datasets", None, "secret") in \
+        dataverse.requests
+
+
+def test_deliver_results_is_bounded(dataverse):
+    mapped = []
+
+    def results():
+        for i in range(12):
+            mapped.append(i)
+            yield str(i), record(pid=None), None
+
+    with DataverseDelivery(dataverse.url, "root", max_in_flight=3,
+                           backoff=0) as delivery:
+        for key, _, _, status in delivery.deliver_results(results()):
+            # Records are mapped only a few ahead of the deliveries.
+            assert len(mapped) <= int(key) + 4
+            assert status["status"] == "delivered"
+
+    assert dataverse.max_in_flight <= 3
+    # The connections are kept alive and shared by the requests.
+    assert len(dataverse.clients) <= 3
+
+
+def test_deliver_retries_give_up():
+    # Nothing listens on this port, so every attempt fails to connect.
+    with DataverseDelivery("http://127.0.0.1:9", "root", retries=2,
+                           backoff=0, timeout=1) as delivery:
+        status = delivery.deliver("a", record())
+
+    assert (status["status"], status["attempts"]) == ("failed", 3)
+    assert status["http_status"] is None
+    assert status["error"].startswith("ConnectionError")
+
+    # A create that could not connect never reached the server either.
+    with DataverseDelivery("http://127.0.0.1:9", "root", retries=2,
+                           backoff=0, timeout=1) as delivery:
+        status = delivery.deliver("a", record(pid=None))
+
+    assert (status["status"], status["attempts"]) == ("failed", 3)
+
+
+@pytest.mark.parametrize("options", [{"create_status": 503},
+                                     {"delay": 0.5}])
+def test_create_is_not_retried(options):
+    # The dataset may have been created when the response is an error or
+    # is lost, so sending it again could create a duplicate.
+    server = start_dataverse(**options)
+    try:
+        with DataverseDelivery(server.url, "root", backoff=0,
+                               timeout=0.2) as delivery:
+            status = delivery.deliver("new", record(pid=None))
+            imported = delivery.deliver("a", record())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert (status["status"], status["attempts"]) == ("failed", 1)
+    if "delay" in options:
+        assert status["error"].startswith("ReadTimeout")
+    else:
+        # An import is retried.
+        assert imported["attempts"] == 2
+
+
+def test_bulk_deliver(dataverse, tmp_path, capsys):
+    records = tmp_path / "records.ndjson"
+    with open(METADATA) as f:
+        metadata = json.dumps(json.load(f))
+    records.write_text("\n".join([metadata, "{not json", metadata]) + "\n")
+    output = tmp_path / "mapped.ndjson"
+
+    exit_code = main([str(records), "--output", str(output),
+                      "--template", TEMPLATE, "--mapping", MAPPING,
+                      "--workers", "1", "--deliver",
+                      "--dataverse-url", dataverse.url,
+                      "--collection", "easy"])
+
+    summary = json.loads(capsys.readouterr().out)
+    assert exit_code == 1
+    assert summary["delivery"] == {"delivered": 2, "skipped": 1}
+    assert summary["failed"] == 1
+    report = [json.loads(line) for line in
+              (tmp_path / "mapped.ndjson.delivery.ndjson").read_text()
+              .splitlines()]
+    assert [status["status"] for status in report] == \
+        ["delivered", "skipped", "delivered"]
+    assert report[0]["persistentId"] == "doi:10.17026/dans-xnh-wt5n"
+
+
+def test_bulk_deliver_resume(dataverse, tmp_path, capsys):
+    records = tmp_path / "records.ndjson"
+    with open(METADATA) as f:
+        metadata = json.dumps(json.load(f))
+    records.write_text("\n".join([metadata] * 3) + "\n")
+    output = tmp_path / "mapped.ndjson"
+    arguments = [str(records), "--output", str(output),
+                 "--template", TEMPLATE, "--mapping", MAPPING,
+                 "--workers", "1", "--deliver",
+                 "--dataverse-url", dataverse.url, "--collection", "easy"]
+    assert main(arguments) == 0
+    capsys.readouterr()
+    sent = len(dataverse.requests)
+
+    # The run is stopped before its first checkpoint was saved.
+    checkpoint_path = tmp_path / "mapped.ndjson.checkpoint"
+    checkpoint = json.loads(checkpoint_path.read_text())
+    checkpoint.update(done=0, offset=0, delivery_offset=0)
+    checkpoint_path.write_text(json.dumps(checkpoint))
+
+    assert main(arguments) == 0
+
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["resumed_at"] == 0
+    assert summary["delivery"] == {"delivered": 3}
+    # The delivered records are not sent again.
+    assert len(dataverse.requests) == sent
+    report = (tmp_path / "mapped.ndjson.delivery.ndjson").read_text()
+    assert len(report.splitlines()) == 3
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from ..delta import map_record_delta
+from ..delta_client import apply_patch, main, rebuild
+from ..mapper import map_record
+from .conftest import open_json_file
+
+
+def field(type_name, value, multiple=False, type_class="primitive"):
+    return {"typeName": type_name, "multiple": multiple,
+            "typeClass": type_class, "value": value}
+
+
+def delta_template() -> dict:
+    """ A template with every kind of field the delta has to handle. """
+    return {"datasetVersion": {
+        "license": "CC0",
+        "datasetPersistentId": "",
+        "metadataBlocks": {
+            "citation": {"displayName": "Citation", "fields": [
+                field("title", ""),
+                field("contactEmail", "info@example.org"),
+                field("subject", ["Other"], multiple=True),
+                field("keyword", [], multiple=True),
+                field("author", [{
+                    "authorName": field("authorName", ""),
+                    "authorAffiliation": field("authorAffiliation", "DANS"),
+                }], multiple=True, type_class="compound"),
+                field("contributor", [{
+                    "contributorName": field("contributorName", ""),
+                }], multiple=True, type_class="compound"),
+                field("series", {
+                    "seriesName": field("seriesName", ""),
+                }, type_class="compound"),
+            ]},
+            "geospatial": {"displayName": "Geo", "fields": [
+                field("country", "Netherlands"),
+                field("city", ""),
+            ]},
+        },
+    }}
+
+
+METADATA = {"pid": "doi:10.5072/a", "title": "A title",
+            "subjects": ["Law"], "keywords": ["a", "b"],
+            "authors": ["Ann", "Bob"], "series": "S1"}
+MAPPING = {"datasetPersistentId": ["pid"], "title": ["title"],
+           "subject": ["subjects"], "keyword": ["keywords"],
+           "authorName": ["authors"], "seriesName": ["series"]}
+
+
+def test_values_delta():
+    delta = map_record_delta(METADATA, delta_template(), MAPPING, "values")
+
+    assert delta == {
+        "header": {"datasetPersistentId": "doi:10.5072/a"},
+        "fields": {"citation": {
+            "title": "A title",
+            "subject": ["Other", "Law"],
+            "keyword": ["a", "b"],
+            "author": [{"authorName": "Ann", "authorAffiliation": "DANS"},
+                       {"authorName": "Bob"}],
+            "series": {"seriesName": "S1"},
+        }},
+        # The contributor has a row in the template, but nothing is mapped.
+        "removed": {"citation": ["contributor"]},
+    }
+
+
+@pytest.mark.parametrize("metadata", [METADATA, {}])
+def test_delta_rebuilds_result(metadata):
+    template = delta_template()
+    expected = json.dumps(map_record(metadata, template, MAPPING))
+
+    values = map_record_delta(metadata, template, MAPPING, "values")
+    patch = map_record_delta(metadata, template, MAPPING, "patch")
+
+    # The key order is the same as well.
+    assert json.dumps(rebuild(template, values)) == expected
+    assert json.dumps(apply_patch(template, patch)) == expected
+    assert template == delta_template()
+
+
+def test_delta_of_fixture():
+    template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+    mapping = open_json_file("test-data/test-mappings/easy-mapping.json")
+    expected = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    values = map_record_delta(metadata, template, mapping, "values")
+
+    assert rebuild(template, values) == expected
+    assert len(json.dumps(values)) < len(json.dumps(expected)) / 1.5
+    with pytest.raises(ValueError):
+        map_record_delta(metadata, template, mapping, "diff")
+
+
+@pytest.fixture()
+def client():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+    return TestClient(main.app)
+
+
+def test_delta_endpoints(client, easy_input, tmp_path, capsys):
+    expected = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    template = easy_input["template"]
+
+    for path in ("/mapper", "/mapper/raw"):
+        response = client.post(path, params={"delta": "values"},
+                               json=easy_input)
+        assert response.status_code == 200
+        assert rebuild(template, response.json()) == expected
+
+    body = dict(easy_input, metadata=[easy_input["metadata"]] * 2)
+    response = client.post("/mapper/batch", params={"delta": "patch"},
+                           json=body)
+    assert response.status_code == 200
+    batch = tmp_path / "batch.ndjson"
+    batch.write_text(response.text)
+    template_file = tmp_path / "template.json"
+    template_file.write_text(json.dumps(template))
+
+    assert main([str(template_file), str(batch), "--batch"]) == 0
+    lines = [json.loads(line) for line in
+             capsys.readouterr().out.splitlines()]
+    assert lines == [{"index": i, "result": expected} for i in range(2)]
+
+    assert client.post("/mapper", params={"delta": "diff"},
+                       json=easy_input).status_code == 422
+    assert client.post("/mapper", params={"delta": "values", "stream": True},
+                       json=easy_input).status_code == 422
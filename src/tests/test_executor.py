@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+import pytest
+
+from ..executor import MappingExecutor, Overloaded
+
+
+def test_executor_rejects_when_queue_is_full():
+    executor = MappingExecutor("thread", workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def burst():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        waiting = asyncio.ensure_future(executor.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+        assert (executor.running, executor.waiting) == (1, 1)
+
+        with pytest.raises(Overloaded):
+            await executor.run(lambda: "rejected")
+
+        release.set()
+        return await running, await waiting
+
+    try:
+        assert asyncio.run(burst()) == (True, "done")
+    finally:
+        executor.shutdown()
+
+    stats = executor.stats()
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == 1
+    assert stats["running"] == stats["waiting"] == 0
+    assert stats["wait_seconds_max"] > 0
+
+
+def test_executor_slot():
+    executor = MappingExecutor("thread", workers=1, max_queue=0)
+
+    async def hold_slot():
+        async with executor.slot():
+            assert executor.running == 1
+            with pytest.raises(Overloaded):
+                executor.check_admission()
+        return await executor.run(lambda: "done")
+
+    try:
+        assert asyncio.run(hold_slot()) == "done"
+    finally:
+        executor.shutdown()
+    assert executor.running == 0
+
+
+def test_executor_process_backend():
+    executor = MappingExecutor("process", workers=1, max_queue=0)
+    try:
+        assert asyncio.run(executor.run(sum, [1, 2, 3])) == 6
+    finally:
+        executor.shutdown()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        MappingExecutor("fiber", workers=1, max_queue=0)
+
+
+def test_mapper_overloaded_response(monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    class FullExecutor:
+        async def run(self, function, *args):
+            # main imports the executor module by its top-level name.
+            raise main.Overloaded("10 mapping jobs are waiting")
+
+    monkeypatch.setattr(main, "executor", FullExecutor())
+    client = TestClient(main.app)
+
+    response = client.post("/mapper", json={"metadata": {}, "template": {},
+                                            "mapping": {}})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(
+        main.settings.MAPPER_RETRY_AFTER)
+
+
+def test_extract_overloaded_response(monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    # main imports the executor module by its top-level name.
+    executor = main.MappingExecutor("thread", workers=1, max_queue=0)
+    executor.running = 1
+    monkeypatch.setattr(main, "executor", executor)
+    monkeypatch.setattr(main, "get_profile", lambda name: None)
+    client = TestClient(main.app)
+
+    response = client.post("/mapper/easy/extract", content=b"{}")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(
+        main.settings.MAPPER_RETRY_AFTER)
+    assert executor.stats()["rejected"] == 1
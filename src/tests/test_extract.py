@@ -0,0 +1,107 @@
+import io
+import json
+
+import pytest
+
+from ..extract import ExtractError, StreamingExtractor, extract, needed_paths
+from ..mapper import map_record
+from ..profiles import load_profile
+from ..utils import compile_mapping
+from .conftest import open_json_file
+
+
+@pytest.fixture()
+def easy_profile():
+    return load_profile(
+        "easy", "test-data/test-templates/easy_dataverse_template.json",
+        "test-data/test-mappings/easy-mapping.json")
+
+
+def test_needed_paths():
+    mapping = compile_mapping({
+        "title": ["a.b[0].c", "a.d[*].e"],
+        "author": {"mapping": "authors", "name": ["name"]},
+        "keyword": ["k[-1]"],
+    })
+    needed = needed_paths(mapping)
+
+    a = needed.keys["a"]
+    assert a.keys["b"].indexes[0].keys["c"].full
+    assert a.keys["d"].full
+    assert needed.keys["authors"].full
+    assert needed.keys["k"].full
+
+
+def test_extract_keeps_mapped_values(easy_profile):
+    with open("test-data/input-data/easy-test-metadata.json", "rb") as f:
+        document = f.read()
+
+    # A small chunk size makes tokens cross the chunk boundaries.
+    extracted = extract(io.BytesIO(document), easy_profile.mapping,
+                        chunk_size=7)
+
+    assert len(json.dumps(extracted)) < len(document)
+    assert map_record(extracted, easy_profile.plan,
+                      easy_profile.mapping) == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+
+def test_extract_array_indexes():
+    mapping = compile_mapping({"title": ["a[2].b"]})
+    document = b'{"a": [{"b": 1}, "x", {"b": "\\u00e9", "c": [1]}], "z": 1}'
+
+    extracted = extract(io.BytesIO(document), mapping, chunk_size=3)
+
+    assert extracted == {"a": [None, None, {"b": "é"}]}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 1 << 16])
+def test_extract_strings(chunk_size):
+    mapping = compile_mapping({"title": ["title"], "skipped": ["b.c"]})
+    title = 'x\\"y\\\\"\u00e9' * 10
+    document = json.dumps({"a": title, "title": title, "b": {"d": title}})
+
+    extracted = extract(io.BytesIO(document.encode()), mapping, chunk_size)
+
+    assert extracted == {"title": title, "b": {}}
+
+
+def test_extract_long_string():
+    mapping = compile_mapping({"title": ["title"]})
+    title = "x" * (8 << 20)
+    document = json.dumps({"a": title, "title": title}).encode()
+
+    # A string that spans many chunks is scanned once, not once per chunk.
+    extracted = extract(io.BytesIO(document), mapping, chunk_size=1024)
+
+    assert extracted == {"title": title}
+
+
+@pytest.mark.parametrize("document", [b'{"a": ', b'{"a": 1} x', b'{"a" 1}',
+                                      b'{"title": tru}', b'{"title": "ab',
+                                      b'{"a": "\xff\xfe"}'])
+def test_extract_invalid_json(document):
+    mapping = compile_mapping({"title": ["title"]})
+    with pytest.raises(ExtractError):
+        StreamingExtractor(io.BytesIO(document)).extract(
+            needed_paths(mapping))
+
+
+def test_extract_endpoint(easy_profile, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main, "get_profile", lambda name: easy_profile)
+    client = TestClient(main.app)
+    with open("test-data/input-data/easy-test-metadata.json", "rb") as f:
+        document = f.read()
+
+    response = client.post("/mapper/easy/extract", content=document)
+    assert response.status_code == 200
+    assert response.json() == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    for document in [b'{"a": ', b'{"a": "\xff\xfe"}']:
+        response = client.post("/mapper/easy/extract", content=document)
+        assert response.status_code == 422
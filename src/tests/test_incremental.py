@@ -0,0 +1,73 @@
+import copy
+import json
+
+import pytest
+
+from ..incremental import RemapError, changed_fields, remap
+from ..mapper import map_record
+
+
+def citation_fields(template):
+    return template["datasetVersion"]["metadataBlocks"]["citation"]["fields"]
+
+
+def test_changed_fields(easy_input):
+    template, mapping = easy_input["template"], easy_input["mapping"]
+    new_mapping = dict(mapping, keywordValue=["nothing.here"])
+    new_template = copy.deepcopy(template)
+    citation_fields(new_template)[0]["multiple"] = True
+
+    assert changed_fields(template, mapping, template, mapping) == set()
+    assert changed_fields(template, mapping, template,
+                          new_mapping) == {"keyword"}
+    assert changed_fields(template, mapping, new_template,
+                          mapping) == {"title"}
+
+
+@pytest.mark.parametrize("change", ["mapping", "template", "removed"])
+def test_remap_equals_full_mapping(easy_input, change):
+    metadata, template, mapping = easy_input.values()
+    previous = map_record(metadata, template, mapping)
+    new_template, new_mapping = copy.deepcopy(template), dict(mapping)
+    if change == "mapping":
+        new_mapping["subtitle"] = list(mapping["title"])
+    elif change == "template":
+        citation_fields(new_template).reverse()
+        citation_fields(new_template)[-1].update(multiple=True, value=[])
+    else:
+        del new_mapping["authorName"]
+
+    result, fields = remap(previous, metadata, new_template, new_mapping,
+                           template, mapping)
+
+    assert json.dumps(result) == json.dumps(
+        map_record(metadata, new_template, new_mapping))
+    assert len(fields) == 1
+
+
+def test_remap_invalid_previous(easy_input):
+    metadata, template, mapping = easy_input.values()
+
+    with pytest.raises(RemapError):
+        remap({"title": "x"}, metadata, template, mapping)
+
+
+def test_remap_endpoint(easy_input):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    metadata, template, mapping = easy_input.values()
+    previous = map_record(metadata, template, mapping)
+    new_mapping = dict(mapping, title=list(mapping["subtitle"]))
+    client = TestClient(main.app)
+
+    response = client.post("/mapper/remap", json={
+        "previous": previous, "metadata": metadata, "template": template,
+        "mapping": new_mapping, "previous_mapping": mapping})
+
+    assert response.status_code == 200
+    assert response.json() == map_record(metadata, template, new_mapping)
+    assert client.post("/mapper/remap", json={
+        "previous": {}, "metadata": metadata, "template": template,
+        "mapping": mapping}).status_code == 422
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from .. import json_codec
+from ..json_codec import dumps, loads, parse_input
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_and_loads(use_orjson, monkeypatch):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_codec, "orjson", None)
+    value = {"title": "Café", "values": [1, 2.5, None, True]}
+    assert loads(dumps(value)) == value
+    assert json.loads(dumps(value)) == value
+
+
+def test_dumps_falls_back_to_json():
+    # orjson raises a TypeError for these.
+    value = {"id": 2 ** 70, 1: "key"}
+    assert dumps(value) == b'{"id":1180591620717411303424,"1":"key"}'
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"{not json", None),
+    (b"[]", "must be a JSON object"),
+    (b'{"metadata": {}}', "Missing fields: template, mapping"),
+])
+def test_parse_input_errors(body, message):
+    with pytest.raises(ValueError) as e:
+        parse_input(body)
+    if message:
+        assert message in str(e.value)
+
+
+def test_raw_endpoint(easy_input):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    client = TestClient(main.app)
+
+    response = client.post("/mapper/raw", content=json.dumps(easy_input))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == client.post("/mapper", json=easy_input).json()
+
+    response = client.post("/mapper/raw", content=b'{"metadata": {}}')
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_mapper_large_integer(easy_input, stream):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    client = TestClient(main.app)
+    body = dict(easy_input, metadata={"id": 2 ** 70},
+                mapping={"title": ["id"]})
+
+    response = client.post("/mapper", params={"stream": stream}, json=body)
+    assert response.status_code == 200
+    assert str(2 ** 70) in response.text
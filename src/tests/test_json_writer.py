@@ -0,0 +1,47 @@
+import io
+import json
+
+import pytest
+
+from ..benchmarks.synthetic import synthetic_case
+from ..json_codec import dumps
+from ..json_writer import iter_record_json, write_record_json
+from ..mapper import map_record
+from .conftest import open_json_file
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 1 << 20])
+def test_streamed_json_equals_result(easy_input, chunk_size):
+    metadata, template, mapping = easy_input.values()
+
+    chunks = list(iter_record_json(metadata, template, mapping, chunk_size))
+
+    assert b"".join(chunks) == dumps(map_record(metadata, template, mapping))
+    assert len(chunks) == 1 if chunk_size > 1000 else len(chunks) > 1
+
+
+def test_write_record_json():
+    metadata, template, mapping = synthetic_case(authors=20, compounds=5,
+                                                 depth=3)
+    output = io.BytesIO()
+
+    written = write_record_json(output, metadata, template, mapping,
+                                chunk_size=16)
+
+    assert written == len(output.getvalue())
+    assert json.loads(output.getvalue()) == map_record(metadata, template,
+                                                       mapping)
+
+
+@pytest.mark.parametrize("path", ["/mapper?stream=true", "/mapper"])
+def test_stream_endpoint(easy_input, path):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    response = TestClient(main.app).post(path, json=easy_input)
+
+    assert response.status_code == 200
+    assert response.json() == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    assert ("server-timing" in response.headers) == ("stream" not in path)
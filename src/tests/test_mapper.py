@@ -1,11 +1,7 @@
-import json
 import pytest
 from ..mapper import MetadataMapper
-
-
-def open_json_file(json_path):
-    with open(json_path) as f:
-        return json.load(f)
+from ..plan import FieldPlan
+from .conftest import open_json_file
 
 
 def _create_mapper(
@@ -386,3 +382,140 @@ def test_map_object_onto_compound_multiple_objects_with_missing_values():
 
     result = mapper.map_object_onto_compound(variable_compound)
     assert result == expected_result
+
+
+def test_template_is_not_changed():
+    """Test that the same template can be used to map several records."""
+    template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    mapping = open_json_file("test-data/test-mappings/easy-mapping.json")
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+    expected_result = open_json_file(
+        "test-data/expected-result-data/easy-result.json"
+    )
+
+    for _ in range(2):
+        mapper = MetadataMapper(metadata, template, mapping)
+        assert mapper.map_metadata() == expected_result
+
+    assert template == open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+
+
+def test_prune_empty_fields():
+    """Test that pruning while mapping equals removing empty fields after."""
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+    template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    mapping = open_json_file("test-data/test-mappings/easy-mapping.json")
+
+    mapper = MetadataMapper(metadata, template, mapping,
+                            prune_empty_fields=True)
+
+    expected_clean_result = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json"
+    )
+    assert mapper.map_metadata() == expected_clean_result
+
+
+def test_remove_empty_compound_objects(simple_test_mapper):
+    """Test that compound objects without values are removed."""
+    simple_test_mapper.template = {
+        "datasetVersion": {"metadataBlocks": {"citation": {"fields": [{
+            "typeName": "compoundMultipleObject",
+            "multiple": True,
+            "typeClass": "compound",
+            "value": [
+                {"firstMultipleObject": {
+                    "typeName": "firstMultipleObject", "multiple": False,
+                    "typeClass": "primitive", "value": ""}},
+                {"firstMultipleObject": {
+                    "typeName": "firstMultipleObject", "multiple": False,
+                    "typeClass": "primitive", "value": "value"}}
+            ]
+        }, {
+            "typeName": "compoundEmptyObjects",
+            "multiple": True,
+            "typeClass": "compound",
+            "value": [
+                {"emptyObject": {
+                    "typeName": "emptyObject", "multiple": False,
+                    "typeClass": "primitive", "value": ""}}
+            ]
+        }]}}}
+    }
+    simple_test_mapper.remove_empty_fields()
+
+    fields = simple_test_mapper.template["datasetVersion"]["metadataBlocks"][
+        "citation"]["fields"]
+    assert [field["typeName"] for field in fields] == [
+        "compoundMultipleObject"]
+    assert fields[0]["value"] == [
+        {"firstMultipleObject": {
+            "typeName": "firstMultipleObject", "multiple": False,
+            "typeClass": "primitive", "value": "value"}}
+    ]
+
+
+def test_create_result_dict_list_uneven_lists():
+    """Test that rows of lists of different lengths keep the child order."""
+    children = {
+        key: FieldPlan({"typeName": key, "multiple": False,
+                        "typeClass": "primitive", "value": ""})
+        for key in ("name", "affiliation")
+    }
+    list_dict = {"name": ["a", "", "c"], "affiliation": ["x"]}
+
+    rows = MetadataMapper.create_result_dict_list(list_dict, children)
+    pruned = MetadataMapper.create_result_dict_list(
+        {"name": ["", "b"], "affiliation": [""]}, children, prune=True)
+
+    assert [list(row) for row in rows] == [["name", "affiliation"],
+                                           ["name"], ["name"]]
+    assert rows[0]["affiliation"]["value"] == "x"
+    assert rows[1]["name"]["value"] == ""
+    assert [row["name"]["value"] for row in pruned] == ["b"]
+
+
+def test_sparse_mapping_equals_full_mapping():
+    """Test that visiting only mapped fields gives the same result."""
+    def primitive(type_name, value=""):
+        return {"typeName": type_name, "multiple": False,
+                "typeClass": "primitive", "value": value}
+
+    fields = [primitive(f"unmapped{index}") for index in range(50)]
+    fields += [
+        primitive("title"),
+        primitive("license", "CC0"),
+        {"typeName": "author", "multiple": True, "typeClass": "compound",
+         "value": [{"authorName": primitive("authorName"),
+                    "authorRole": primitive("authorRole", "creator")}]},
+        {"typeName": "contact", "multiple": True, "typeClass": "compound",
+         "value": [{"contactName": primitive("contactName")}]},
+    ]
+    template = {"datasetVersion": {
+        "datasetPersistentId": "",
+        "license": "",
+        "metadataBlocks": {
+            "citation": {"displayName": "Citation", "fields": fields},
+            "custom": {"fields": [primitive("unmappedCustom")]},
+        }
+    }}
+    mapping = {"datasetPersistentId": ["id"], "title": ["title"],
+               "authorName": ["authors[*]"], "missing": ["nothing"]}
+    metadata = {"id": "doi:1", "title": "A title", "authors": ["a", "b"]}
+
+    mapper = MetadataMapper(metadata, template, mapping)
+    mapper.map_metadata()
+    mapper.remove_empty_fields()
+    sparse_mapper = MetadataMapper(metadata, template, mapping,
+                                   prune_empty_fields=True)
+
+    assert sparse_mapper.map_metadata() == mapper.template
+    assert sparse_mapper.plan.field_index["authorRole"] == (
+        ("citation", 52),)
+    assert sparse_mapper.plan.field_index["datasetPersistentId"] == (
+        (None, "datasetPersistentId"),)
+    header_keys, positions = sparse_mapper.plan.mapped_fields(mapping)
+    assert header_keys == ["datasetPersistentId"]
+    assert positions == {"citation": [50, 51, 52], "custom": []}
@@ -0,0 +1,67 @@
+import pickle
+
+import pytest
+
+from ..metrics import PhaseMetrics
+from ..profiles import ProfileRegistry
+from ..timing import Timings
+from .conftest import open_json_file
+
+
+def test_timings():
+    timings = Timings()
+    with timings.measure("blocks"):
+        pass
+    timings.add("compounds", 0.002)
+    timings.add("compounds", 0.001)
+
+    worker_timings = pickle.loads(pickle.dumps(Timings("easy")))
+    worker_timings.add("serialize", 0.0005)
+    timings.merge(worker_timings)
+
+    assert list(timings.phases) == ["blocks", "compounds", "serialize"]
+    assert timings.label == "easy"
+    assert "compounds;dur=3.000" in timings.server_timing()
+
+
+def test_phase_metrics():
+    metrics = PhaseMetrics(max_labels=1, buckets=(0.001, 0.01))
+    for label, seconds in [("easy", 0.0005), ("easy", 0.005),
+                           ("cbs", 0.05)]:
+        timings = Timings(label)
+        timings.add("blocks", seconds)
+        metrics.observe(timings)
+
+    lines = metrics.render().splitlines()
+    assert 'mapper_phase_seconds_bucket{phase="blocks",profile="easy",' \
+           'le="0.001"} 1' in lines
+    assert 'mapper_phase_seconds_bucket{phase="blocks",profile="easy",' \
+           'le="0.01"} 2' in lines
+    assert 'mapper_phase_seconds_count{phase="blocks",profile="easy"} 2' \
+           in lines
+    # Only one label is allowed, so cbs is counted as other.
+    assert 'mapper_phase_seconds_bucket{phase="blocks",profile="other",' \
+           'le="+Inf"} 1' in lines
+
+
+def test_server_timing_and_metrics_endpoint(resources_dir,
+                                            monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main, "profiles", ProfileRegistry(resources_dir))
+    client = TestClient(main.app)
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+
+    response = client.post("/mapper/easy", json={"metadata": metadata})
+    assert response.status_code == 200
+    phases = {entry.split(";")[0] for entry in
+              response.headers["server-timing"].split(", ")}
+    assert phases == {"parse", "execute", "compile", "header", "blocks",
+                      "compounds", "serialize", "total"}
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'phase="blocks",profile="easy"' in response.text
+    assert "server-timing" not in response.headers
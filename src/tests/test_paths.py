@@ -0,0 +1,56 @@
+import jmespath
+import pytest
+
+from ..paths import PathTrie, Resolver, SimplePath, parse_simple_path
+
+
+@pytest.fixture()
+def metadata():
+    return {
+        "result": {
+            "oai_dc:dc": {
+                "dc:title": ["Title 1", "Title 2"],
+                "dc:creator": [{"#text": "Author 1"}, {"#text": "Author 2"}],
+                "dc:date": "2023"
+            }
+        }
+    }
+
+
+def test_parse_simple_path():
+    assert parse_simple_path('result."oai_dc:dc"."dc:title"[0]') == \
+           ("result", "oai_dc:dc", "dc:title", 0)
+    assert parse_simple_path('a[1][-1].b') == ("a", 1, -1, "b")
+
+    # Projections, filters, pipes and unquoted special characters fall back
+    # to jmespath.
+    for path in ['a[*].b', 'a[]', 'a | b', 'a[?b]', 'a:b', '[0].a', 'a.']:
+        assert parse_simple_path(path) is None
+
+
+def test_path_trie_matches_jmespath(metadata):
+    paths = [
+        'result."oai_dc:dc"."dc:title"',
+        'result."oai_dc:dc"."dc:title"[1]',
+        'result."oai_dc:dc"."dc:title"[5]',
+        'result."oai_dc:dc"."dc:creator"[*]."#text"',
+        'result."oai_dc:dc"."dc:date"[0]',
+        'result."oai_dc:dc".missing.path',
+    ]
+    trie = PathTrie()
+    resolver = Resolver(metadata)
+    for path in paths:
+        compiled = trie.compile(path)
+        expected = jmespath.search(path, metadata)
+        assert compiled.search(metadata) == expected
+        assert resolver.search(compiled) == expected
+
+
+def test_path_trie_shares_prefixes():
+    trie = PathTrie()
+    title = trie.compile('result."oai_dc:dc"."dc:title"')
+    date = trie.compile('result."oai_dc:dc"."dc:date"')
+
+    assert isinstance(title, SimplePath)
+    assert title.nodes[:2] == date.nodes[:2]
+    assert title.nodes[2] is not date.nodes[2]
@@ -0,0 +1,99 @@
+import pickle
+
+import pytest
+
+from ..mapper import map_record
+from ..pathstats import PathStats, PathStatsRegistry
+from ..pool import MappingPool
+
+
+def test_path_stats():
+    template = {"datasetVersion": {"metadataBlocks": {"citation": {
+        "fields": [{"typeName": "keyword", "typeClass": "primitive",
+                    "multiple": True, "value": []}]
+    }}}}
+    mapping = {"keyword": ["missing", "keywords"]}
+    path_stats = PathStats("test")
+
+    for metadata in [{"keywords": ["a", "b"]}, {"keywords": ["c"]}]:
+        map_record(metadata, template, mapping, path_stats=path_stats)
+
+    keywords, missing = PathStats.report(
+        pickle.loads(pickle.dumps(path_stats)))
+    assert missing["path"] == "missing"
+    assert missing["evaluations"] == 2
+    assert missing["hit_rate"] == 0
+    assert keywords["path"] == "keywords"
+    assert keywords["hit_rate"] == 1
+    assert keywords["result_size_avg"] == 1.5
+
+
+def test_object_compound_path_stats():
+    template = {"datasetVersion": {"metadataBlocks": {"citation": {
+        "fields": [{"typeName": "author", "typeClass": "compound",
+                    "multiple": True, "value": [{
+                        "authorName": {"typeName": "authorName",
+                                       "typeClass": "primitive",
+                                       "multiple": False, "value": ""}}]}]
+    }}}}
+    mapping = {"author": {"mapping": "authors",
+                          "children": {"authorName": ["name"]}}}
+    path_stats = PathStats("test")
+
+    map_record({"authors": [{"name": "Ann"}, {"name": "Bob"}]}, template,
+               mapping, path_stats=path_stats)
+
+    report = {(path["typeName"], path["path"]): path
+              for path in path_stats.report()}
+    # The path of the objects is counted like the paths of the children.
+    assert report["author", "authors"]["evaluations"] == 1
+    assert report["author", "authors"]["hit_rate"] == 1
+    assert report["authorName", "name"]["evaluations"] == 2
+
+
+def test_path_stats_registry_is_bounded():
+    registry = PathStatsRegistry(2)
+    for label in ["a", "b", "a", "c"]:
+        registry.merge(PathStats(label))
+
+    # The least recently used label is dropped.
+    assert list(registry.report()) == ["a", "c"]
+
+
+def test_pool_path_stats(easy_input, monkeypatch):
+    from .. import pool
+
+    registry = PathStatsRegistry(10)
+    monkeypatch.setattr(pool, "PATH_STATS", registry)
+    records = [easy_input["metadata"]] * 3
+
+    with MappingPool(easy_input["template"], easy_input["mapping"],
+                     workers=2, chunk_size=2, stats_label="easy") as pool:
+        list(pool.map(records))
+
+    report = registry.report()["easy"]
+    assert {path["typeName"] for path in report} == set(easy_input["mapping"])
+    assert all(path["evaluations"] == 3 for path in report)
+
+
+def test_path_stats_endpoint(easy_input, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main.settings, "PATH_STATS", True)
+    client = TestClient(main.app)
+    client.delete("/path-stats")
+
+    client.post("/mapper", json=easy_input)
+    client.post("/mapper", json=easy_input)
+
+    report = client.get("/path-stats").json()
+    assert report["enabled"]
+    (label, paths), = report["mappings"].items()
+    assert label.startswith("mapping:")
+    title, = [path for path in paths if path["typeName"] == "title"]
+    assert title["evaluations"] == 2
+    assert title["hit_rate"] == 1
+
+    assert client.delete("/path-stats").json()["mappings"] == {}
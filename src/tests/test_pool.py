@@ -0,0 +1,99 @@
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from ..batch import map_batch_record
+from ..pool import MappingPool
+from .conftest import open_json_file
+
+
+def test_mapping_pool_keeps_order():
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+    template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    mapping = open_json_file("test-data/test-mappings/easy-mapping.json")
+    records = [metadata, b"{not json", metadata, metadata, metadata]
+
+    with MappingPool(template, mapping, workers=2, chunk_size=2) as pool:
+        lines = list(pool.map(records))
+
+    expected_lines = [
+        map_batch_record(index, record, template, mapping)
+        for index, record in enumerate(records)
+    ]
+    assert lines == expected_lines
+    assert "error" in json.loads(lines[1])
+
+
+def test_shared_executor():
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+    template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    mapping = open_json_file("test-data/test-mappings/easy-mapping.json")
+    other_mapping = {"title": ["title"]}
+    records = [metadata] * 5
+
+    async def records_async():
+        for record in records:
+            yield record
+
+    async def map_async(pool):
+        return [line async for line in pool.map_async(records_async())]
+
+    with ProcessPoolExecutor(2) as executor:
+        # Two batches with another mapping share the workers.
+        with MappingPool(template, mapping, workers=2, chunk_size=2,
+                         executor=executor) as pool, \
+                MappingPool(template, other_mapping, workers=2, chunk_size=2,
+                            executor=executor) as other_pool:
+            lines = list(pool.map(records))
+            other_lines = asyncio.run(map_async(other_pool))
+        # Closing a pool leaves the shared executor running.
+        assert executor.submit(len, "abc").result() == 3
+
+    assert lines == [map_batch_record(index, record, template, mapping)
+                     for index, record in enumerate(records)]
+    assert other_lines == [
+        map_batch_record(index, record, template, other_mapping)
+        for index, record in enumerate(records)]
+
+
+@pytest.fixture()
+def batch_executor(monkeypatch):
+    pytest.importorskip("httpx")
+    from .. import main
+    from ..executor import MappingExecutor
+
+    batch_executor = MappingExecutor("process", 2, 0)
+    monkeypatch.setattr(main, "batch_executor", batch_executor)
+    yield batch_executor
+    batch_executor.shutdown()
+
+
+def test_batch_endpoint_shares_workers(batch_executor):
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    body = {"metadata": [open_json_file(
+                "test-data/input-data/easy-test-metadata.json")] * 3,
+            "template": open_json_file(
+                "test-data/test-templates/easy_dataverse_template.json"),
+            "mapping": open_json_file(
+                "test-data/test-mappings/easy-mapping.json")}
+    expected = open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    with TestClient(main.app) as client:
+        shared = batch_executor.executor
+        for _ in range(2):
+            response = client.post("/mapper/batch", json=body)
+            assert [json.loads(line) for line in
+                    response.text.splitlines()] == \
+                [{"index": i, "result": expected} for i in range(3)]
+        # Both batches were mapped by the pool started with the server.
+        assert shared is not None
+        assert batch_executor.executor is shared
+    # The pool is shut down with the server.
+    assert batch_executor.executor is None
@@ -0,0 +1,112 @@
+import shutil
+import time
+from pathlib import Path
+
+import pytest
+
+from ..mapper import map_record
+from ..profiles import ProfileRegistry, find_profiles, load_sample
+from .conftest import open_json_file
+
+
+def test_find_profiles(resources_dir):
+    assert list(find_profiles(resources_dir)) == ["easy"]
+
+
+def test_profile_mapping(resources_dir):
+    registry = ProfileRegistry(resources_dir)
+    profile = registry.get("easy")
+    master_template = open_json_file(
+        "test-data/test-templates/easy_dataverse_template.json")
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+
+    result = map_record(metadata, profile.plan, profile.mapping)
+
+    assert result == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+    assert profile.template == master_template
+    assert registry.get("easy") is profile
+
+    with pytest.raises(KeyError):
+        registry.get("liss-old")
+
+
+def test_profile_endpoint(resources_dir, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main, "profiles", ProfileRegistry(resources_dir))
+    client = TestClient(main.app)
+    metadata = open_json_file("test-data/input-data/easy-test-metadata.json")
+
+    response = client.post("/mapper/easy", json={"metadata": metadata})
+    assert response.status_code == 200
+    assert response.json() == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    response = client.post("/mapper/unknown", json={"metadata": metadata})
+    assert response.status_code == 404
+
+
+def test_warm_up(resources_dir):
+    (Path(resources_dir) / "samples").mkdir()
+    shutil.copy("test-data/input-data/easy-test-metadata.json",
+                Path(resources_dir) / "samples" / "easy-sample.json")
+    registry = ProfileRegistry(resources_dir)
+
+    assert registry.warm_up() == (["easy"], {})
+    assert "easy" in registry._profiles
+    assert load_sample(resources_dir, "easy")
+    assert load_sample(resources_dir, "cbs") == {}
+    # The service bundles a sample of every known profile.
+    assert load_sample(resources_dir, "cbs", "samples")
+
+
+def test_warm_up_skips_broken_profile(resources_dir):
+    shutil.copy("test-data/test-templates/easy_dataverse_template.json",
+                Path(resources_dir) / "templates" /
+                "broken_dataverse_template.json")
+    (Path(resources_dir) / "mappings" / "broken-mapping.json").write_text(
+        "{not json")
+    registry = ProfileRegistry(resources_dir, samples_dir="samples")
+
+    warmed, failed = registry.warm_up()
+
+    assert warmed == ["easy"]
+    assert list(failed) == ["broken"]
+    assert failed["broken"].startswith("JSONDecodeError")
+
+
+def test_ready_endpoint(resources_dir, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main, "profiles", ProfileRegistry(resources_dir))
+    monkeypatch.setattr(main, "readiness", main.Readiness())
+    monkeypatch.setattr(main.settings, "WARM_UP_RETRY_DELAY", 0)
+    # The first warm-up fails and is tried again.
+    executor_start = main.executor.start
+    calls = []
+
+    def start():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("workers")
+        executor_start()
+
+    monkeypatch.setattr(main.executor, "start", start)
+    assert TestClient(main.app).get("/ready").status_code == 503
+
+    # The lifespan of the app runs the warm-up.
+    with TestClient(main.app) as client:
+        for _ in range(100):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+    assert response.status_code == 200
+    assert response.json() == {"ready": True, "profiles": ["easy"],
+                               "failed": {}, "error": None}
+    assert len(calls) == 2
@@ -0,0 +1,111 @@
+import pytest
+
+from ..result_cache import (MemoryResultCache, SQLiteResultCache,
+                            etag_matches, result_key)
+from .conftest import open_json_file
+
+
+def test_result_key():
+    assert result_key("a", "b") == result_key("a", "b")
+    assert result_key("a", "b") != result_key("ab", "")
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"x"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_memory_result_cache_limits():
+    cache = MemoryResultCache(maxsize=2, max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+
+    # Too many entries, b is the least recently used.
+    cache.set("c", b"cc")
+    assert cache.get("b") is None
+    # Too many bytes, a is evicted.
+    cache.set("d", b"dddddddd")
+    assert cache.get("a") is None
+    assert cache.get("d") == b"dddddddd"
+    # Larger than max_bytes, not cached at all.
+    cache.set("e", b"e" * 11)
+    assert cache.get("e") is None
+
+    stats = cache.stats()
+    assert (stats["size"], stats["bytes"]) == (2, 10)
+    assert stats["evictions"] == 2
+
+
+def test_sqlite_result_cache(tmp_path):
+    path = str(tmp_path / "cache" / "results.sqlite3")
+    cache = SQLiteResultCache(path, maxsize=2, max_bytes=100)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    cache.set("a", b"aaaa")
+    cache.set("c", b"cc")
+    assert cache.get("b") is None
+
+    # The results survive a restart.
+    cache = SQLiteResultCache(path, maxsize=2, max_bytes=100)
+    assert cache.get("a") == b"aaaa"
+    assert cache.stats()["bytes"] == 6
+    cache.clear()
+    assert cache.get("c") is None
+
+
+def test_sqlite_result_cache_shared(tmp_path):
+    # Two server processes that share the database file.
+    path = str(tmp_path / "results.sqlite3")
+    first = SQLiteResultCache(path, maxsize=2, max_bytes=100)
+    second = SQLiteResultCache(path, maxsize=2, max_bytes=100)
+    first.set("a", b"aaaa")
+    first.set("b", b"bbbb")
+
+    second.set("c", b"cc")
+
+    assert first.get("a") is None
+    assert first.stats()["size"] == second.stats()["size"] == 2
+    assert first.stats()["bytes"] == 6
+
+
+def test_mapper_etag(monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    monkeypatch.setattr(main, "result_cache",
+                        MemoryResultCache(maxsize=10, max_bytes=2 ** 20))
+    client = TestClient(main.app)
+    body = {
+        "metadata": open_json_file(
+            "test-data/input-data/easy-test-metadata.json"),
+        "template": open_json_file(
+            "test-data/test-templates/easy_dataverse_template.json"),
+        "mapping": open_json_file("test-data/test-mappings/easy-mapping.json")
+    }
+
+    response = client.post("/mapper", json=body)
+    etag = response.headers["etag"]
+    assert response.json() == open_json_file(
+        "test-data/expected-result-data/easy-clean-result.json")
+
+    not_modified = client.post("/mapper", json=body,
+                               headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+
+    cached = client.post("/mapper", json=body)
+    assert cached.content == response.content
+    assert cached.headers["etag"] == etag
+    assert client.get("/result-cache").json()["hits"] == 1
+    # A cached result is counted, not labelled as a profile.
+    metrics = client.get("/metrics").text
+    assert 'mapper_result_cache_lookups_total{result="hit"} 1' in metrics
+    assert 'profile="cache"' not in metrics
+
+    body["metadata"] = {}
+    assert client.post("/mapper", json=body).headers["etag"] != etag
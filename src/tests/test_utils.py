@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from ..cache import LRUCache, content_hash
+from ..utils import (CompiledMapping, MappingError, compile_mapping,
+                     drill_down)
+
+
+@pytest.fixture()
+def mapping():
+    return {
+        "title": ["result.ddi:titl.#text"],
+        "variable": {
+            "mapping": "result.variables[*]",
+            "children": {"variableName": ["name"]}
+        }
+    }
+
+
+def test_compile_mapping(mapping):
+    metadata = {
+        "result": {
+            "ddi:titl": {"#text": "A title"},
+            "variables": [{"name": "var1"}, {"name": "var2"}]
+        }
+    }
+    compiled = compile_mapping(mapping)
+
+    assert isinstance(compiled, CompiledMapping)
+    assert drill_down(metadata, compiled["title"][0]) == "A title"
+    variables = drill_down(metadata, compiled["variable"]["mapping"])
+    child_path = compiled["variable"]["children"]["variableName"][0]
+    assert [drill_down(v, child_path) for v in variables] == ["var1", "var2"]
+
+    # The mapping given to the compiler is left untouched.
+    assert mapping["title"] == ["result.ddi:titl.#text"]
+
+
+def test_compile_invalid_path():
+    compiled = compile_mapping({"title": ["title"], "unused": ["a..b"],
+                                "variable": {"mapping": "variables",
+                                             "children": {"name": ["a[b"]}}})
+
+    assert drill_down({"title": "A title"}, compiled["title"][0]) == \
+        "A title"
+    # The invalid path only fails when it is searched.
+    with pytest.raises(MappingError, match="'a..b' of mapping key 'unused'"):
+        drill_down({}, compiled["unused"][0])
+    with pytest.raises(MappingError, match="mapping key 'variable.name'"):
+        drill_down({}, compiled["variable"]["children"]["name"][0])
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("mapping, status_code", [
+    ({"title": ["title"], "unused": ["a..b"]}, 200),
+    ({"title": ["a..b"]}, 422),
+])
+def test_mapper_invalid_path(mapping, status_code, stream):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from .. import main
+
+    with open("test-data/test-templates/easy_dataverse_template.json") as f:
+        template = json.load(f)
+    body = {"metadata": {"title": "A title"}, "template": template,
+            "mapping": mapping}
+    # A streamed response is started after its first chunk is mapped.
+    response = TestClient(main.app).post("/mapper", params={"stream": stream},
+                                         json=body)
+
+    assert response.status_code == status_code
+    if status_code == 422:
+        assert response.json()["detail"].startswith(
+            "Invalid path 'a..b' of mapping key 'title'")
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == \
+           content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_lru_cache_counters():
+    cache = LRUCache(maxsize=2)
+    cache.get_or_create("a", lambda: 1)
+    cache.get_or_create("b", lambda: 2)
+    assert cache.get_or_create("a", lambda: 3) == 1
+    cache.get_or_create("c", lambda: 4)
+
+    # "b" was the least recently used entry, so it was evicted.
+    assert cache.get_or_create("b", lambda: 5) == 5
+    assert cache.stats() == {
+        "size": 2, "maxsize": 2, "hits": 1, "misses": 4, "evictions": 2
+    }
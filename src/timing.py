@@ -0,0 +1,88 @@
+from time import perf_counter
+
+
+class Phase:
+    """ Measures a phase while it is used as a context manager. """
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name: str):
+        self.timings = timings
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, perf_counter() - self.start)
+
+
+class NoPhase:
+    """ A phase that measures nothing, used when timing is turned off. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+class Timings:
+    """ The time spent in every phase of a single mapping request.
+
+    Phases with the same name are added up, so a phase that runs once per
+    compound field reports the total time of all compound fields. Timings
+    are picklable, so they can be returned by a worker process.
+
+    Attributes
+    ----------
+    phases:
+        The seconds spent per phase name, in the order they first ended.
+    label:
+        The profile or template the request was mapped with, or None.
+    start:
+        The perf_counter value when the timings were created.
+    """
+    __slots__ = ("phases", "label", "start")
+
+    def __init__(self, label: str = None):
+        self.phases = {}
+        self.label = label
+        self.start = perf_counter()
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def measure(self, name: str) -> Phase:
+        return Phase(self, name)
+
+    def merge(self, other):
+        """ Adds the phases of other, and takes its label if it has one. """
+        for name, seconds in other.phases.items():
+            self.add(name, seconds)
+        if other.label is not None:
+            self.label = other.label
+
+    def server_timing(self) -> str:
+        """ Returns the phases as the value of a Server-Timing header. """
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}"
+                         for name, seconds in self.phases.items())
+
+
+class NoTimings:
+    """ Timings that record nothing, for mappings that are not measured. """
+    __slots__ = ()
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def measure(self, name: str) -> NoPhase:
+        return NO_PHASE
+
+
+NO_TIMINGS = NoTimings()
@@ -1,7 +1,68 @@
+import copy
+
 import jmespath
+from jmespath.exceptions import JMESPathError
+
+import settings
+from cache import LRUCache, content_hash
+from paths import PathTrie
 
 SPECIAL_CHARACTERS_LIST = [":", "@", "#"]
 
+MAPPING_CACHE = LRUCache(settings.MAPPING_CACHE_SIZE)
+
+
+class CompiledMapping(dict):
+    """ A cleaned mapping where every path is compiled.
+
+    Simple paths are compiled to a SimplePath in a trie shared by all paths
+    of the mapping, other paths are compiled jmespath expressions.
+
+    It has the same shape as the mapping it was compiled from, so it can be
+    used anywhere a mapping is expected.
+
+    Attributes
+    ----------
+    digest:
+        The content hash of the mapping before it was cleaned and compiled.
+    """
+
+    def __init__(self, compiled: dict, digest: str):
+        super().__init__(compiled)
+        self.digest = digest
+
+
+class MappingError(ValueError):
+    """ Raised when a path of a mapping that is searched is not valid. """
+
+
+class InvalidPath:
+    """ A path of a mapping that could not be compiled.
+
+    A mapping with an invalid path still compiles, so a mapping key that the
+    template does not use can have one. Searching the path raises a
+    MappingError that names the key and the path.
+
+    Attributes
+    ----------
+    expression:
+        The cleaned path.
+    key:
+        The mapping key of the path.
+    error:
+        Why the path could not be compiled.
+    """
+    __slots__ = ("expression", "key", "error")
+
+    def __init__(self, expression: str, key: str, error: str):
+        self.expression = expression
+        self.key = key
+        self.error = error
+
+    def search(self, data):
+        raise MappingError(f"Invalid path {self.expression!r} of mapping key "
+                           f"{self.key!r}: {self.error}")
+
 
 def drill_down(metadata_json, path):
     """
@@ -10,11 +71,12 @@ def drill_down(metadata_json, path):
     This method assumes that the paths have been cleaned.
 
     :param metadata_json: metadata in json format
-    :param path: string
+    :param path: string or compiled expression
     :return: string or list
     """
-    value = jmespath.search(path, metadata_json)
-    return value
+    if isinstance(path, str):
+        return jmespath.search(path, metadata_json)
+    return path.search(metadata_json)
 
 
 def clean_mapping(mapping):
@@ -38,6 +100,85 @@ def clean_mapping(mapping):
     return mapping
 
 
+def compile_path(path, trie, key):
+    """
+    Returns a path compiled by the given trie, or an InvalidPath.
+
+    :param path: a cleaned path
+    :param trie: the PathTrie of the object the path is searched in.
+    :param key: the mapping key of the path.
+    """
+    try:
+        return trie.compile(path)
+    except JMESPathError as e:
+        return InvalidPath(path, key, str(e).splitlines()[0])
+
+
+def compile_paths(path_list, trie, key):
+    """
+    Returns the paths in a list of paths compiled by the given trie.
+
+    :param path_list: list of cleaned paths
+    :param trie: the PathTrie of the object the paths are searched in.
+    :param key: the mapping key of the paths.
+    :return: list of compiled paths
+    """
+    return [compile_path(path, trie, key) for path in path_list]
+
+
+def compile_mapping(mapping, digest=None):
+    """
+    Returns a cleaned copy of the mapping with all paths compiled.
+
+    Object to compound mappings keep their shape, their 'mapping' path and the
+    paths of their 'children' are compiled as well. The paths of the children
+    are searched in the mapped objects, so they get a trie of their own.
+    The given mapping is not changed.
+
+    :param mapping: json
+    :param digest: the content hash of the mapping, if already known.
+    :return: CompiledMapping
+    """
+    if digest is None:
+        digest = content_hash(mapping)
+    cleaned_mapping = clean_mapping(copy.deepcopy(mapping))
+
+    trie = PathTrie()
+    compiled = {}
+    for key, path_list in cleaned_mapping.items():
+        if isinstance(path_list, dict):
+            children_trie = PathTrie()
+            compiled[key] = {
+                "mapping": compile_path(path_list["mapping"], trie, key),
+                "children": {
+                    child: compile_paths(child_paths, children_trie,
+                                         f"{key}.{child}")
+                    for child, child_paths
+                    in path_list.get("children", {}).items()
+                },
+            }
+        else:
+            compiled[key] = compile_paths(path_list, trie, key)
+    return CompiledMapping(compiled, digest)
+
+
+def get_compiled_mapping(mapping):
+    """
+    Returns the compiled mapping, using the mapping cache when possible.
+
+    Mappings are cached by their content hash, so a mapping that is sent
+    with every request is only cleaned and compiled the first time.
+
+    :param mapping: json or CompiledMapping
+    :return: CompiledMapping
+    """
+    if isinstance(mapping, CompiledMapping):
+        return mapping
+    digest = content_hash(mapping)
+    return MAPPING_CACHE.get_or_create(
+        digest, lambda: compile_mapping(mapping, digest))
+
+
 def clean_path(path):
     """
     Returns cleaned path.
@@ -1,6 +1,9 @@
+from functools import lru_cache
+
 import tomli
 
 
+@lru_cache(maxsize=None)
 def get_version():
     with open('stub.toml', 'rb') as file:
         package_details = tomli.load(file)